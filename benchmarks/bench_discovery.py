@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# Measures how long it takes `pls` to discover the sources of a large generated tree, with `"**/*.cc"` in `pls.json`.
+# The tree has `--files` files spread over `--dirs` dirs, half of them sources, plus as many files again in the dirs
+# that should be pruned, `.git`, `.pls`, and `.debug`. The first, cold, discovery is not counted, so the numbers are
+# for the warm file system, which is the case for the repeated runs of `pls build`.
+#
+# Usage: python3 benchmarks/bench_discovery.py [--files 50000] [--dirs 500] [--runs 10] [--max-seconds 1] [--json]
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+
+def make_tree(root, files, dirs):
+    files_per_dir = max(1, files // dirs)
+    for d in range(dirs):
+        # Nested three levels deep, as in `module_7/component_3/part_42`.
+        rel_dir = os.path.join(f"module_{d % 10}", f"component_{d // 10 % 10}", f"part_{d}")
+        for pruned_dir in ["", ".git/objects", ".pls/deps/lib", ".debug/CMakeFiles"]:
+            full_dir = os.path.join(root, pruned_dir, rel_dir)
+            os.makedirs(full_dir)
+            for f in range(files_per_dir):
+                with open(os.path.join(full_dir, f"file_{f}.cc" if f % 2 == 0 else f"file_{f}.h"), "w") as file:
+                    file.write("int main() {}\n")
+    with open(os.path.join(root, "pls.json"), "w") as file:
+        file.write('{"sources": {"include": ["**/*.cc"]}}')
+    return dirs * files_per_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the source discovery of `pls`.")
+    parser.add_argument("--files", type=int, default=50000, help="The number of files in the tree, 50000 by default.")
+    parser.add_argument("--dirs", type=int, default=500, help="The number of dirs in the tree, 500 by default.")
+    parser.add_argument("--runs", type=int, default=10, help="The number of measured runs, 10 by default.")
+    parser.add_argument("--max-seconds", type=float, help="Fail if the median run takes longer than this.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="pls_bench_discovery_")
+    try:
+        total_files = make_tree(root, args.files, args.dirs)
+        # `pls.cmd` parses the command line, and looks at the current dir, as it is imported.
+        sys.argv = [sys.argv[0]]
+        os.chdir(root)
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import pls.cmd as pls_cmd
+
+        sources = pls_cmd.list_sources_in_dir(root)
+        times = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            pls_cmd.list_sources_in_dir(root)
+            times.append(time.perf_counter() - start)
+    finally:
+        os.chdir("/")
+        shutil.rmtree(root)
+
+    results = {
+        "files": total_files,
+        "pruned_files": 3 * total_files,
+        "sources": len(sources),
+        "runs": args.runs,
+        "median_seconds": statistics.median(times),
+        "min_seconds": min(times),
+        "max_seconds": max(times),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"Discovered {results['sources']} sources among {results['files']} files.")
+        median, fastest, slowest = results["median_seconds"], results["min_seconds"], results["max_seconds"]
+        print(f"Median {median:.3f}s, min {fastest:.3f}s, max {slowest:.3f}s.")
+    if args.max_seconds is not None and results["median_seconds"] > args.max_seconds:
+        print(f"The median of {results['median_seconds']:.3f}s is over {args.max_seconds}s.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
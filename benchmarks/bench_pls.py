@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# Measures the overhead of `pls` itself, on synthetic projects with `--files` sources in `--dirs` dirs, importing
+# a `--depth` levels deep and `--width` wide DAG of dependencies, each level importing every dependency of the next one.
+# The dependencies are local git repos, served via `PLS_INJECT_GITHUB`. The sources other than `main.cc` are named
+# `lib_*.cc`, so that `pls` scans them all, but does not build them, and the dependencies are header-only.
+#
+# For `install` and `build`, the timings are cold, with the shared cache empty, warm, for a fresh copy of the project
+# with the shared cache populated, and no-op, for running the same command again. For `clean`, they are of cleaning
+# the built project, and of cleaning it again, and for `version`, of the startup. Each `pls` run is traced with
+# `--profile`, and besides the wall time, the time of `pls` itself is reported, which excludes the time of `cmake`,
+# and thus of the compiler. The lists, as in `--files 100,1000`, measure every combination, to see how `pls` scales.
+#
+# Usage: python3 benchmarks/bench_pls.py [--files 200] [--dirs 10] [--depth 3] [--width 3] [--runs 3]
+#                                        [--output results.json] [--json] [--compare baseline.json] [--threshold 20]
+
+import argparse
+import itertools
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PLS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pls")
+PLS_CMD_PY = os.path.join(PLS_DIR, "cmd.py")
+
+
+def git(repo_dir, *args):
+    command = ["git", "-C", repo_dir, "-c", "user.name=pls", "-c", "user.email=pls@localhost", *args]
+    subprocess.run(command, check=True, capture_output=True)
+
+
+def write_files(root, files):
+    for name, contents in files.items():
+        path = os.path.join(root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            file.write(contents)
+
+
+def dependency_names(depth, width):
+    return [[f"dep_{level}_{i}" for i in range(width)] for level in range(depth)]
+
+
+def make_dependencies(github_dir, depth, width):
+    levels = dependency_names(depth, width)
+    for level, names in enumerate(levels):
+        imports = levels[level + 1] if level + 1 < depth else []
+        for name in names:
+            repo_dir = os.path.join(github_dir, "dkorolev", name)
+            cmakelists_txt = f"cmake_minimum_required(VERSION 3.14.1)\nproject({name} CXX)\n"
+            cmakelists_txt += "".join(f"add_subdirectory({lib})\n" for lib in imports)
+            cmakelists_txt += f"add_library({name} INTERFACE)\n"
+            cmakelists_txt += f"target_include_directories({name} INTERFACE ${{CMAKE_CURRENT_SOURCE_DIR}})\n"
+            if imports:
+                cmakelists_txt += f"target_link_libraries({name} INTERFACE {' '.join(imports)})\n"
+            header = "#pragma once\n" + "".join(f'#include "{lib}.h"\n' for lib in imports)
+            header += f"inline int {name}() {{ return 1{''.join(f' + {lib}()' for lib in imports)}; }}\n"
+            pls_json = {"import": {lib: f"https://github.com/dkorolev/{lib}" for lib in imports}}
+            write_files(
+                repo_dir,
+                {"CMakeLists.txt": cmakelists_txt, f"{name}.h": header, "pls.json": json.dumps(pls_json)},
+            )
+            git(repo_dir, "init", "-q")
+            git(repo_dir, "add", "-A")
+            git(repo_dir, "commit", "-qm", "Synthetic dependency.")
+    return levels[0] if levels else []
+
+
+def make_project(project_dir, files, dirs, top_dependencies):
+    def pls_import(lib):
+        return f'PLS_IMPORT("{lib}", "https://github.com/dkorolev/{lib}");\n'
+
+    sources = {"pls.json": json.dumps({"sources": {"include": ["*.cc", "src/**/*.cc"]}})}
+    main_cc = '#include <cstdio>\n#include <vector>\n#include "pls.h"\n'
+    main_cc += "".join(pls_import(lib) for lib in top_dependencies)
+    main_cc += "".join(f'#include "{lib}.h"\n' for lib in top_dependencies)
+    main_cc += f"int main() {{ std::printf(\"%d\\n\", 0{''.join(f' + {lib}()' for lib in top_dependencies)}); }}\n"
+    sources["main.cc"] = main_cc
+    for i in range(files - 1):
+        source = '#include <vector>\n#include "pls.h"\n'
+        if top_dependencies:
+            source += pls_import(top_dependencies[i % len(top_dependencies)])
+        sources[f"src/dir_{i % dirs}/lib_{i}.cc"] = source + f"int lib_{i}() {{ return {i}; }}\n"
+    write_files(project_dir, sources)
+
+
+def cmake_seconds(trace_json):
+    # The time spent running `cmake`, to configure and to build, which is not the overhead of `pls` itself.
+    with open(trace_json, "r") as file:
+        events = json.loads(file.read())["traceEvents"]
+    return sum(event["dur"] for event in events if event.get("ph") == "X" and event["cat"] == "cmake") / 1e6
+
+
+class Bench:
+    def __init__(self, root, github_dir, template_dir):
+        self.root = root
+        self.github_dir = github_dir
+        self.template_dir = template_dir
+        self.counter = itertools.count()
+        self.env = {key: value for key, value in os.environ.items() if not key.startswith("PLS_")}
+        self.env["PLS_INJECT_GITHUB"] = github_dir
+
+    def fresh_cache_dir(self):
+        return os.path.join(self.root, f"cache_{next(self.counter)}")
+
+    def fresh_project(self):
+        project_dir = os.path.join(self.root, f"project_{next(self.counter)}")
+        shutil.copytree(self.template_dir, project_dir)
+        return project_dir
+
+    def pls(self, project_dir, cache_dir, *args):
+        # Returns the wall time, and the time of `pls` itself, in seconds.
+        trace_json = os.path.join(self.root, "trace.json")
+        command = [sys.executable, PLS_CMD_PY, f"--profile={trace_json}", *args]
+        env = {**self.env, "PLS_CACHE_DIR": cache_dir}
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=project_dir, env=env, capture_output=True, text=True)
+        wall = time.perf_counter() - start
+        if result.returncode != 0:
+            sys.exit(f"`pls {' '.join(args)}` failed in `{project_dir}`:\n{result.stdout}{result.stderr}")
+        pls_seconds = wall - cmake_seconds(trace_json) if os.path.isfile(trace_json) else wall
+        if os.path.isfile(trace_json):
+            os.unlink(trace_json)
+        return wall, pls_seconds
+
+    def measure(self, command, runs):
+        timings = {}
+        if command == "version":
+            project_dir, cache_dir = self.fresh_project(), self.fresh_cache_dir()
+            timings["startup"] = [self.pls(project_dir, cache_dir, "version") for _ in range(runs)]
+            return timings
+        warm_cache_dir = self.fresh_cache_dir()
+        self.pls(self.fresh_project(), warm_cache_dir, "install")
+        for scenario in ["cold", "warm", "noop"] if command != "clean" else ["built", "noop"]:
+            timings[scenario] = []
+            for _ in range(runs):
+                project_dir = self.fresh_project()
+                cache_dir = self.fresh_cache_dir() if scenario == "cold" else warm_cache_dir
+                if command == "clean":
+                    self.pls(project_dir, cache_dir, "build")
+                    if scenario == "noop":
+                        self.pls(project_dir, cache_dir, "clean")
+                elif scenario == "noop":
+                    self.pls(project_dir, cache_dir, command)
+                timings[scenario].append(self.pls(project_dir, cache_dir, command))
+                shutil.rmtree(project_dir)
+                if scenario == "cold":
+                    shutil.rmtree(cache_dir, ignore_errors=True)
+        return timings
+
+
+def summarize(runs):
+    walls = [wall for wall, _ in runs]
+    return {
+        "median_seconds": statistics.median(walls),
+        "min_seconds": min(walls),
+        "max_seconds": max(walls),
+        "median_pls_seconds": statistics.median(pls_seconds for _, pls_seconds in runs),
+    }
+
+
+def int_list(value):
+    try:
+        values = [int(v) for v in value.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expecting a number or a comma-separated list of numbers, not `{value}`")
+    if any(v < 0 for v in values):
+        raise argparse.ArgumentTypeError(f"expecting non-negative numbers, not `{value}`")
+    return values
+
+
+def compare(results, baseline, threshold, min_delta):
+    # Returns the number of regressions of the time of `pls` itself, by more than `threshold` percent and more than
+    # `min_delta` seconds, so that the noise in the milliseconds-long runs does not count.
+    baseline_by_params = {json.dumps(entry["params"], sort_keys=True): entry for entry in baseline["results"]}
+    regressions = 0
+    for entry in results["results"]:
+        baseline_entry = baseline_by_params.get(json.dumps(entry["params"], sort_keys=True))
+        if baseline_entry is None:
+            print(f"Not in the baseline: {entry['params']}.")
+            continue
+        for command, scenarios in entry["timings"].items():
+            for scenario, summary in scenarios.items():
+                baseline_summary = baseline_entry["timings"].get(command, {}).get(scenario)
+                if baseline_summary is None:
+                    continue
+                value, baseline_value = summary["median_pls_seconds"], baseline_summary["median_pls_seconds"]
+                change = (value / baseline_value - 1) * 100 if baseline_value > 0 else 0
+                regressed = change > threshold and value - baseline_value > min_delta
+                regressions += regressed
+                print(
+                    f"{entry['params']} {command} {scenario}: {value:.3f}s vs. {baseline_value:.3f}s,"
+                    f" {change:+.1f}%{', REGRESSION' if regressed else ''}."
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the overhead of `pls` on synthetic projects.")
+    parser.add_argument("--files", type=int_list, default=[200], help="The number of sources, 200 by default.")
+    parser.add_argument("--dirs", type=int_list, default=[10], help="The number of dirs with sources, 10 by default.")
+    parser.add_argument("--depth", type=int_list, default=[3], help="The depth of the dependency DAG, 3 by default.")
+    parser.add_argument("--width", type=int_list, default=[3], help="The width of the dependency DAG, 3 by default.")
+    parser.add_argument("--runs", type=int, default=3, help="The number of runs of each measurement, 3 by default.")
+    parser.add_argument("--commands", type=str, default="version,install,build,clean", help="What to measure.")
+    parser.add_argument("--output", type=str, help="Write the results into this file, as JSON.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    parser.add_argument("--compare", type=str, help="Compare to the results saved with `--output` before.")
+    parser.add_argument("--threshold", type=float, default=20.0, help="The regression threshold, 20%% by default.")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="Ignore the changes under this, 0.05s default.")
+    args = parser.parse_args()
+    commands = args.commands.split(",")
+    if args.runs < 1 or not set(commands) <= {"version", "install", "build", "clean"}:
+        parser.error("The runs should be positive, and the commands any of `version`, `install`, `build`, `clean`.")
+    if any(n < 1 for n in args.files + args.dirs):
+        parser.error("There should be at least one source, in at least one dir.")
+
+    with open(os.path.join(PLS_DIR, "static", "version"), "r") as file:
+        version = file.read().strip()
+    results = {"version": version, "python": sys.version.split()[0], "runs": args.runs, "results": []}
+    for files, dirs, depth, width in itertools.product(args.files, args.dirs, args.depth, args.width):
+        params = {"files": files, "dirs": dirs, "depth": depth, "width": width}
+        root = tempfile.mkdtemp(prefix="pls_bench_")
+        try:
+            github_dir = os.path.join(root, "github")
+            top_dependencies = make_dependencies(github_dir, depth, width if depth else 0)
+            template_dir = os.path.join(root, "template")
+            make_project(template_dir, files, dirs, top_dependencies)
+            bench = Bench(root, github_dir, template_dir)
+            timings = {command: bench.measure(command, args.runs) for command in commands}
+        finally:
+            shutil.rmtree(root)
+        entry = {"params": params, "timings": {}}
+        for command, scenarios in timings.items():
+            entry["timings"][command] = {scenario: summarize(runs) for scenario, runs in scenarios.items()}
+        results["results"].append(entry)
+        if not args.json:
+            print(f"With {files} sources in {dirs} dirs, and {depth} levels of {width} dependencies:")
+            for command, scenarios in entry["timings"].items():
+                for scenario, summary in scenarios.items():
+                    print(
+                        f"  {command:<8} {scenario:<8} median {summary['median_seconds']:.3f}s,"
+                        f" min {summary['min_seconds']:.3f}s, max {summary['max_seconds']:.3f}s,"
+                        f" of which `pls` {summary['median_pls_seconds']:.3f}s."
+                    )
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(json.dumps(results, indent=2) + "\n")
+    if args.compare:
+        with open(args.compare, "r") as file:
+            baseline = json.loads(file.read())
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+        if regressions:
+            print(f"{regressions} regressions beyond {args.threshold}%.")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
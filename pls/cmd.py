@@ -1,40 +1,82 @@
 #!/usr/bin/env python3
 
-# TODO(dkorolev): Bugfix that `pls c[lean]` should not try to install any deps!
 # TODO(dkorolev): Make top-level symlinks relative, not absolute!
-# TODO(dkorolev): Add that cache file, to know when to re-scan the sources and when to re-install the deps.
 
 # REMAINS FOR v0.0.1 to be "complete":
 # * Generate the `CMakeLists.txt` if not exists.
 # * Provide the `pls.h` file by this tool.
 # * Wrap each dependency into a singleton.
 # * Basic tests, and a Github action running them.
-# * During the call to `pls clean` it should not `git clone` anything; need to use some state/cache file!
 
 # TODO(dkorolev): Add `setup.py` so that `pls` can be installed into the system via `pip3 install pls`.
 # TODO(dkorolev): Test `--dotpls` for real.
 # TODO(dkorolev): Should `.debug` and `.release` be symlinks to `.pls/.debug` and `.pls/.release`?
-# TODO(dkorolev): CMAKE_BUILD_TYPE, NDEBUG, and test for these.
 # TODO(dkorolev): Add `pls runwithcoredump` ?
 # TODO(dkorolev): Check for broken symlinks, they need to be re-cloned.
 # TODO(dkorolev): Figure out bash/zsh completion.
 
 import os
 import sys
+import shutil
 import subprocess
 import argparse
+import functools
 import json
-from collections import deque
+import re
+import hashlib
+import time
+import threading
+import concurrent.futures
+import ctypes
+import ctypes.util
+import fcntl
+import select
+import signal
+import struct
+import xml.etree.ElementTree
 from collections import defaultdict
 from dataclasses import dataclass, field
 
 parser = argparse.ArgumentParser(description="PLS: The trivial build system for C++ and beyond, v0.01")
 parser.add_argument("--verbose", "-v", action="store_true", help="Increase output verbosity")
 parser.add_argument("--dotpls", type=str, default=".pls", help="The directory to use for output if not `./.pls`.")
+parser.add_argument("--no-cache", action="store_true", help="Do not use or update the scan cache, `.pls/cache.json`.")
+parser.add_argument("--no-native-scan", action="store_true", help="Always use `g++ -E` to find the `PLS_*` commands.")
+parser.add_argument("--jobs", "-j", type=int, help="The number of parallel jobs, `PLS_JOBS` or the CPU count.")
+parser.add_argument("--no-git-cache", action="store_true", help="Clone the dependencies directly, bypassing the cache.")
+parser.add_argument("--all-configs", action="store_true", help="Build `.debug` and `.release` at once, concurrently.")
+parser.add_argument("--release", action="store_true", help="Build and run the optimized build, in `.release`.")
+parser.add_argument("--lto", action="store_true", help="Build and run with link-time optimization, in `.release_lto`.")
+parser.add_argument("--unity", action="store_true", help="Use unity builds, also configurable in `pls.json`.")
+parser.add_argument("--locked", action="store_true", help="Use the dependencies at the commits from `pls.lock`.")
+parser.add_argument("--no-pch", action="store_true", help="Do not precompile the commonly included system headers.")
+parser.add_argument("--prebuilt-deps", action="store_true", help="Reuse the dependencies built by any project.")
+parser.add_argument("--profile", type=str, help="Record where the time goes into this file, as a Chrome trace.")
 flags, cmd = parser.parse_known_args()
 
 if os.getenv("PLS_VERBOSE") is not None:
     flags.verbose = True
+if os.getenv("PLS_NO_CACHE") is not None:
+    flags.no_cache = True
+if os.getenv("PLS_NO_NATIVE_SCAN") is not None:
+    flags.no_native_scan = True
+if os.getenv("PLS_NO_GIT_CACHE") is not None:
+    flags.no_git_cache = True
+if os.getenv("PLS_NO_PCH") is not None:
+    flags.no_pch = True
+if os.getenv("PLS_LOCKED") is not None:
+    flags.locked = True
+if os.getenv("PLS_PREBUILT_DEPS") is not None:
+    flags.prebuilt_deps = True
+if flags.jobs is None:
+    try:
+        flags.jobs = int(os.getenv("PLS_JOBS") or os.cpu_count() or 1)
+    except ValueError:
+        print(f"PLS: The `PLS_JOBS` should be the number of jobs, not `{os.getenv('PLS_JOBS')}`.")
+        sys.exit(1)
+if flags.jobs < 1:
+    print("PLS: The number of jobs should be positive.")
+    sys.exit(1)
 
 def file_or_link(path):
     try:
@@ -74,15 +116,26 @@ cc_git_clone_sh_contents = read_static_file("dot_pls/git_clone.sh")
 pls_export_gdb_or_lldb_sh = f"{flags.dotpls}/export_gdb_or_lldb.sh"
 pls_export_gdb_or_lldb_sh_contents = read_static_file("dot_pls/export_gdb_or_lldb.sh")
 
+prebuilt_deps_cmake = f"{flags.dotpls}/prebuilt_deps.cmake"
+prebuilt_deps_cmake_contents = read_static_file("dot_pls/prebuilt_deps.cmake")
+
 
-def singleton_cmakelists_txt_contents(lib_name):
+def singleton_cmakelists_txt_contents(lib_name, prebuilt=None):
+    # With `prebuilt` as the repo and the commit, the library is imported from the artifacts cache if it is there.
     lib_name_uppercase = lib_name.upper()
+    add_library = "add_subdirectory(impl)"
+    if prebuilt:
+        repo, commit = prebuilt
+        add_library = (
+            f'include("{os.path.abspath(prebuilt_deps_cmake)}")\n'
+            f'  pls_add_prebuilt_dependency({lib_name} "{repo}" "{commit}" "{version}" "{artifacts_cache_dir}")'
+        )
     return f"""cmake_minimum_required(VERSION 3.14.1)
 project(singleton_{lib_name_uppercase} C CXX)
 get_property(VALUE GLOBAL PROPERTY "HAS_SINGLETON_LIBRARY_{lib_name_uppercase}")
 if(NOT VALUE)
   set_property(GLOBAL PROPERTY "HAS_SINGLETON_LIBRARY_{lib_name_uppercase}" TRUE)
-  add_subdirectory(impl)
+  {add_library}
 endif()
 """
 
@@ -93,10 +146,89 @@ def pls_fail(msg):
     sys.exit(1)
 
 
+# With `--profile`, the spans of the phases and of the subprocesses of `pls`, as the Chrome Trace Event format events,
+# to be viewed in `chrome://tracing` or in Perfetto, and summarized with `pls profile summary`.
+trace_events = []
+trace_lock = threading.Lock()
+trace_start = time.perf_counter()
+trace_thread_ids = {}
+
+
+def trace_thread_id(key=None):
+    # The small integer IDs for the threads, as well as for the "virtual" threads, such as the Ninja jobs.
+    if key is None:
+        key = threading.current_thread().name
+    with trace_lock:
+        if key not in trace_thread_ids:
+            trace_thread_ids[key] = len(trace_thread_ids) + 1
+            event = {"name": "thread_name", "ph": "M", "pid": 1, "tid": trace_thread_ids[key], "args": {"name": key}}
+            trace_events.append(event)
+        return trace_thread_ids[key]
+
+
+def trace_timestamp(perf_counter_time=None):
+    return ((time.perf_counter() if perf_counter_time is None else perf_counter_time) - trace_start) * 1e6
+
+
+def add_trace_event(name, category, start, duration, tid=None, **args):
+    if flags.profile:
+        event = {"name": name, "cat": category, "ph": "X", "ts": start, "dur": duration, "pid": 1}
+        event["tid"] = trace_thread_id() if tid is None else tid
+        event["args"] = args
+        with trace_lock:
+            trace_events.append(event)
+
+
+class TraceSpan:
+    def __init__(self, name, category, **args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = trace_timestamp()
+        return self
+
+    def __exit__(self, *unused_exc):
+        add_trace_event(self.name, self.category, self.start, trace_timestamp() - self.start, **self.args)
+
+
+def traced(category):
+    # The decorator to record the span of each call to the function, for the phases of `pls`.
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with TraceSpan(function.__name__, category):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def run_subprocess(command, category, trace_args=None, **kwargs):
+    # The `subprocess.run()` that records the span of the subprocess, with its command line and exit code.
+    trace_args = trace_args or {}
+    with TraceSpan(os.path.basename(command[0]), category, command=" ".join(command), **trace_args) as span:
+        result = subprocess.run(command, **kwargs)
+        span.args["exit_code"] = result.returncode
+    return result
+
+
+def save_trace():
+    if flags.profile:
+        with trace_lock:
+            trace = {"traceEvents": list(trace_events), "displayTimeUnit": "ms", "otherData": {"version": version}}
+        with open(flags.profile, "w") as file:
+            file.write(json.dumps(trace))
+
+
 if os.path.isfile("pls.py") or os.path.isfile("pls"):
     pls_fail("PLS: You are probably running `pls` from the wrong directory. Navigate to your project directory first.")
 
 modules = {}
+# For each of the `modules`, the directory that imported it first, to report the conflicting imports.
+module_imported_by = {}
 
 
 @dataclass
@@ -111,6 +243,18 @@ class PerDirectoryStatus:
 
 per_dir = defaultdict(PerDirectoryStatus)
 
+# The build configurations, as the build dir, `CMAKE_BUILD_TYPE`, and the extra `cmake` arguments.
+# Each has its own build dir, so that switching between them does not trigger full rebuilds.
+build_configs = {
+    "debug": (".debug", "Debug", []),
+    "release": (".release", "Release", []),
+    "release_lto": (".release_lto", "Release", ["-DCMAKE_INTERPROCEDURAL_OPTIMIZATION=ON"]),
+    # The `pls pgo` workflow, the binaries that collect the profile, and then the ones optimized using it.
+    # Their flags refer to the profiles of the project, so their dependencies are never prebuilt.
+    "pgo_instrumented": (".pgo_instrumented", "Release", ["-DPLS_NO_PREBUILT_DEPS=ON"]),
+    "release_pgo": (".release_pgo", "Release", ["-DPLS_NO_PREBUILT_DEPS=ON"]),
+}
+
 full_abspath = os.path.abspath(".")
 per_dir[full_abspath].add_to_gitignore.append(flags.dotpls)
 per_dir[full_abspath].add_to_gitignore.append(".debug")
@@ -121,6 +265,9 @@ def create_symlink_with_cmakelists_txt(dst_dir, lib_name, lib_cloned_dir):
     # TODO(dkorolev): Creating the symlink should involve the `.gitignore` magic.
     final_dst_path = os.path.join(dst_dir, lib_name)
     if not os.path.isdir(final_dst_path):
+        if os.path.lexists(final_dst_path) and not os.path.exists(final_dst_path):
+            # The dangling symlink left by `pls clean` removing `.pls/singleton_deps`, as the older `pls` did.
+            os.unlink(final_dst_path)
         wrapper_top_dir = os.path.join(flags.dotpls, "singleton_deps")
         # TODO(dkorolev): So, the top-level symlinks created can be relative paths, the rest should be absolute. Fix this.
         wrapper_dir = os.path.join(os.path.abspath(wrapper_top_dir), lib_name)
@@ -133,73 +280,896 @@ def create_symlink_with_cmakelists_txt(dst_dir, lib_name, lib_cloned_dir):
         if not os.path.isfile(cmakelists_path):
             with open(cmakelists_path, "w") as file:
                 file.write(singleton_cmakelists_txt_contents(lib_name))
+    # On every run, not only once created, so that the symlinks from before the manifest are in it too.
+    if is_symlink_into_dotpls(final_dst_path):
+        record_artifact(final_dst_path, "symlink")
+
+
+def write_file_if_changed(path, contents, executable=False):
+    # Rewrite the file only if its contents differ, so that its mtime, and thus `cmake`, is not disturbed needlessly.
+    if os.path.isfile(path):
+        with open(path, "r") as file:
+            if file.read() == contents:
+                return False
+    with open(path, "w") as file:
+        file.write(contents)
+    if executable:
+        os.chmod(path, 0o755)
+    return True
+
+
+# What `pls` creates outside `.pls`, so that `pls clean` removes exactly that, without scanning the sources, let alone
+# cloning the dependencies, to find out what it is. Each path, relative to the project dir, is mapped to its kind, one
+# of `clean_levels`, and the lines `pls` has added to the `.gitignore` files are kept too.
+manifest_json = f"{flags.dotpls}/manifest.json"
+manifest_format = 1
+manifest = None
+manifest_dirty = False
+manifest_lock = threading.Lock()
+
+gitignore_comment = "# Added automatically by `pls`. Okay to push to git."
+
+# The kinds of artifacts, to the `pls clean` level that removes them: zero for `--build-only`, one by default,
+# and two for `--full`. The contents of `.pls` are removed by default, except for the cloned dependencies.
+clean_levels = {"build_dir": 0, "symlink": 1, "cmakelists_txt": 1, "vscode_file": 2, "vscode_dir": 2}
+
+
+def load_manifest():
+    global manifest
+    if manifest is None:
+        manifest = {"format": manifest_format, "artifacts": {}, "gitignore": {}}
+        if os.path.isfile(manifest_json):
+            try:
+                with open(manifest_json, "r") as file:
+                    loaded = json.loads(file.read())
+                if loaded.get("format") == manifest_format:
+                    manifest = loaded
+            except (OSError, ValueError):
+                if flags.verbose:
+                    print(f"PLS: Ignoring the malformed `{manifest_json}`.")
+    return manifest
+
+
+def record_artifact(path, kind):
+    global manifest_dirty
+    rel_path = os.path.relpath(os.path.abspath(path), full_abspath)
+    with manifest_lock:
+        artifacts = load_manifest()["artifacts"]
+        if artifacts.get(rel_path) != kind:
+            artifacts[rel_path] = kind
+            manifest_dirty = True
+
+
+def record_gitignore_lines(gitignore_file, lines):
+    global manifest_dirty
+    rel_path = os.path.relpath(os.path.abspath(gitignore_file), full_abspath)
+    with manifest_lock:
+        recorded_lines = load_manifest()["gitignore"].setdefault(rel_path, [])
+        for line in lines:
+            if line not in recorded_lines:
+                recorded_lines.append(line)
+                manifest_dirty = True
+
+
+def save_manifest():
+    global manifest_dirty
+    with manifest_lock:
+        if manifest_dirty and os.path.isdir(flags.dotpls):
+            tmp_manifest_json = f"{manifest_json}.tmp"
+            with open(tmp_manifest_json, "w") as file:
+                file.write(json.dumps(manifest, indent=2, sort_keys=True) + "\n")
+            os.replace(tmp_manifest_json, manifest_json)
+            manifest_dirty = False
+
+
+@traced("phase")
+def install_dotpls_files():
+    os.makedirs(flags.dotpls, exist_ok=True)
+    os.makedirs(pls_h_dir, exist_ok=True)
+    write_file_if_changed(cc_instrument_sh, cc_instrument_sh_contents, executable=True)
+    write_file_if_changed(git_clone_sh, cc_git_clone_sh_contents, executable=True)
+    write_file_if_changed(pls_export_gdb_or_lldb_sh, pls_export_gdb_or_lldb_sh_contents, executable=True)
+    write_file_if_changed(pls_h, pls_h_contents)
+    write_file_if_changed(prebuilt_deps_cmake, prebuilt_deps_cmake_contents)
+
+
+# The scan cache, so that the sources that did not change are not re-instrumented with `g++ -E` on every run.
+# A source is keyed by its absolute path, and its cached `PLS_*` commands are valid as long as the source itself and
+# every user header it includes, as reported by the preprocessor, still have the same size and mtime, or, failing that,
+# the same contents. The `pls.json` files are cached the same way. Changing `pls.h`, the instrumentation script, or
+# the version of `pls` itself discards the whole cache. Along with the commands, each source keeps the system headers
+# it includes, and whether it defines any macros before including them, and the preprocessed sizes of these headers
+# are cached too, to pick the headers to precompile.
+scan_cache_json = f"{flags.dotpls}/cache.json"
+scan_cache_format = 5
+scan_cache = None
+scan_cache_dirty = False
+
+
+def scan_cache_salt():
+    salt = f"{scan_cache_format}\n{version}\n{pls_h_contents}\n{cc_instrument_sh_contents}"
+    return hashlib.sha256(salt.encode()).hexdigest()
+
+
+def load_scan_cache():
+    global scan_cache
+    if scan_cache is None:
+        scan_cache = {"salt": scan_cache_salt(), "sources": {}, "pls_json": {}, "system_headers": {}}
+        if not flags.no_cache and os.path.isfile(scan_cache_json):
+            try:
+                with open(scan_cache_json, "r") as file:
+                    loaded = json.loads(file.read())
+                if loaded.get("salt") == scan_cache["salt"]:
+                    scan_cache = loaded
+                elif flags.verbose:
+                    print("PLS: The scan cache is from a different version of `pls`, will re-scan everything.")
+            except (OSError, ValueError):
+                if flags.verbose:
+                    print(f"PLS: Ignoring the malformed `{scan_cache_json}`.")
+    return scan_cache
+
+
+def save_scan_cache():
+    global scan_cache_dirty
+    if scan_cache_dirty and not flags.no_cache and os.path.isdir(flags.dotpls):
+        tmp_scan_cache_json = f"{scan_cache_json}.tmp"
+        with open(tmp_scan_cache_json, "w") as file:
+            file.write(json.dumps(scan_cache))
+        os.replace(tmp_scan_cache_json, scan_cache_json)
+        scan_cache_dirty = False
+
+
+def file_signature(path, stat=None):
+    if stat is None:
+        stat = os.stat(path)
+    with open(path, "rb") as file:
+        sha256 = hashlib.sha256(file.read()).hexdigest()
+    return [stat.st_size, stat.st_mtime_ns, sha256]
+
+
+def file_matches_signature(path, signature, stat=None):
+    if signature is None:
+        return not os.path.exists(path)
+    try:
+        if stat is None:
+            stat = os.stat(path)
+        if [stat.st_size, stat.st_mtime_ns] == signature[:2]:
+            return True
+        return file_signature(path, stat)[2] == signature[2]
+    except OSError:
+        return False
+
+
+def cache_lookup(section, path, stat=None):
+    # The `stat` of the `path` itself, if it is known already, saves a system call.
+    if flags.no_cache:
+        return None
+    entry = load_scan_cache()[section].get(path)
+    if entry and all(
+        file_matches_signature(p, signature, stat if p == path else None) for p, signature in entry["inputs"].items()
+    ):
+        return entry
+    return None
+
+
+def cache_store(section, path, inputs, **values):
+    # The `inputs` are `{path: True}` for the files this entry depends on, and `{path: False}` for those that must not
+    # exist, such as the not yet installed headers.
+    global scan_cache_dirty
+    if flags.no_cache:
+        return
+    try:
+        signatures = {p: file_signature(p) if exists else None for p, exists in inputs.items()}
+    except OSError:
+        return
+    load_scan_cache()[section][path] = {"inputs": signatures, **values}
+    scan_cache_dirty = True
+
+
+def system_header_name(path):
+    # The name under which the header at this path is included as `#include <...>`, or `None` if it is not a system one.
+    normalized_path = os.path.normpath(os.path.abspath(path))
+    for search_dir in get_system_include_dirs():
+        search_dir = os.path.join(os.path.normpath(search_dir), "")
+        if normalized_path.startswith(search_dir):
+            return normalized_path[len(search_dir) :]
+    return None
+
+
+def parse_headers_log(headers_log, pls_h_abs_dir):
+    # The `stderr` of `g++ -E -H`: one ". path/to/header.h" line per header, and, if some header could not be found,
+    # the "file.cc:1:10: fatal error: header.h: No such file or directory" line. The number of dots is the depth.
+    # Returns the headers within the project tree, plus the paths where the missing header, if any, should stay missing,
+    # the system headers included from the project tree, and whether the missing header was why the preprocessor failed.
+    project_dir = os.path.join(os.path.abspath("."), "")
+    inputs = {}
+    system_includes = []
+    # Whether each header of the current chain of `#include`-s is from the project tree.
+    within_project = []
+    missing_header_seen = False
+    with open(headers_log, "r") as file:
+        for line in file:
+            line = line.rstrip("\n")
+            dots, _, header = line.partition(" ")
+            if dots and dots == "." * len(dots):
+                abs_header = os.path.abspath(header)
+                is_project_header = abs_header.startswith(project_dir)
+                if is_project_header:
+                    inputs[abs_header] = True
+                elif len(dots) == 1 or within_project[len(dots) - 2]:
+                    header_name = system_header_name(header)
+                    if header_name is not None and header_name not in system_includes:
+                        system_includes.append(header_name)
+                within_project[len(dots) - 1 :] = [is_project_header]
+            elif ": fatal error: " in line and line.endswith(": No such file or directory"):
+                including_file = line.split(":")[0]
+                missing_header = line.split(": fatal error: ")[1][: -len(": No such file or directory")]
+                for search_dir in [os.path.dirname(os.path.abspath(including_file)), pls_h_abs_dir]:
+                    inputs[os.path.join(search_dir, missing_header)] = False
+                missing_header_seen = True
+    return inputs, system_includes, missing_header_seen
+
+
+def scan_source_with_preprocessor(full_src_name, pls_h_abs_dir):
+    # Returns the `PLS_*` commands, the cache inputs for them, or `None` if the result should not be cached,
+    # the system headers included by the source and by the headers of the project it includes, and whether any macros
+    # may be defined before these system headers are included, which, as the macros are not tracked here, they may be.
+    abs_src_name = os.path.abspath(full_src_name)
+    headers_log = os.path.join(flags.dotpls, "scan_logs", hashlib.sha256(abs_src_name.encode()).hexdigest())
+    os.makedirs(os.path.dirname(headers_log), exist_ok=True)
+    result = run_subprocess(
+        ["bash", cc_instrument_sh, full_src_name, pls_h_abs_dir, headers_log],
+        "scan",
+        {"file": abs_src_name},
+        capture_output=True,
+        text=True,
+    )
+    pls_commands = []
+    for line in result.stdout.split("\n"):
+        stripped_line = line.rstrip(";").strip()
+        if stripped_line:
+            try:
+                pls_commands.append(json.loads(stripped_line))
+            except json.decoder.JSONDecodeError as e:
+                pls_fail(f"PLS internal error: Can not parse `{stripped_line}` while processing `{full_src_name}`.")
+    inputs = None
+    system_includes = []
+    if os.path.isfile(headers_log):
+        headers, system_includes, missing_header_seen = parse_headers_log(headers_log, pls_h_abs_dir)
+        os.unlink(headers_log)
+        # NOTE(dkorolev): The preprocessor most often fails on an `#include` of a not yet installed dependency.
+        #                 The output is partial then, but it stays right for as long as that header is missing.
+        if result.returncode == 0 or missing_header_seen:
+            inputs = {abs_src_name: True, **headers}
+    return pls_commands, inputs, system_includes, bool(system_includes)
+
+
+# The native scanner, to extract `PLS_IMPORT("lib", "repo")` and `PLS_PROJECT("name")` without running `g++ -E`.
+# It skips comments and string literals, follows the `#include`-s of the headers from the project tree, and mimics
+# the preprocessor stopping at the first `#include` that can not be found. Whenever the outcome depends on something
+# it does not evaluate, such as a directive under `#if`, or within a macro, it gives up, and the preprocessor is used.
+class NativeScanFallback(Exception):
+    pass
+
+
+# Only the `PLS_*` identifiers are matched, the rest of the code is skipped over, except for what may hide them.
+# The lookahead is purely for performance, to not try every alternative at every position. The text is expected
+# to begin with a newline, so that each directive, including one on the very first line, is preceded by one.
+native_scan_token_re = re.compile(
+    r"""(?=[/"'uULRP\n])(?:
+      (?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+    | (?P<raw_string>(?<![\w$])(?:u8|u|U|L)?R"(?P<delimiter>[^()\\\s"]{0,16})\(.*?(?:\)(?P=delimiter)"|\Z))
+    | (?P<literal>(?:(?<![\w$])(?:u8|u|U|L))?"(?:[^"\\\n]|\\.)*"?|(?<![\w$])(?:u8|u|U|L)?'(?:[^'\\\n]|\\.)*'?)
+    | \n(?P<directive>[ \t]*\#[^\n]*)
+    | (?P<identifier>(?<![\w$])PLS_\w+)
+    )""",
+    re.VERBOSE | re.DOTALL,
+)
+native_scan_string_literal = r'"(?:[^"\\\n]|\\.)*"'
+native_scan_invocation_re = re.compile(
+    rf"[ \t\n]*\([ \t\n]*({native_scan_string_literal})[ \t\n]*(?:,[ \t\n]*({native_scan_string_literal})[ \t\n]*)?\)"
+)
+native_scan_maybe_invocation_re = re.compile(r"\s*[(/]")
+native_scan_rest_of_line_re = re.compile(r"[ \t;]*(?://[^\n]*)?(?=\n|\Z)")
+native_scan_directive_re = re.compile(r"[ \t]*#[ \t]*(\w*)[ \t]*(.*)", re.DOTALL)
+native_scan_include_re = re.compile(r'(?:"([^"\n]+)"|<([^>\n]+)>)\s*\Z')
+native_scan_pls_identifier_re = re.compile(r"\bPLS_(?:IMPORT|PROJECT|INSTRUMENTATION_OUTPUT)\b")
+native_scan_max_include_depth = 64
+
+system_include_dirs = None
+system_include_dirs_lock = threading.Lock()
+
+
+def get_system_include_dirs():
+    # The directories `g++` looks in for `#include <...>`, so that the native scanner knows which headers are there.
+    global system_include_dirs
+    with system_include_dirs_lock:
+        if system_include_dirs is None:
+            result = run_subprocess(
+                ["g++", "-x", "c++", "-E", "-v", os.devnull],
+                "scan",
+                capture_output=True,
+                text=True,
+                env={**os.environ, "LC_ALL": "C"},
+            )
+            system_include_dirs = []
+            within_search_list = False
+            for line in result.stderr.split("\n"):
+                if line.startswith("#include <...> search starts here:"):
+                    within_search_list = True
+                elif line.startswith("End of search list."):
+                    within_search_list = False
+                elif within_search_list:
+                    system_include_dirs.append(line.strip().removesuffix(" (framework directory)"))
+    return system_include_dirs
+
+
+@dataclass
+class NativeScanState:
+    pls_h_abs_dir: str
+    pls_commands: list = field(default_factory=list)
+    inputs: dict = field(default_factory=dict)
+    # The system headers included unconditionally, in the order of their first `#include`.
+    system_includes: list = field(default_factory=list)
+    # Whether any macro other than an include guard was defined or undefined, and then a system header was included.
+    macros_changed: bool = False
+    macros_before_system_includes: bool = False
+    pls_h_included: bool = False
+    # Set once an `#include` could not be resolved, as this is where `g++ -E` would have stopped.
+    stopped_at: str = ""
+    defined_macros: set = field(default_factory=set)
+    pragma_once_headers: set = field(default_factory=set)
+    # The headers wrapped entirely into `#ifndef X`, `#define X`, ..., `#endif`, to the respective `X`.
+    guarded_headers: dict = field(default_factory=dict)
+
+
+def native_scan_resolve_include(state, including_file, header, is_quoted):
+    # Returns `(path, is_system)`, or `(None, False)` if the header can not be found, as `g++ -E` would look for it.
+    # The would-be locations that precede where the header is found are recorded as ones that must stay missing.
+    project_search_dirs = [os.path.dirname(including_file)] if is_quoted else []
+    project_search_dirs.append(state.pls_h_abs_dir)
+    for search_dir in project_search_dirs:
+        candidate = os.path.join(search_dir, header)
+        if os.path.isfile(candidate):
+            return os.path.abspath(candidate), False
+        state.inputs[os.path.abspath(candidate)] = False
+    for search_dir in get_system_include_dirs():
+        if os.path.isfile(os.path.join(search_dir, header)):
+            return os.path.join(search_dir, header), True
+    return None, False
+
+
+def native_scan_file(state, path, include_depth=0):
+    if include_depth > native_scan_max_include_depth:
+        raise NativeScanFallback("too deeply nested `#include`-s")
+    abs_path = os.path.abspath(path)
+    state.inputs[abs_path] = True
+    if state.guarded_headers.get(abs_path) in state.defined_macros:
+        return
+    with open(abs_path, "r", encoding="utf-8", errors="replace") as file:
+        text = "\n" + file.read().replace("\r\n", "\n").replace("\\\n", "")
+    if native_scan_pls_identifier_re.search(text) is None and "#" not in text:
+        return
+    # The stack of the `#if`-s this file is in; `True` for the include guard, which does not count as a condition.
+    conditions = []
+    guard_macro = None
+    guard = None
+    guard_closed = False
+    seen_significant_tokens = False
+    pos = 0
+    while True:
+        match = native_scan_token_re.search(text, pos)
+        if match is None:
+            break
+        pos = match.end()
+        kind = match.lastgroup if match.lastgroup != "delimiter" else "raw_string"
+        if kind == "comment":
+            continue
+        if kind == "directive":
+            directive = match.group("directive")
+            if "/*" in directive or "//" in directive:
+                directive = re.sub(r"//.*|/\*.*?\*/", " ", directive)
+                if "/*" in directive:
+                    raise NativeScanFallback("a multi-line comment in a directive")
+            name, args = native_scan_directive_re.match(directive).groups()
+            args = args.strip()
+            is_first_token = not seen_significant_tokens
+            seen_significant_tokens = True
+            guard_closed = False
+            if name in ("if", "ifdef", "ifndef"):
+                if is_first_token and include_depth > 0 and name == "ifndef" and re.fullmatch(r"\w+", args):
+                    guard_macro = args
+                conditions.append(False)
+            elif name in ("else", "elif", "elifdef", "elifndef"):
+                if conditions:
+                    conditions[-1] = False
+            elif name == "endif":
+                if conditions and conditions.pop() is True:
+                    guard_closed = True
+            elif name == "define":
+                macro = re.match(r"\w*", args).group(0)
+                if native_scan_pls_identifier_re.search(args):
+                    raise NativeScanFallback(f"`#define {macro}` involves `PLS_*`")
+                if guard_macro is not None and macro == guard_macro and len(conditions) == 1:
+                    if macro in state.defined_macros:
+                        raise NativeScanFallback(f"the include guard `{macro}` is already defined")
+                    conditions[0] = True
+                    guard = macro
+                else:
+                    state.macros_changed = True
+                if not any(not is_guard for is_guard in conditions):
+                    state.defined_macros.add(macro)
+                guard_macro = None
+            elif name == "undef":
+                if native_scan_pls_identifier_re.search(args):
+                    raise NativeScanFallback("`#undef` of `PLS_*`")
+                state.macros_changed = True
+            elif name == "pragma":
+                if args == "once":
+                    if abs_path in state.pragma_once_headers:
+                        return
+                    state.pragma_once_headers.add(abs_path)
+            elif name in ("include", "include_next", "import"):
+                if state.stopped_at:
+                    continue
+                include = native_scan_include_re.match(args)
+                if name != "include" or include is None:
+                    raise NativeScanFallback(f"can not resolve `#{name} {args}`")
+                is_quoted = include.group(1) is not None
+                header = include.group(1) if is_quoted else include.group(2)
+                conditional = not all(conditions)
+                header_path, is_system = native_scan_resolve_include(state, abs_path, header, is_quoted)
+                if header_path is None:
+                    if conditional:
+                        raise NativeScanFallback(f"`#include` of the missing `{header}` under `#if`")
+                    state.stopped_at = header
+                elif is_system:
+                    state.macros_before_system_includes |= state.macros_changed
+                    if not conditional and header not in state.system_includes:
+                        state.system_includes.append(header)
+                elif os.path.dirname(header_path) == state.pls_h_abs_dir and header == "pls.h":
+                    if conditional:
+                        raise NativeScanFallback("`pls.h` is included under `#if`")
+                    state.pls_h_included = True
+                else:
+                    if conditional:
+                        raise NativeScanFallback(f"`{header}` is included under `#if`")
+                    native_scan_file(state, header_path, include_depth + 1)
+            continue
+        seen_significant_tokens = True
+        guard_closed = False
+        if kind != "identifier":
+            continue
+        identifier = match.group("identifier")
+        if identifier == "PLS_INSTRUMENTATION_OUTPUT":
+            raise NativeScanFallback("`PLS_INSTRUMENTATION_OUTPUT` is used directly")
+        if identifier not in ("PLS_IMPORT", "PLS_PROJECT") or not state.pls_h_included:
+            continue
+        invocation = native_scan_invocation_re.match(text, pos)
+        if invocation is None:
+            if native_scan_maybe_invocation_re.match(text, pos):
+                raise NativeScanFallback(f"can not parse the arguments of `{identifier}`")
+            continue
+        if state.stopped_at:
+            raise NativeScanFallback(f"`{identifier}` follows the `#include` of the missing `{state.stopped_at}`")
+        if not all(conditions):
+            raise NativeScanFallback(f"`{identifier}` is under `#if`")
+        # The preprocessed `PLS_*` output is parsed line by line, so it should be the only thing on its line.
+        line_start = text.rfind("\n", 0, match.start()) + 1
+        rest_of_line = native_scan_rest_of_line_re.match(text, invocation.end())
+        if text[line_start : match.start()].strip() or rest_of_line is None:
+            raise NativeScanFallback(f"`{identifier}` is not on a line of its own")
+        pos = rest_of_line.end()
+        try:
+            args = [json.loads(arg) for arg in invocation.groups() if arg is not None]
+        except json.decoder.JSONDecodeError:
+            raise NativeScanFallback(f"can not decode the arguments of `{identifier}`")
+        if identifier == "PLS_PROJECT" and len(args) == 1:
+            state.pls_commands.append({"pls_project": args[0]})
+        elif identifier == "PLS_IMPORT" and len(args) == 2:
+            state.pls_commands.append({"pls_import": {"lib": args[0], "repo": args[1]}})
+        else:
+            raise NativeScanFallback(f"wrong number of arguments to `{identifier}`")
+    if guard_closed:
+        state.guarded_headers[abs_path] = guard
+
+
+def scan_source_natively(full_src_name, pls_h_abs_dir):
+    # Returns the `PLS_*` commands, the cache inputs for them, and the system headers, as the preprocessor would, and
+    # whether any macros are defined before some system header is included. The system headers included under `#if`
+    # are not reported, as the condition is not evaluated, but they do count as included after the macros.
+    state = NativeScanState(pls_h_abs_dir=pls_h_abs_dir)
+    native_scan_file(state, full_src_name)
+    return state.pls_commands, state.inputs, state.system_includes, state.macros_before_system_includes
+
+
+def dependency_of_path(path):
+    # The name of the dependency the file belongs to, if any, for `pls profile summary`.
+    deps_dir = os.path.join(os.path.abspath(flags.dotpls), "deps")
+    relative_path = os.path.relpath(os.path.abspath(path), deps_dir)
+    if relative_path.startswith(".."):
+        return None
+    return relative_path.split(os.sep)[0]
+
+
+# The system headers each of the instrumented sources includes, by the absolute path of the source, and whether any
+# macros are defined or undefined before they are included, in which case the precompiled headers can not be used.
+scanned_system_includes = {}
+scanned_macros_before_system_includes = {}
+
+
+def instrument_source_file(full_src_name, stat=None):
+    abs_src_name = os.path.abspath(full_src_name)
+    with TraceSpan(os.path.basename(full_src_name), "scan", file=abs_src_name) as span:
+        span.args["dependency"] = dependency_of_path(abs_src_name)
+        span.args["method"] = "cache"
+        cached = cache_lookup("sources", abs_src_name, stat)
+        if cached is not None:
+            scanned_system_includes[abs_src_name] = cached["system_includes"]
+            scanned_macros_before_system_includes[abs_src_name] = cached["macros_before_system_includes"]
+            return cached["pls_commands"]
+        pls_h_abs_dir = os.path.join(os.path.abspath(flags.dotpls), "pls_h_dir")
+        try:
+            if flags.no_native_scan:
+                raise NativeScanFallback("disabled by `--no-native-scan`")
+            span.args["method"] = "native"
+            pls_commands, inputs, system_includes, macros_before = scan_source_natively(full_src_name, pls_h_abs_dir)
+        except NativeScanFallback as e:
+            if flags.verbose:
+                print(f"PLS: Instrumenting `{full_src_name}`, as {e}.")
+            span.args["method"] = "preprocessor"
+            scanned = scan_source_with_preprocessor(full_src_name, pls_h_abs_dir)
+            pls_commands, inputs, system_includes, macros_before = scanned
+        scanned_system_includes[abs_src_name] = system_includes
+        scanned_macros_before_system_includes[abs_src_name] = macros_before
+        if inputs is not None:
+            cache_store(
+                "sources",
+                abs_src_name,
+                inputs,
+                pls_commands=pls_commands,
+                system_includes=system_includes,
+                macros_before_system_includes=macros_before,
+            )
+        return pls_commands
+
+
+# The sources are the `.cc` files in the project dir and in its `src/`, unless `pls.json` says otherwise, as in
+# `"sources": {"include": ["**/*.cc"], "exclude": ["third_party/**"]}`, with the globs relative to the project dir,
+# where `**` matches any number of dirs. The hidden dirs, such as `.pls`, `.git`, and the build dirs, are never looked
+# into, and neither are the symlinked dirs, such as the dependencies.
+default_source_globs = {"include": ["*.cc", "src/*.cc"], "exclude": []}
+
+
+def read_pls_json(pls_json_path):
+    # Returns what `pls` needs from `pls.json`, the imports, the source globs, the executables listed as the benchmarks
+    # and as the tests, and the unity build and the precompiled headers settings, cached as the sources are.
+    abs_pls_json_path = os.path.abspath(pls_json_path)
+    cached = cache_lookup("pls_json", abs_pls_json_path)
+    if cached is not None:
+        return cached
+    pls_json = None
+    with open(pls_json_path, "r") as file:
+        try:
+            pls_json = json.loads(file.read())
+        except json.decoder.JSONDecodeError as e:
+            pls_fail(f"PLS: Failed to parse `{pls_json_path}`: {e}.")
+    imports = pls_json.get("import", {})
+    sources = {**default_source_globs, **pls_json.get("sources", {})}
+    for key in ("include", "exclude"):
+        globs = sources.get(key)
+        if not isinstance(globs, list) or not all(isinstance(glob, str) and glob for glob in globs):
+            pls_fail(f"PLS: The `sources.{key}` in `{pls_json_path}` should be a list of globs, such as `src/**/*.cc`.")
+    values = {"imports": imports, "sources": {"include": sources["include"], "exclude": sources["exclude"]}}
+    for key in ("bench", "test"):
+        listed = pls_json.get(key, [])
+        if not isinstance(listed, list) or not all(isinstance(exe, str) for exe in listed):
+            pls_fail(f"PLS: The `{key}` in `{pls_json_path}` should be a list of the names of the executables.")
+        values[key] = listed
+    values["unity"] = parse_unity_settings(pls_json.get("unity", False), pls_json_path)
+    values["pch"] = parse_pch_settings(pls_json.get("pch", True), pls_json_path)
+    cache_store("pls_json", abs_pls_json_path, {abs_pls_json_path: True}, **values)
+    return values
+
+
+def read_pls_json_imports(pls_json_path):
+    return read_pls_json(pls_json_path)["imports"]
 
 
 already_traversed_src_dirs = set()
+# For each dir the sources were discovered in, all the dirs looked into, for `pls watch`.
+discovered_source_dirs = {}
 
 
-def traverse_source_tree(src_dir="."):
-    # TODO(dkorolev): Traverse recursively.
-    # TODO(dkorolev): `libraries`? And a command to `run` them, if only with `objdump -s`?
-    queue_list = deque()
-    queue_set = set()
-
-    def add_to_queue(src_dir):
-        abs_src_dir = os.path.abspath(src_dir)
-        queue_list.append(abs_src_dir)
-        queue_set.add(abs_src_dir)
-
-    add_to_queue(src_dir)
-    while queue_list:
-        src_dir = queue_list.popleft()
-        if src_dir not in already_traversed_src_dirs and (src_dir == "." or os.path.isdir(src_dir)):
+def source_glob_component_regex(component):
+    # A component of a glob: `*` and `?` match within it, the rest is matched literally.
+    return "".join("[^/]*" if c == "*" else "[^/]" if c == "?" else re.escape(c) for c in component)
+
+
+@functools.lru_cache(maxsize=None)
+def source_glob_component_re(component):
+    return re.compile(source_glob_component_regex(component) + r"\Z")
+
+
+@functools.lru_cache(maxsize=None)
+def source_glob_re(glob):
+    parts = glob.strip("/").split("/")
+    regex = ""
+    for i, part in enumerate(parts):
+        is_last = i == len(parts) - 1
+        if part == "**":
+            regex += ".*" if is_last else "(?:[^/]+/)*"
+        else:
+            regex += source_glob_component_regex(part) + ("" if is_last else "/")
+    return re.compile(regex + r"\Z")
+
+
+def source_glob_may_match_within(glob, rel_dir_parts):
+    # Whether anything within the dir can match the glob, so that the dirs that can not are not even looked into.
+    parts = glob.strip("/").split("/")
+    for i, dir_part in enumerate(rel_dir_parts):
+        if i >= len(parts) - 1:
+            return False
+        if parts[i] == "**":
+            return True
+        if not source_glob_component_re(parts[i]).match(dir_part):
+            return False
+    return True
+
+
+def list_sources_in_dir(src_dir):
+    # The `(name relative to `src_dir`, full name, `os.stat_result`)` triples of the sources of `src_dir`, the shallower
+    # ones first, and then sorted, so that the order of the generated targets does not depend on the file system.
+    pls_json_path = os.path.join(src_dir, "pls.json")
+    globs = read_pls_json(pls_json_path)["sources"] if os.path.isfile(pls_json_path) else default_source_globs
+    include = [source_glob_re(glob) for glob in globs["include"]]
+    exclude = [source_glob_re(glob) for glob in globs["exclude"]]
+    pruned_names = {os.path.basename(os.path.normpath(flags.dotpls))}
+    pruned_names.update(build_dir for build_dir, _, _ in build_configs.values())
+    sources = []
+    looked_into = []
+    pending_dirs = [()]
+    while pending_dirs:
+        rel_dir_parts = pending_dirs.pop()
+        rel_dir = "/".join(rel_dir_parts)
+        full_dir = os.path.join(src_dir, *rel_dir_parts)
+        looked_into.append(full_dir)
+        try:
+            entries = list(os.scandir(full_dir))
+        except OSError:
+            continue
+        for entry in entries:
+            rel_name = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name.startswith(".") or entry.name in pruned_names:
+                    continue
+                if any(regex.match(rel_name) or regex.match(f"{rel_name}/") for regex in exclude):
+                    continue
+                child_parts = rel_dir_parts + (entry.name,)
+                if any(source_glob_may_match_within(glob, child_parts) for glob in globs["include"]):
+                    pending_dirs.append(child_parts)
+            elif any(regex.match(rel_name) for regex in include):
+                if any(regex.match(rel_name) for regex in exclude):
+                    continue
+                try:
+                    if entry.is_file():
+                        sources.append((rel_name, entry.path, entry.stat()))
+                except OSError:
+                    pass
+    discovered_source_dirs[os.path.abspath(src_dir)] = looked_into
+    return sorted(sources, key=lambda source: (source[0].count("/"), source[0]))
+
+
+def executable_name_of_source(src_name):
+    # The sources in the project dir and in `src/` are named as is, the deeper ones are qualified by their dirs,
+    # as in `tools_server_main` for `tools/server/main.cc`, so that the names of the targets do not clash.
+    return os.path.splitext(src_name.removeprefix("src/"))[0].replace("/", "_")
+
+
+# The machine-wide cache of the cloned repositories, shared by all the projects and all the `pls` processes.
+# Each repository is kept as a bare `git clone --mirror` in `git/<sha256 of its URL>`, cloned once and then only
+# fetched incrementally. The dependencies of a project are then shallow-cloned from the local mirror, which is
+# near-instant and takes little disk space, and is not affected if the mirror is evicted later on. Each mirror is
+# guarded by its own `.lock` file, the mtime of which is also when the mirror was last used, for `pls cache gc`.
+pls_cache_dir = os.getenv("PLS_CACHE_DIR") or os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "pls"
+)
+git_cache_dir = os.path.join(pls_cache_dir, "git")
+git_cache_default_max_size = "5G"
+
+# With `--prebuilt-deps`, the dependencies that import nothing themselves are built once per machine, and are then
+# imported as prebuilt by every project that uses them at the same commit with the same compiler and flags, as
+# `.pls/prebuilt_deps.cmake` decides. Each is kept in `artifacts/<key>`, as the static libraries, the headers, and
+# the `targets.cmake` that imports them, and is locked and evicted the same way as the mirrors of the git repositories.
+artifacts_cache_dir = os.path.join(pls_cache_dir, "artifacts")
+
+
+class CacheLock:
+    # The shared locks are for using what is cached, the exclusive ones are for changing or evicting it.
+    def __init__(self, cached_dir, blocking=True, shared=False):
+        self.lock_path = f"{cached_dir}.lock"
+        self.blocking = blocking
+        self.shared = shared
+        self.file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        self.file = open(self.lock_path, "a")
+        try:
+            mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+            fcntl.flock(self.file, mode if self.blocking else mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.file.close()
+            self.file = None
+        return self.file is not None
+
+    def __exit__(self, *unused_exc):
+        if self.file is not None:
+            self.file.close()
+
+
+def git_mirror_dir(repo):
+    return os.path.join(git_cache_dir, hashlib.sha256(repo.encode()).hexdigest())
+
+
+def run_git_steps(steps):
+    # Returns the result of the first step that failed, or of the last one, with the output of all of them.
+    output = ""
+    for step in steps:
+        result = run_subprocess(["git"] + step, "git", capture_output=True, text=True)
+        output += result.stdout + result.stderr
+        if result.returncode != 0:
+            break
+    return subprocess.CompletedProcess(result.args, result.returncode, output, "")
+
+
+def clone_dependency_via_git_cache(lib, repo, commit=None):
+    lib_dir = os.path.abspath(f"{flags.dotpls}/deps/{lib}")
+    mirror_dir = git_mirror_dir(repo)
+    os.makedirs(os.path.dirname(lib_dir), exist_ok=True)
+    with CacheLock(mirror_dir):
+        has_commit = False
+        if commit is not None and os.path.isdir(mirror_dir):
+            has_commit = run_git_steps([["-C", mirror_dir, "cat-file", "-e", f"{commit}^{{commit}}"]]).returncode == 0
+        if has_commit:
+            # The locked commit is cached already, no need to even reach out to the remote.
+            result = subprocess.CompletedProcess([], 0, "", "")
+        elif os.path.isdir(mirror_dir):
+            if flags.verbose:
+                print(f"PLS: Updating the cached `{repo}`.")
+            result = run_git_steps([["-C", mirror_dir, "fetch", "--prune", "--quiet"]])
+            if result.returncode != 0:
+                # Most likely offline, and the cached mirror is still good to build from.
+                print(f"PLS: Could not update the cached `{repo}`, will use it as is.")
+                result.returncode = 0
+        else:
             if flags.verbose:
-                print(f"PLS: Analyzing `{src_dir}`.")
-            libs_to_import = set()
-            already_traversed_src_dirs.add(src_dir)
-            pls_json_path = os.path.join(src_dir, "pls.json")
-            if os.path.isfile(pls_json_path):
-                pls_json = None
-                with open(pls_json_path, "r") as file:
-                    try:
-                        pls_json = json.loads(file.read())
-                    except json.decoder.JSONDecodeError as e:
-                        pls_fail(f"PLS: Failed to parse `{pls_json_path}`: {e}.")
-                if "import" in pls_json:
-                    for lib, repo in pls_json["import"].items():
-                        # TODO(dkorolev): Fail on branch mismatch.
-                        modules[lib] = repo
-                        libs_to_import.add(lib)
-
-            def process_sources_in_dir(true_src_dir, prefix=""):
-                for src_name in os.listdir(true_src_dir):
-                    if src_name.endswith(".cc"):
-                        executable_name = src_name.rstrip(".cc")
+                print(f"PLS: Caching `{repo}` in `{mirror_dir}`.")
+            # Clone into a temporary dir first, so that an interrupted clone does not leave a broken mirror behind.
+            tmp_mirror_dir = f"{mirror_dir}.tmp"
+            shutil.rmtree(tmp_mirror_dir, ignore_errors=True)
+            result = run_git_steps(
+                [
+                    ["clone", "--mirror", "--quiet", repo, tmp_mirror_dir],
+                    # So that the dependencies can later be materialized at any commit, not just at the branch heads.
+                    ["-C", tmp_mirror_dir, "config", "uploadpack.allowAnySHA1InWant", "true"],
+                ]
+            )
+            if result.returncode == 0:
+                os.rename(tmp_mirror_dir, mirror_dir)
+            else:
+                shutil.rmtree(tmp_mirror_dir, ignore_errors=True)
+        if result.returncode != 0:
+            return result
+        os.utime(f"{mirror_dir}.lock")
+        if commit is None:
+            return run_git_steps(
+                [
+                    ["clone", "--depth", "1", "--quiet", f"file://{mirror_dir}", lib_dir],
+                    ["-C", lib_dir, "remote", "set-url", "origin", repo],
+                ]
+            )
+        return run_git_steps(
+            [
+                ["init", "--quiet", lib_dir],
+                ["-C", lib_dir, "fetch", "--depth", "1", "--quiet", f"file://{mirror_dir}", commit],
+                ["-C", lib_dir, "checkout", "--detach", "--quiet", "FETCH_HEAD"],
+                ["-C", lib_dir, "remote", "add", "origin", repo],
+            ]
+        )
+
+
+def clone_dependency(lib, repo, commit=None):
+    # Runs in a worker thread, so the output is captured, to be reported if the clone fails.
+    if injected_github_path and repo.startswith(github_https_prefix):
+        new_repo = f"{injected_github_path}/{repo[len(github_https_prefix):]}"
+        if flags.verbose:
+            print(f"PLS: Injecting `{repo}` -> `{new_repo}`.")
+        repo = new_repo
+    with TraceSpan(lib, "clone", dependency=lib, repo=repo, commit=commit) as span:
+        if flags.no_git_cache:
+            result = run_subprocess(["bash", git_clone_sh, repo, lib], "git", capture_output=True, text=True)
+            if result.returncode == 0 and commit is not None:
+                lib_dir = f"{flags.dotpls}/deps/{lib}"
+                result = run_git_steps([["-C", lib_dir, "checkout", "--detach", "--quiet", commit]])
+        else:
+            result = clone_dependency_via_git_cache(lib, repo, commit)
+        span.args["exit_code"] = result.returncode
+    return repo, result
+
+
+def register_module(lib, repo, src_dir):
+    # The same library imported from two different repos can not be built, so this is an error, found up front.
+    if modules.get(lib, repo) != repo:
+        pls_fail(
+            f"PLS: Conflicting imports of `{lib}`: `{modules[lib]}` from `{module_imported_by[lib]}`, "
+            f"and `{repo}` from `{src_dir}`."
+        )
+    modules[lib] = repo
+    module_imported_by.setdefault(lib, src_dir)
+
+
+@traced("phase")
+def traverse_source_tree(src_dir=".", follow_dependencies=True):
+    # TODO(dkorolev): `libraries`? And a command to `run` them, if only with `objdump -s`?
+    # The dependencies are traversed breadth-first, one frontier at a time. The sources of every directory of the
+    # frontier are instrumented in parallel, and the results are consumed strictly in order, so that the outcome is
+    # the same as if sequential. Then the newly discovered dependencies are cloned in parallel, and the sources
+    # of each one are queued for instrumentation as soon as it is cloned, while the other clones are still running.
+    load_scan_cache()
+    pending_scans = {}
+    # For each dependency directory, the directory that first required it, to report the chain if the clone fails.
+    required_by = {}
+
+    def start_scanning(pool, src_dir):
+        if src_dir not in pending_scans and src_dir not in already_traversed_src_dirs and os.path.isdir(src_dir):
+            pending_scans[src_dir] = [
+                (name, pool.submit(instrument_source_file, full_src_name, stat))
+                for name, full_src_name, stat in list_sources_in_dir(src_dir)
+            ]
+
+    def requirement_chain(src_dir):
+        chain = [src_dir]
+        while chain[-1] in required_by:
+            chain.append(required_by[chain[-1]])
+        return " <- ".join(f"`{d}`" for d in chain)
+
+    frontier = [os.path.abspath(src_dir)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=flags.jobs) as scan_pool:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=flags.jobs) as clone_pool:
+            while frontier:
+                for src_dir in frontier:
+                    start_scanning(scan_pool, src_dir)
+                next_frontier = []
+                libs_to_clone = {}
+                symlinks_to_create = []
+                for src_dir in frontier:
+                    if src_dir in already_traversed_src_dirs or not os.path.isdir(src_dir):
+                        continue
+                    if flags.verbose:
+                        print(f"PLS: Analyzing `{src_dir}`.")
+                    libs_to_import = set()
+                    already_traversed_src_dirs.add(src_dir)
+                    pls_json_path = os.path.join(src_dir, "pls.json")
+                    if os.path.isfile(pls_json_path):
+                        for lib, repo in read_pls_json_imports(pls_json_path).items():
+                            # TODO(dkorolev): Fail on branch mismatch.
+                            register_module(lib, repo, src_dir)
+                            libs_to_import.add(lib)
+
+                    for src_name, scan in pending_scans.pop(src_dir):
+                        executable_name = executable_name_of_source(src_name)
+                        source_stem = os.path.splitext(os.path.basename(src_name))[0]
                         # TODO(dkorolev): This looks like a terrible hack, but would do for now.
-                        if not "lib_" in executable_name and not "_lib" in executable_name:
-                            per_dir[src_dir].executables[executable_name] = prefix + src_name
-                        pls_commands = []
-                        full_src_name = os.path.join(true_src_dir, src_name)
-                        result = subprocess.run(
-                            [
-                                "bash",
-                                cc_instrument_sh,
-                                full_src_name,
-                                os.path.join(os.path.abspath(flags.dotpls), "pls_h_dir"),
-                            ],
-                            capture_output=True,
-                            text=True,
-                        )
-                        for line in result.stdout.split("\n"):
-                            stripped_line = line.rstrip(";").strip()
-                            if stripped_line:
-                                try:
-                                    pls_commands.append(json.loads(stripped_line))
-                                except json.decoder.JSONDecodeError as e:
-                                    pls_fail(
-                                        f"PLS internal error: Can not parse `{stripped_line}` while processing `{full_src_name}`."
-                                    )
-                        for pls_cmd in pls_commands:
+                        if not "lib_" in source_stem and not "_lib" in source_stem:
+                            other_src_name = per_dir[src_dir].executables.get(executable_name, src_name)
+                            if other_src_name != src_name:
+                                pls_fail(
+                                    f"PLS: Both `{other_src_name}` and `{src_name}` in `{src_dir}` would build "
+                                    f"`{executable_name}`, exclude one of them in `pls.json`."
+                                )
+                            per_dir[src_dir].executables[executable_name] = src_name
+                        for pls_cmd in scan.result():
                             if "pls_project" in pls_cmd:
                                 # TODO(dkorolev): Parse the project name from `pls.json` as well.
                                 per_dir[src_dir].project_name = pls_cmd["pls_project"]
@@ -210,51 +1180,263 @@ def traverse_source_tree(src_dir="."):
                                     # TODO(dkorolev): Maybe create and add to `#include`-s path the `pls.h` file from this tool?
                                     # TODO(dkorolev): Variadic macro templates for branches.
                                     lib, repo = pls_import["lib"], pls_import["repo"]
-                                    modules[lib] = repo
+                                    register_module(lib, repo, src_dir)
                                     libs_to_import.add(lib)
                                     per_dir[src_dir].executable_deps[executable_name].add(lib)
 
-            process_sources_in_dir(src_dir)
-            src_src_dir = os.path.join(src_dir, "src")
-            if os.path.isdir(src_src_dir):
-                process_sources_in_dir(src_src_dir, "src/")
-            for lib in libs_to_import:
-                print(f"PLS: Requirement `{lib}` from `{src_dir}`.")
-                per_dir[src_dir].deps.add(lib)
-            for lib in libs_to_import:
-                if lib not in queue_set:
-                    add_to_queue(os.path.join(flags.dotpls, "deps", lib))
-                    repo = modules[lib]
-                    lib_dir = f"{flags.dotpls}/deps/{lib}"
-                    if os.path.isdir(os.path.join(src_dir, lib)):
-                        if flags.verbose:
-                            print(f"PLS: Has symlink to `{lib}`, will use it.")
-                    else:
-                        if not os.path.isdir(lib_dir):
+                    for lib in sorted(libs_to_import):
+                        print(f"PLS: Requirement `{lib}` from `{src_dir}`.")
+                        per_dir[src_dir].deps.add(lib)
+                    if not follow_dependencies:
+                        continue
+                    for lib in sorted(libs_to_import):
+                        lib_dir = f"{flags.dotpls}/deps/{lib}"
+                        abs_lib_dir = os.path.abspath(lib_dir)
+                        if abs_lib_dir not in required_by and abs_lib_dir not in already_traversed_src_dirs:
+                            required_by[abs_lib_dir] = src_dir
+                            next_frontier.append(abs_lib_dir)
+                            start_scanning(scan_pool, abs_lib_dir)
+                        if os.path.isdir(os.path.join(src_dir, lib)):
                             if flags.verbose:
-                                print(f"PLS: Need to clone `{lib}` from `{repo}`.")
-                            if injected_github_path and repo.startswith(github_https_prefix):
-                                new_repo = f"{injected_github_path}/{repo[len(github_https_prefix):]}"
-                                if flags.verbose:
-                                    print(f"PLS: Injecting `{repo}` -> `{new_repo}`.")
-                                repo = new_repo
-                            result = subprocess.run(["bash", git_clone_sh, repo, lib])
-                            if result.returncode != 0:
-                                pls_fail(f"PLS: Clone of {repo} failed.")
-                            per_dir[full_abspath].add_to_gitignore.append(lib)
-                        else:
+                                print(f"PLS: Has symlink to `{lib}`, will use it.")
+                            continue
+                        if lib in libs_to_clone:
+                            pass
+                        elif not os.path.isdir(lib_dir):
                             if flags.verbose:
-                                print(f"PLS: Has module `{lib}`, will use it.")
-                        if not os.path.isdir(lib_dir):
-                            pls_fail(f"PLS internal error: repl {repo} cloned into {lib}, but can not be located.")
-                        create_symlink_with_cmakelists_txt(dst_dir=".", lib_name=lib, lib_cloned_dir=lib_dir)
-                        create_symlink_with_cmakelists_txt(dst_dir=src_dir, lib_name=lib, lib_cloned_dir=lib_dir)
-
-
+                                print(f"PLS: Need to clone `{lib}` from `{modules[lib]}`.")
+                            libs_to_clone[lib] = clone_pool.submit(clone_dependency, lib, modules[lib])
+                        elif flags.verbose:
+                            print(f"PLS: Has module `{lib}`, will use it.")
+                        symlinks_to_create.append((src_dir, lib, lib_dir))
+
+                failed_clones = []
+                clone_futures = {future: lib for lib, future in libs_to_clone.items()}
+                for future in concurrent.futures.as_completed(clone_futures):
+                    lib = clone_futures[future]
+                    repo, result = future.result()
+                    lib_dir = f"{flags.dotpls}/deps/{lib}"
+                    if result.returncode != 0:
+                        failed_clones.append((lib, repo, result))
+                    elif not os.path.isdir(lib_dir):
+                        pls_fail(f"PLS internal error: repl {repo} cloned into {lib}, but can not be located.")
+                    else:
+                        if flags.verbose:
+                            print(f"PLS: Cloned `{lib}`.")
+                        start_scanning(scan_pool, os.path.abspath(lib_dir))
+                if failed_clones:
+                    for lib, repo, result in sorted(failed_clones):
+                        print(result.stdout + result.stderr, end="")
+                        chain = requirement_chain(required_by[os.path.abspath(f"{flags.dotpls}/deps/{lib}")])
+                        print(f"PLS: Clone of {repo} failed, required by {chain}.")
+                    pls_fail(f"PLS: Failed to clone {len(failed_clones)} of the dependencies.")
+
+                for lib in sorted(libs_to_clone):
+                    per_dir[full_abspath].add_to_gitignore.append(lib)
+                for src_dir, lib, lib_dir in symlinks_to_create:
+                    create_symlink_with_cmakelists_txt(dst_dir=".", lib_name=lib, lib_cloned_dir=lib_dir)
+                    create_symlink_with_cmakelists_txt(dst_dir=src_dir, lib_name=lib, lib_cloned_dir=lib_dir)
+                frontier = next_frontier
+    save_scan_cache()
+
+
+# The lockfile, `pls.lock`, pins each dependency to the commit it was checked out at when `pls lock` was run,
+# and records which directories and executables import it. With `--locked`, only the sources of the project itself
+# are scanned, while all the dependencies are checked out at their locked commits at once, in parallel, instead of
+# being discovered one level of the dependency graph at a time. The locked commits come from the shared cache if it has
+# them, without reaching out to the remotes.
+pls_lock = "pls.lock"
+pls_lock_format = 1
+
+
+def lock_dir_name(src_dir):
+    # The importing directory as recorded in `pls.lock`, `.` for the project itself, or the name of the dependency.
+    if src_dir == full_abspath:
+        return "."
+    return dependency_of_path(src_dir) or os.path.relpath(src_dir, full_abspath)
+
+
+def read_pls_lock():
+    if not os.path.isfile(pls_lock):
+        pls_fail(f"PLS: No `{pls_lock}` to use with `--locked`, run `pls lock` first.")
+    with open(pls_lock, "r") as file:
+        try:
+            lock = json.loads(file.read())
+        except json.decoder.JSONDecodeError as e:
+            pls_fail(f"PLS: Failed to parse `{pls_lock}`: {e}.")
+    if not isinstance(lock, dict) or lock.get("format") != pls_lock_format:
+        pls_fail(f"PLS: The `{pls_lock}` is not of the format this version of `pls` uses, run `pls lock` again.")
+    return lock["dependencies"]
+
+
+def materialize_locked_dependency(lib, repo, commit):
+    # Returns `(repo, result)` if the checkout failed, `None` otherwise, including when it is at this commit already.
+    lib_dir = f"{flags.dotpls}/deps/{lib}"
+    if os.path.isdir(lib_dir):
+        if read_git_head(lib_dir) == commit:
+            return None
+        if flags.verbose:
+            print(f"PLS: `{lib}` is not at the locked commit, will check it out again.")
+        shutil.rmtree(lib_dir)
+    repo, result = clone_dependency(lib, repo, commit)
+    return (repo, result) if result.returncode != 0 else None
+
+
+@traced("phase")
+def materialize_locked_dependencies():
+    dependencies = read_pls_lock()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=flags.jobs) as clone_pool:
+        checkouts = {
+            lib: clone_pool.submit(materialize_locked_dependency, lib, dependency["repo"], dependency["commit"])
+            for lib, dependency in sorted(dependencies.items())
+        }
+        # Meanwhile, the project itself is scanned, for its own `CMakeLists.txt`, and to check that the lock is current.
+        traverse_source_tree(follow_dependencies=False)
+        failed_checkouts = [(lib, future.result()) for lib, future in checkouts.items() if future.result() is not None]
+    for lib in sorted(per_dir[full_abspath].deps):
+        if lib not in dependencies or dependencies[lib]["repo"] != modules[lib]:
+            pls_fail(f"PLS: The `{pls_lock}` is out of date, `{lib}` is from `{modules[lib]}` now, run `pls lock`.")
+    if failed_checkouts:
+        for lib, (repo, result) in failed_checkouts:
+            print(result.stdout + result.stderr, end="")
+            print(f"PLS: Checkout of {repo} at {dependencies[lib]['commit']} failed.")
+        pls_fail(f"PLS: Failed to check out {len(failed_checkouts)} of the locked dependencies.")
+    for lib, dependency in sorted(dependencies.items()):
+        register_module(lib, dependency["repo"], pls_lock)
+        lib_dir = f"{flags.dotpls}/deps/{lib}"
+        if lib not in per_dir[full_abspath].add_to_gitignore:
+            per_dir[full_abspath].add_to_gitignore.append(lib)
+        create_symlink_with_cmakelists_txt(dst_dir=".", lib_name=lib, lib_cloned_dir=lib_dir)
+        for importer in dependency["imported_by"]:
+            if importer != ".":
+                importer_dir = os.path.abspath(f"{flags.dotpls}/deps/{importer}")
+                create_symlink_with_cmakelists_txt(dst_dir=importer_dir, lib_name=lib, lib_cloned_dir=lib_dir)
+
+
+# The fingerprint of everything that affects how a build dir is configured, so that `pls build` can go straight to
+# `cmake --build` when nothing but the bodies of the sources has changed. For each directory traversed last time,
+# it covers the list of sources with their `PLS_*` commands and system headers, which are cheap to obtain from the scan
+# cache, the imports and the precompiled headers settings from `pls.json`, the `CMakeLists.txt`, the presence of
+# the imported libraries, and the checked out commit of the dependency. Plus the version of `pls` and the arguments
+# to `cmake`.
+fingerprints_json = f"{flags.dotpls}/fingerprints.json"
+
+
+def read_git_head(repo_dir):
+    # Reads the checked out commit from `.git` directly, as running `git` for each dependency would not be cheap.
+    git_dir = os.path.join(repo_dir, ".git")
+    try:
+        with open(os.path.join(git_dir, "HEAD"), "r") as file:
+            head = file.read().strip()
+        if not head.startswith("ref: "):
+            return head
+        ref = head[len("ref: ") :]
+        ref_path = os.path.join(git_dir, ref)
+        if os.path.isfile(ref_path):
+            with open(ref_path, "r") as file:
+                return file.read().strip()
+        with open(os.path.join(git_dir, "packed-refs"), "r") as file:
+            for line in file:
+                if line.rstrip("\n").endswith(f" {ref}"):
+                    return line.split(" ")[0]
+    except OSError:
+        pass
+    return None
+
+
+def compute_build_fingerprint(src_dirs, cmake_args):
+    fingerprint = {"version": version, "cmake_args": cmake_args, "dirs": {}}
+    for src_dir in sorted(src_dirs):
+        if not os.path.isdir(src_dir):
+            fingerprint["dirs"][src_dir] = None
+            continue
+        sources = {}
+        for name, full_src_name, stat in list_sources_in_dir(src_dir):
+            pls_commands = instrument_source_file(full_src_name, stat)
+            abs_src_name = os.path.abspath(full_src_name)
+            sources[name] = [
+                pls_commands,
+                scanned_system_includes[abs_src_name],
+                scanned_macros_before_system_includes[abs_src_name],
+            ]
+        pls_json_path = os.path.join(src_dir, "pls.json")
+        imports = read_pls_json_imports(pls_json_path) if os.path.isfile(pls_json_path) else None
+        libs = set(imports or {})
+        for pls_commands, _, _ in sources.values():
+            libs.update(c["pls_import"].get("lib") for c in pls_commands if "pls_import" in c)
+        cmakelists_txt = os.path.join(src_dir, "CMakeLists.txt")
+        fingerprint["dirs"][src_dir] = {
+            "sources": sources,
+            "imports": imports,
+            "pch": read_pch_settings(src_dir),
+            "cmakelists_txt": file_signature(cmakelists_txt) if os.path.isfile(cmakelists_txt) else None,
+            "libs": {lib: os.path.isdir(os.path.join(src_dir, lib)) for lib in sorted(libs, key=str)},
+            "head": read_git_head(src_dir),
+        }
+    if flags.locked:
+        fingerprint["locked"] = read_pls_lock()
+    fingerprint["prebuilt_deps"] = flags.prebuilt_deps
+    save_scan_cache()
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+
+def load_fingerprints():
+    if not flags.no_cache and os.path.isfile(fingerprints_json):
+        try:
+            with open(fingerprints_json, "r") as file:
+                return json.loads(file.read())
+        except (OSError, ValueError):
+            pass
+    return {}
+
+
+@traced("phase")
+def is_build_up_to_date(build_dir, cmake_args):
+    # If so, restores what the rest of `pls` needs from the full run, namely the executables of the project.
+    recorded = load_fingerprints().get(build_dir)
+    if not recorded or not os.path.isfile(os.path.join(build_dir, "CMakeCache.txt")):
+        return False
+    if compute_build_fingerprint(recorded["src_dirs"], cmake_args) != recorded["fingerprint"]:
+        return False
+    if not lock_prebuilt_deps_in_use(build_dir):
+        return False
+    per_dir[full_abspath].executables.update(recorded["executables"])
+    return True
+
+
+fingerprints_lock = threading.Lock()
+
+
+@traced("phase")
+def record_build_fingerprint(build_dir, cmake_args):
+    # Called from the concurrent builds of the different configurations, hence the lock.
+    if flags.no_cache or not os.path.isdir(flags.dotpls):
+        return
+    with fingerprints_lock:
+        fingerprints = load_fingerprints()
+        fingerprints[build_dir] = {
+            "fingerprint": compute_build_fingerprint(already_traversed_src_dirs, cmake_args),
+            "src_dirs": sorted(already_traversed_src_dirs),
+            "executables": per_dir[full_abspath].executables,
+        }
+        write_file_if_changed(fingerprints_json, json.dumps(fingerprints, indent=2, sort_keys=True) + "\n")
+
+
+def forget_build_fingerprint(build_dir):
+    with fingerprints_lock:
+        fingerprints = load_fingerprints()
+        if fingerprints.pop(build_dir, None) is not None:
+            write_file_if_changed(fingerprints_json, json.dumps(fingerprints, indent=2, sort_keys=True) + "\n")
+
+
+@traced("phase")
 def update_dependencies():
     if os.path.isfile("CMakeLists.txt"):
         if flags.verbose:
             print("PLS: Has `CMakeLists.txt`, will use it.")
+        if is_generated_cmakelists_txt("CMakeLists.txt"):
+            # Recorded on every run, as it may have been generated by the older `pls`, from before the manifest.
+            record_artifact("CMakeLists.txt", "cmakelists_txt")
     else:
         if flags.verbose:
             print("PLS: No `CMakeLists.txt`, will generate it, and will add it to `.gitignore`.")
@@ -262,40 +1444,51 @@ def update_dependencies():
         per_dir[full_abspath].add_to_gitignore.append("CMakeLists.txt")
 
     # TODO(dkorolev): A better name for this function.
+    @traced("phase")
     def apply_gitignore_changes_and_more():
         for full_dir, full_dir_data in per_dir.items():
             if full_dir_data.need_cmakelists_txt:
                 # TODO(dkorolev): Libraries would work too, not just executables.
                 if not full_dir_data.executables:
                     pls_fail("PLS: To run `pls install/build/run` please make sure to have at least one source file.")
-                with open(os.path.join(full_dir, "CMakeLists.txt"), "w") as file:
-                    file.write("# NOTE: This `CMakeLists.txt` is autogenerated by `pls`.\n")
-                    file.write("#       It is perfectly OK to edit, if only to remove this header.\n")
-                    # TODO(dkorolev): Time to introduce `.pls/cache.json`, at least to keep track of which `CMakeLists.txt`-s to clean!
-                    file.write(
-                        "#       Just keep in mind that a) it is `.gitignore`-d now, and b) it will be deleted on `pls clean`.\n"
-                    )
-                    file.write("\n")
-                    file.write("cmake_minimum_required(VERSION 3.14.1)\n")
-                    file.write("\n")
-                    file.write(f"project({full_dir_data.project_name} C CXX)\n")
-                    file.write("\n")
-                    file.write("set(CMAKE_CXX_STANDARD 11)\n")
-                    file.write("set(CMAKE_CXX_STANDARD_REQUIRED True)\n")
-                    file.write("\n")
-                    file.write('# This is for `#include "pls.h"` to work.\n')
-                    file.write('include_directories("${CMAKE_SOURCE_DIR}/.pls/pls_h_dir/")\n')
-                    if full_dir_data.deps:
-                        file.write("\n")
-                        for dep in full_dir_data.deps:
-                            file.write(f"add_subdirectory({dep})\n")
-                    if full_dir_data.executables:
-                        for exe, src in full_dir_data.executables.items():
-                            file.write("\n")
-                            file.write(f"add_executable({exe} {src})\n")
-                            if exe in full_dir_data.executable_deps:
-                                libs = " ".join(sorted(list(full_dir_data.executable_deps[exe])))
-                                file.write(f"target_link_libraries({exe} { libs })\n")
+                lines = []
+                lines.append("# NOTE: This `CMakeLists.txt` is autogenerated by `pls`.\n")
+                lines.append("#       It is perfectly OK to edit, if only to remove this header.\n")
+                lines.append(
+                    "#       Just keep in mind that a) it is `.gitignore`-d now, and b) it will be deleted on `pls clean`.\n"
+                )
+                lines.append("\n")
+                lines.append("cmake_minimum_required(VERSION 3.14.1)\n")
+                lines.append("\n")
+                lines.append(f"project({full_dir_data.project_name} C CXX)\n")
+                lines.append("\n")
+                lines.append("# `pls` sets the build type explicitly, this is for the IDEs.\n")
+                lines.append("if(NOT CMAKE_BUILD_TYPE)\n")
+                lines.append("  set(CMAKE_BUILD_TYPE Debug)\n")
+                lines.append("endif()\n")
+                lines.append("\n")
+                lines.append("set(CMAKE_CXX_STANDARD 11)\n")
+                lines.append("set(CMAKE_CXX_STANDARD_REQUIRED True)\n")
+                lines.append("\n")
+                lines.append('# This is for `#include "pls.h"` to work.\n')
+                lines.append('include_directories("${CMAKE_SOURCE_DIR}/.pls/pls_h_dir/")\n')
+                if full_dir_data.deps:
+                    lines.append("\n")
+                    for dep in sorted(full_dir_data.deps):
+                        lines.append(f"add_subdirectory({dep})\n")
+                if full_dir_data.executables:
+                    for exe, src in full_dir_data.executables.items():
+                        lines.append("\n")
+                        lines.append(f"add_executable({exe} {src})\n")
+                        if exe in full_dir_data.executable_deps:
+                            libs = " ".join(sorted(list(full_dir_data.executable_deps[exe])))
+                            lines.append(f"target_link_libraries({exe} { libs })\n")
+                lines.append("\n")
+                lines.append("# The system headers to precompile, updated by `pls` on each build.\n")
+                lines.append('include("${CMAKE_SOURCE_DIR}/.pls/pch.cmake" OPTIONAL)\n')
+                # Not touching the unchanged `CMakeLists.txt`, so that `cmake` does not need to reconfigure.
+                write_file_if_changed(os.path.join(full_dir, "CMakeLists.txt"), "".join(lines))
+                record_artifact(os.path.join(full_dir, "CMakeLists.txt"), "cmakelists_txt")
             gitignore_lines = sorted(full_dir_data.add_to_gitignore)
             gitignore_file = os.path.join(full_dir, ".gitignore")
             skip_this_gitignore = False
@@ -323,58 +1516,45 @@ def update_dependencies():
                 lines = []
                 if need_newline_in_gitignore:
                     lines.append("\n")
-                lines.append("# Added automatically by `pls`. Okay to push to git.\n")
+                lines.append(f"{gitignore_comment}\n")
                 for line in gitignore_lines:
                     if line not in present:
                         lines.append(f"{line}\n")
                 with open(gitignore_file, "a") as file:
                     file.writelines(lines)
+                added_lines = [line.strip() for line in lines if line.strip() != gitignore_comment]
+                record_gitignore_lines(gitignore_file, added_lines)
 
-    os.makedirs(flags.dotpls, exist_ok=True)
-
-    if not os.path.isfile(cc_instrument_sh):
-        with open(cc_instrument_sh, "w") as file:
-            file.write(cc_instrument_sh_contents)
-        os.chmod(cc_instrument_sh, 0o755)
+    install_dotpls_files()
 
-    if not os.path.isfile(git_clone_sh):
-        with open(git_clone_sh, "w") as file:
-            file.write(cc_git_clone_sh_contents)
-        os.chmod(git_clone_sh, 0o755)
-
-    if not os.path.isfile(pls_export_gdb_or_lldb_sh):
-        with open(pls_export_gdb_or_lldb_sh, "w") as file:
-            file.write(pls_export_gdb_or_lldb_sh_contents)
-        os.chmod(pls_export_gdb_or_lldb_sh, 0o755)
-
-    if not os.path.isdir(pls_h_dir):
-        os.makedirs(pls_h_dir, exist_ok=True)
-    if not os.path.isfile(pls_h):
-        with open(pls_h, "w") as file:
-            file.write(pls_h_contents)
-
-    traverse_source_tree()
+    if flags.locked:
+        materialize_locked_dependencies()
+    else:
+        traverse_source_tree()
 
     # TODO(dkorolev): Exclude the manually-added symlinks to the libraries, in `static/.vscode/settings.json`.
     if not os.path.isdir(".vscode"):
         if flags.verbose:
             print("PLS: Adding `.vscode` to `.gitignore`, as it was not here before.")
         per_dir[full_abspath].add_to_gitignore.append(".vscode")
-    os.makedirs(".vscode", exist_ok=True)
+        os.makedirs(".vscode")
+        record_artifact(".vscode", "vscode_dir")
     self_static_vscode_dir = os.path.join(self_static_dir, "dot_vscode")
     for dot_vs_code_static_file in os.listdir(self_static_vscode_dir):
         dst_static_file = os.path.join(".vscode", dot_vs_code_static_file)
         if not os.path.isfile(dst_static_file):
             with open(dst_static_file, "w") as file:
                 file.write(read_static_file(os.path.join(self_static_vscode_dir, dot_vs_code_static_file)))
+            record_artifact(dst_static_file, "vscode_file")
 
+    write_singleton_cmakelists_txts()
+    write_pch_cmake(per_dir[full_abspath].executables)
     apply_gitignore_changes_and_more()
 
 
 if __name__ == "__main__" and not cmd:
     # TODO(dkorolev): Differentiate between debug and release?
     # TODO(dkorolev): The "selfupdate" command, in case `pls` is `alias`-ed into a cloned repo?
-    # TODO(dkorolev): `test` to run the tests, and also `release_test`.
     print("PLS: Requires a command, the most common ones are `build`, `run`, `clean`, and `version`.")
     sys.exit(0)
 
@@ -383,21 +1563,113 @@ def cmd_version(unused_args):
     print(f"PLS {version} NOT READY YET")
 
 
+def is_symlink_into_dotpls(path):
+    # The symlinks to the dependencies `pls` creates point into `.pls/singleton_deps`, by their absolute paths.
+    return os.path.islink(path) and os.readlink(path).startswith(os.path.join(os.path.abspath(flags.dotpls), ""))
+
+
+def symlinks_into_dotpls(src_dir):
+    # For the `.pls` from before the manifest: the symlinks to the dependencies `pls` has created in `src_dir`.
+    try:
+        entries = list(os.scandir(src_dir))
+    except OSError:
+        return []
+    return [entry.path for entry in entries if is_symlink_into_dotpls(entry.path)]
+
+
+def remove_path(path):
+    if os.path.islink(path) or os.path.isfile(path):
+        os.unlink(path)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        return
+    if flags.verbose:
+        print(f"PLS: Removed `{os.path.relpath(path, full_abspath)}`.")
+
+
+def remove_gitignore_lines(gitignore_file, lines):
+    # Removes the lines `pls` has added, along with its comments before them.
+    if not os.path.isfile(gitignore_file):
+        return
+    with open(gitignore_file, "r") as file:
+        contents = file.read()
+    kept_lines = []
+    removed_after = False
+    for line in reversed(contents.split("\n")):
+        if line.strip().rstrip("/") in lines:
+            removed_after = True
+        elif line == gitignore_comment:
+            if not removed_after:
+                kept_lines.append(line)
+            removed_after = False
+        else:
+            kept_lines.append(line)
+    new_contents = "\n".join(reversed(kept_lines)).strip("\n")
+    if not new_contents:
+        os.unlink(gitignore_file)
+    elif new_contents + "\n" != contents:
+        with open(gitignore_file, "w") as file:
+            file.write(new_contents + "\n")
+
+
+def is_generated_cmakelists_txt(path):
+    # Unless the user has made it their own, which starts with removing the header.
+    if not os.path.isfile(path):
+        return False
+    with open(path, "r") as file:
+        return file.readline().startswith("# NOTE: This `CMakeLists.txt` is autogenerated by `pls`.")
+
+
 def cmd_clean(args):
-    traverse_source_tree()
-    previously_broken_symlinks = set()
-    for lib, _ in modules.items():
-        if os.path.islink(lib):
-            if not os.path.exists(os.readlink(lib)):
-                previously_broken_symlinks.add(lib)
-    result = subprocess.run(["rm", "-rf", ".pls", ".debug", ".release"])
-    for lib, _ in modules.items():
-        if os.path.islink(lib) and not os.path.exists(os.readlink(lib)) and not lib in previously_broken_symlinks:
-            if flags.verbose:
-                print(f"PLS: Unlinking the now-broken link to `{lib}`.")
-            os.unlink(lib)
-    if result.returncode != 0:
-        pls_fail("PLS: Could not clean the build.")
+    global manifest_dirty
+    clean_parser = argparse.ArgumentParser(
+        prog="pls clean", description="Remove what `pls` has created, except for the cloned dependencies and `.vscode`."
+    )
+    clean_level_group = clean_parser.add_mutually_exclusive_group()
+    clean_level_group.add_argument("--build-only", action="store_true", help="Only remove the build dirs.")
+    clean_level_group.add_argument("--full", action="store_true", help="Remove everything, and undo `.gitignore`.")
+    clean_args = clean_parser.parse_args(args)
+    level = 0 if clean_args.build_only else 2 if clean_args.full else 1
+    remaining_artifacts = {}
+    # The dirs go last, as the `.vscode` dir is only removed if nothing but the files `pls` created were in it.
+    artifacts = load_manifest()["artifacts"]
+    for rel_path, kind in sorted(artifacts.items(), key=lambda item: (item[1].endswith("_dir"), item)):
+        path = os.path.join(full_abspath, rel_path)
+        if clean_levels.get(kind, 2) > level:
+            remaining_artifacts[rel_path] = kind
+        elif kind == "cmakelists_txt":
+            if is_generated_cmakelists_txt(path):
+                remove_path(path)
+        elif kind == "vscode_dir":
+            if os.path.isdir(path) and not os.listdir(path):
+                os.rmdir(path)
+        else:
+            remove_path(path)
+    for build_dir, _, _ in build_configs.values():
+        remove_path(build_dir)
+    if level >= 1:
+        # Also after an older version of `pls`, which did not keep the manifest, even if a newer one has built since.
+        deps_dir = os.path.join(flags.dotpls, "deps")
+        lib_dirs = [entry.path for entry in os.scandir(deps_dir) if entry.is_dir()] if os.path.isdir(deps_dir) else []
+        for src_dir in ["."] + lib_dirs:
+            for symlink in symlinks_into_dotpls(src_dir):
+                remove_path(symlink)
+        if is_generated_cmakelists_txt("CMakeLists.txt"):
+            remove_path("CMakeLists.txt")
+    if level == 2:
+        for gitignore_file, lines in load_manifest()["gitignore"].items():
+            remove_gitignore_lines(os.path.join(full_abspath, gitignore_file), set(lines))
+        remove_path(flags.dotpls)
+    elif level == 1 and os.path.isdir(flags.dotpls):
+        for entry in os.scandir(flags.dotpls):
+            if entry.name != "deps":
+                remove_path(entry.path)
+    if os.path.isdir(flags.dotpls):
+        # Keeping track of what is left, for `pls clean --full` to remove later.
+        manifest["artifacts"] = remaining_artifacts
+        manifest_dirty = True
+        save_manifest()
     if flags.verbose:
         print("PLS: Clean successful.")
 
@@ -408,15 +1680,535 @@ def cmd_install(args):
         print("PLS: Dependencies cloned successfully.")
 
 
-def cmd_build(args):
+def cmd_lock(args):
+    # Locks the dependencies as they are checked out now, so `pls clean --full` first to lock their latest commits.
+    flags.locked = False
     update_dependencies()
-    # TODO(dkorolev): Debug/release.
-    result = subprocess.run(["cmake", "-B", ".debug", f"-DCMAKE_CXX_FLAGS=-I{os.path.abspath(pls_h_dir)}"])
-    if result.returncode != 0:
-        pls_fail("PLS: cmake configuration failed.")
-    result = subprocess.run(["cmake", "--build", ".debug"])
-    if result.returncode != 0:
-        pls_fail("PLS: cmake build failed.")
+    dependencies = {}
+    for lib, repo in sorted(modules.items()):
+        commit = read_git_head(f"{flags.dotpls}/deps/{lib}")
+        if commit is None:
+            pls_fail(f"PLS: Can not lock `{lib}`, as it is not checked out by `pls` into `{flags.dotpls}/deps`.")
+        imported_by = {}
+        for src_dir, src_dir_data in per_dir.items():
+            if lib in src_dir_data.deps:
+                executables = [exe for exe in src_dir_data.executables if lib in src_dir_data.executable_deps[exe]]
+                imported_by[lock_dir_name(src_dir)] = sorted(executables)
+        dependencies[lib] = {"repo": repo, "commit": commit, "imported_by": imported_by}
+    lock = {"format": pls_lock_format, "dependencies": dependencies}
+    write_file_if_changed(pls_lock, json.dumps(lock, indent=2, sort_keys=True) + "\n")
+    print(f"PLS: Locked {len(dependencies)} dependencies in `{pls_lock}`.")
+
+
+print_lock = threading.Lock()
+
+
+def cmake_generator_args(build_dir):
+    # Prefer Ninja, unless the build dir is already configured, as `cmake` refuses to change the generator,
+    # or unless the generator is set explicitly via `CMAKE_GENERATOR`.
+    if os.path.isfile(os.path.join(build_dir, "CMakeCache.txt")) or os.getenv("CMAKE_GENERATOR"):
+        return []
+    if shutil.which("ninja"):
+        return ["-G", "Ninja"]
+    return []
+
+
+def run_with_prefixed_output(command, prefix, config):
+    # Prefixes each line of the output, so that the interleaved outputs of the concurrent builds can be told apart.
+    if prefix is None:
+        return run_subprocess(command, "cmake", {"config": config}).returncode
+    with TraceSpan("cmake", "cmake", command=" ".join(command), config=config) as span:
+        process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace"
+        )
+        for line in process.stdout:
+            with print_lock:
+                print(f"[{prefix}] {line}", end="", flush=True)
+        span.args["exit_code"] = process.wait()
+    return span.args["exit_code"]
+
+
+def merge_ninja_log(ninja_log, offset, build_start, config):
+    # Adds the compile times of the individual targets from what Ninja appended to `.ninja_log` during the build.
+    # The overlapping jobs are spread over the "virtual" threads, so that they are all visible in the trace.
+    try:
+        with open(ninja_log, "r") as file:
+            file.seek(offset)
+            lines = file.read().split("\n")
+    except OSError:
+        return
+    entries = []
+    for line in lines:
+        fields = line.split("\t")
+        if not line.startswith("#") and len(fields) == 5:
+            entries.append((int(fields[0]), int(fields[1]), fields[3]))
+    lanes = []
+    for start_ms, end_ms, output in sorted(entries):
+        lane = next((i for i, lane_end in enumerate(lanes) if lane_end <= start_ms), len(lanes))
+        if lane == len(lanes):
+            lanes.append(end_ms)
+        else:
+            lanes[lane] = end_ms
+        parts = output.split("/")
+        impl_dirs = [parts[i - 1] for i in range(1, len(parts)) if parts[i] == "impl"]
+        add_trace_event(
+            os.path.basename(output),
+            "compile",
+            build_start + start_ms * 1000,
+            (end_ms - start_ms) * 1000,
+            tid=trace_thread_id(f"ninja {config} #{lane + 1}"),
+            file=output,
+            config=config,
+            dependency=impl_dirs[-1] if impl_dirs else None,
+        )
+
+
+def selected_config():
+    if flags.lto:
+        return "release_lto"
+    return "release" if flags.release else "debug"
+
+
+# For the unity builds, the `CMAKE_PROJECT_INCLUDE` that excludes the opted out sources from the unity batches. Each
+# target generated by `pls` is a single source, so only the targets with several sources, those of the dependencies,
+# are compiled any faster.
+# It runs once all the targets, including those of the dependencies, are defined, and matches the sources by their
+# real paths, as the dependencies are seen by `cmake` via the symlinks, which may not exist before the first build.
+unity_cmake = f"{flags.dotpls}/unity.cmake"
+unity_cmake_template = """# NOTE: This file is autogenerated by `pls` for `pls build --unity`, and is overwritten on each build.
+include_guard(GLOBAL)
+if(CMAKE_VERSION VERSION_LESS 3.19)
+  message(WARNING "PLS: Excluding the sources from the unity build requires CMake 3.19 or newer.")
+  return()
+endif()
+
+set(PLS_UNITY_EXCLUDE "{unity_exclude}")
+set(PLS_DEPS_DIR "{deps_dir}")
+
+function(pls_unity_exclude_in_dir dir)
+  get_property(targets DIRECTORY "${{dir}}" PROPERTY BUILDSYSTEM_TARGETS)
+  foreach(target IN LISTS targets)
+    get_target_property(sources ${{target}} SOURCES)
+    get_target_property(source_dir ${{target}} SOURCE_DIR)
+    foreach(source IN LISTS sources)
+      get_filename_component(abs_source "${{source}}" ABSOLUTE BASE_DIR "${{source_dir}}")
+      get_filename_component(real_source "${{abs_source}}" REALPATH)
+      foreach(exclude IN LISTS PLS_UNITY_EXCLUDE)
+        string(FIND "${{real_source}}" "${{exclude}}" position)
+        if(position EQUAL 0)
+          set_source_files_properties(
+            "${{abs_source}}" DIRECTORY "${{source_dir}}" PROPERTIES SKIP_UNITY_BUILD_INCLUSION ON
+          )
+        endif()
+      endforeach()
+    endforeach()
+  endforeach()
+  get_property(subdirs DIRECTORY "${{dir}}" PROPERTY SUBDIRECTORIES)
+  foreach(subdir IN LISTS subdirs)
+    pls_unity_exclude_in_dir("${{subdir}}")
+  endforeach()
+endfunction()
+
+function(pls_unity_exclude)
+  set(real_excludes)
+  foreach(exclude IN LISTS PLS_UNITY_EXCLUDE)
+    # As in `some_lib/src/odd.cc`, for the dependency that is symlinked as `some_lib`, via the singleton wrapper.
+    if(EXISTS "${{PLS_DEPS_DIR}}/${{exclude}}")
+      set(exclude "${{PLS_DEPS_DIR}}/${{exclude}}")
+    endif()
+    get_filename_component(real_exclude "${{exclude}}" REALPATH BASE_DIR "${{CMAKE_SOURCE_DIR}}")
+    if(IS_DIRECTORY "${{real_exclude}}")
+      string(APPEND real_exclude "/")
+    endif()
+    list(APPEND real_excludes "${{real_exclude}}")
+  endforeach()
+  set(PLS_UNITY_EXCLUDE "${{real_excludes}}")
+  pls_unity_exclude_in_dir("${{CMAKE_SOURCE_DIR}}")
+endfunction()
+
+cmake_language(DEFER DIRECTORY "${{CMAKE_SOURCE_DIR}}" CALL pls_unity_exclude)
+"""
+
+
+def parse_unity_settings(unity, pls_json_path):
+    # In `pls.json`, it is `"unity": true`, or `"unity": {"batch_size": 16, "exclude": ["src/odd.cc", "some_lib"]}`,
+    # where the paths are relative to the project dir, or to `.pls/deps`, and a dir excludes all the sources in it.
+    if not unity:
+        return None
+    if not isinstance(unity, dict):
+        unity = {}
+    batch_size = unity.get("batch_size", 8)
+    if not isinstance(batch_size, int) or batch_size < 0:
+        pls_fail(
+            f"PLS: The `unity.batch_size` in `{pls_json_path}` should be a non-negative integer, zero for no limit."
+        )
+    exclude = unity.get("exclude", [])
+    if not isinstance(exclude, list) or not all(isinstance(path, str) and path for path in exclude):
+        pls_fail(f"PLS: The `unity.exclude` in `{pls_json_path}` should be a list of paths, such as `src/odd.cc`.")
+    return {"batch_size": batch_size, "exclude": sorted(exclude)}
+
+
+def read_unity_settings():
+    # Returns `None` if the unity build is off, or its batch size and the paths of the sources excluded from it.
+    unity_settings = read_pls_json("pls.json")["unity"] if os.path.isfile("pls.json") else None
+    if unity_settings is None and flags.unity:
+        unity_settings = parse_unity_settings(True, "pls.json")
+    return unity_settings
+
+
+def unity_cmake_args(build_dir):
+    unity_settings = read_unity_settings()
+    if unity_settings is None:
+        # The cached `CMAKE_UNITY_BUILD` would otherwise stay on, once the build dir was configured with it.
+        cmake_cache_txt = os.path.join(build_dir, "CMakeCache.txt")
+        if os.path.isfile(cmake_cache_txt):
+            with open(cmake_cache_txt, "r") as file:
+                if "\nCMAKE_UNITY_BUILD:" in file.read():
+                    return ["-DCMAKE_UNITY_BUILD=OFF", "-UCMAKE_PROJECT_INCLUDE"]
+        return []
+    os.makedirs(flags.dotpls, exist_ok=True)
+    unity_cmake_contents = unity_cmake_template.format(
+        unity_exclude=";".join(unity_settings["exclude"]), deps_dir=os.path.abspath(f"{flags.dotpls}/deps")
+    )
+    write_file_if_changed(unity_cmake, unity_cmake_contents)
+    return [
+        "-DCMAKE_UNITY_BUILD=ON",
+        f"-DCMAKE_UNITY_BUILD_BATCH_SIZE={unity_settings['batch_size']}",
+        f"-DCMAKE_PROJECT_INCLUDE={os.path.abspath(unity_cmake)}",
+    ]
+
+
+# Each generated target is a single source, so a header is only worth precompiling if several targets include it,
+# and it is then precompiled once, for the first target, and reused by the rest. Only the system headers are considered,
+# as the include dirs of the dependencies differ from target to target. The headers are ranked by how many sources
+# include them times their preprocessed size, which is measured once per header and kept in the scan cache.
+# As the precompiled headers are included before the first line of the source, the targets the source of which, or
+# a header of the project it includes, defines or undefines a macro before including a system header, do not use them,
+# since that system header would otherwise be seen as included before that macro is defined, as in `_GLIBCXX_DEBUG`.
+pch_cmake = f"{flags.dotpls}/pch.cmake"
+pch_max_headers = 8
+pch_min_preprocessed_size = 64 * 1024
+
+
+def parse_pch_settings(pch, pls_json_path):
+    # In `pls.json`, it is `"pch": false`, or `"pch": {"include": ["vector"], "exclude": ["iostream"]}`.
+    if pch is False:
+        return None
+    if pch is True:
+        pch = {}
+    if not isinstance(pch, dict):
+        pls_fail(f"PLS: The `pch` in `{pls_json_path}` should be `true`, `false`, or an object.")
+    settings = {}
+    for key in ("include", "exclude"):
+        headers = pch.get(key, [])
+        if not isinstance(headers, list) or not all(isinstance(header, str) and header for header in headers):
+            pls_fail(f"PLS: The `pch.{key}` in `{pls_json_path}` should be a list of headers, such as `vector`.")
+        settings[key] = [header.strip("<>") for header in headers]
+    return settings
+
+
+def read_pch_settings(src_dir):
+    # Returns `None` if the precompiled headers are off, or the headers to always and to never precompile.
+    if flags.no_pch:
+        return None
+    pls_json_path = os.path.join(src_dir, "pls.json")
+    if os.path.isfile(pls_json_path):
+        return read_pls_json(pls_json_path)["pch"]
+    return parse_pch_settings(True, pls_json_path)
+
+
+def preprocessed_header_size(header):
+    path = None
+    for search_dir in get_system_include_dirs():
+        if os.path.isfile(os.path.join(search_dir, header)):
+            path = os.path.abspath(os.path.join(search_dir, header))
+            break
+    if path is None:
+        return 0
+    cached = cache_lookup("system_headers", header)
+    if cached is not None:
+        return cached["size"]
+    # The generated `CMakeLists.txt` sets C++11, with the GNU extensions on by default.
+    result = run_subprocess(
+        ["g++", "-x", "c++", "-std=gnu++11", "-E", "-P", "-"],
+        "scan",
+        {"file": path},
+        input=f"#include <{header}>\n",
+        capture_output=True,
+        text=True,
+    )
+    size = len(result.stdout) if result.returncode == 0 else 0
+    cache_store("system_headers", header, {path: True}, size=size)
+    return size
+
+
+@traced("phase")
+def select_precompiled_headers(src_dir, executables):
+    # Returns the headers to precompile for the executables generated for `src_dir`, as `<header>`-s, best first.
+    settings = read_pch_settings(src_dir)
+    if settings is None or not executables:
+        return []
+    include, exclude = settings["include"], settings["exclude"]
+    counts = defaultdict(int)
+    for src in executables.values():
+        for header in scanned_system_includes.get(os.path.abspath(os.path.join(src_dir, src)), []):
+            counts[header] += 1
+    candidates = sorted(h for h, count in counts.items() if count > 1 and h not in include and h not in exclude)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=flags.jobs) as pool:
+        sizes = dict(zip(candidates, pool.map(preprocessed_header_size, candidates)))
+    save_scan_cache()
+    ranked = sorted(
+        (h for h in candidates if sizes[h] >= pch_min_preprocessed_size), key=lambda h: -counts[h] * sizes[h]
+    )
+    return [f"<{header}>" for header in include + ranked[:pch_max_headers]]
+
+
+def executables_to_use_pch(src_dir, executables):
+    # Those of the executables generated for `src_dir` the sources of which define no macros before the system headers.
+    if read_pch_settings(src_dir) is None:
+        return {}
+    result = {}
+    for exe, src in executables.items():
+        if scanned_macros_before_system_includes.get(os.path.abspath(os.path.join(src_dir, src)), True):
+            if flags.verbose:
+                print(f"PLS: No precompiled headers for `{exe}`, as `{src}` defines macros before the system headers.")
+        else:
+            result[exe] = src
+    return result
+
+
+def write_pch_cmake(executables):
+    # Included by the generated `CMakeLists.txt`, which is kept once created, while the headers to precompile change.
+    lines = [
+        "# NOTE: This file is autogenerated by `pls`, and is overwritten on each build. See `pch` in `pls.json`.\n"
+    ]
+    executables = executables_to_use_pch(".", executables)
+    pch_headers = select_precompiled_headers(".", executables)
+    if pch_headers:
+        first_exe, *other_exes = executables
+        lines.append(f"if(CMAKE_VERSION VERSION_LESS 3.16 OR NOT TARGET {first_exe})\n")
+        lines.append("  return()\n")
+        lines.append("endif()\n")
+        lines.append(f"target_precompile_headers({first_exe} PRIVATE {' '.join(pch_headers)})\n")
+        for exe in other_exes:
+            lines.append(f"if(TARGET {exe})\n")
+            lines.append(f"  target_precompile_headers({exe} REUSE_FROM {first_exe})\n")
+            lines.append("endif()\n")
+    os.makedirs(flags.dotpls, exist_ok=True)
+    write_file_if_changed(pch_cmake, "".join(lines))
+
+
+def prebuilt_dependency_source(lib):
+    # The repo and the commit of the dependency if it can be prebuilt, which is when it imports nothing itself, and
+    # its checkout is as cloned, as otherwise the same commit would not mean the same library.
+    if not flags.prebuilt_deps:
+        return None
+    lib_dir = os.path.abspath(f"{flags.dotpls}/deps/{lib}")
+    if flags.locked:
+        if any(lib in dependency["imported_by"] for dependency in read_pls_lock().values()):
+            return None
+    elif lib_dir not in already_traversed_src_dirs or per_dir[lib_dir].deps:
+        return None
+    commit = read_git_head(lib_dir)
+    if commit is None or dependency_has_local_changes(lib):
+        return None
+    return modules[lib], commit
+
+
+def dependency_has_local_changes(lib):
+    # Except for `.gitignore`, to which `pls` itself may have added the lines.
+    lib_dir = f"{flags.dotpls}/deps/{lib}"
+    status = ["git", "-C", lib_dir, "status", "--porcelain", "--untracked-files=no", "--", ".", ":!.gitignore"]
+    result = run_subprocess(status, "git", capture_output=True, text=True)
+    if result.returncode != 0 or result.stdout.strip():
+        if flags.verbose:
+            print(f"PLS: `{lib}` has local changes, will not use the prebuilt one.")
+        return True
+    return False
+
+
+def write_singleton_cmakelists_txts():
+    # On each full run, as whether each dependency can be prebuilt, and at which commit, may have changed.
+    for lib in sorted(modules):
+        wrapper_dir = os.path.join(os.path.abspath(flags.dotpls), "singleton_deps", lib)
+        if os.path.isdir(wrapper_dir):
+            contents = singleton_cmakelists_txt_contents(lib, prebuilt_dependency_source(lib))
+            write_file_if_changed(os.path.join(wrapper_dir, "CMakeLists.txt"), contents)
+
+
+# The shared locks of the cached prebuilt dependencies in use, held until `pls` exits.
+held_cache_locks = []
+
+
+def release_held_cache_locks():
+    # For `pls watch`, which locks the prebuilt dependencies in use anew on each rebuild.
+    for lock in held_cache_locks:
+        lock.__exit__()
+    held_cache_locks.clear()
+
+
+def lock_prebuilt_deps_in_use(build_dir):
+    # Locks the prebuilt dependencies the build dir is configured to use, so that `pls cache gc` does not evict them
+    # while they are being linked, and marks them as just used. Returns whether all of them are still in the cache,
+    # and still what the checkouts of the dependencies would build.
+    prebuilt_dir = os.path.join(build_dir, ".pls_prebuilt")
+    if not os.path.isdir(prebuilt_dir):
+        return True
+    for lib in sorted(os.listdir(prebuilt_dir)):
+        used_txt = os.path.join(prebuilt_dir, lib, "used.txt")
+        if os.path.isfile(used_txt):
+            with open(used_txt, "r") as file:
+                entry_dir = file.read().strip()
+            lock = CacheLock(entry_dir, shared=True)
+            lock.__enter__()
+            if not os.path.isdir(entry_dir):
+                # Not holding the lock, so that this very `pls` can store the dependency once it is built.
+                lock.__exit__()
+                if flags.verbose:
+                    print(f"PLS: The prebuilt `{lib}` is no longer in the cache, will build it.")
+                return False
+            if dependency_has_local_changes(lib):
+                lock.__exit__()
+                return False
+            held_cache_locks.append(lock)
+            os.utime(lock.lock_path)
+            if flags.verbose:
+                print(f"PLS: Using the prebuilt `{lib}` from `{entry_dir}`.")
+    return True
+
+
+prebuilt_header_suffixes = (".h", ".hh", ".hpp", ".hxx", ".inl", ".ipp", ".inc")
+
+
+def store_prebuilt_dependency(export_dir):
+    # Stores what `.pls/prebuilt_deps.cmake` has exported, the headers and the libraries built, into the cache,
+    # relocated, so that the other projects can import them from there.
+    with open(os.path.join(export_dir, "entry.json"), "r") as file:
+        entry = json.loads(file.read())
+    with open(os.path.join(export_dir, "targets.cmake"), "r") as file:
+        targets_cmake = file.read()
+    lib, source_dir, binary_dir = entry["lib"], entry["source_dir"], entry["binary_dir"]
+    entry_dir = os.path.join(artifacts_cache_dir, entry["key"])
+    # Cheaper to check before taking the lock, and the checkout may have been changed since it was configured.
+    if os.path.isdir(entry_dir) or dependency_has_local_changes(lib):
+        return
+    libraries = re.findall(r'IMPORTED_LOCATION_\w+ "([^"]+)"', targets_cmake)
+    if not all(os.path.isfile(library) and library.startswith(binary_dir + "/") for library in libraries):
+        # Not all the libraries were built, as with `--target`, or not where they could be found.
+        return
+    for path, placeholder in [(binary_dir, "build"), (source_dir, "src"), (os.path.realpath(source_dir), "src")]:
+        targets_cmake = targets_cmake.replace(path, "${PLS_PREBUILT_DIR}/" + placeholder)
+    if full_abspath in targets_cmake or os.path.realpath(full_abspath) in targets_cmake:
+        if flags.verbose:
+            print(f"PLS: `{lib}` refers to the project, will not store it as prebuilt.")
+        return
+    targets_cmake += "\n# Added by `pls`, for the other directories of the project to see these targets.\n"
+    for target in entry["targets"]:
+        targets_cmake += f"set_target_properties({target} PROPERTIES IMPORTED_GLOBAL TRUE)\n"
+
+    with CacheLock(entry_dir, blocking=False) as locked:
+        # If locked, another `pls` is storing this very dependency right now.
+        if not locked or os.path.isdir(entry_dir):
+            return
+        # Stored into a temporary dir first, so that the projects never see a partially stored dependency.
+        tmp_entry_dir = f"{entry_dir}.tmp"
+        shutil.rmtree(tmp_entry_dir, ignore_errors=True)
+        shutil.copytree(os.path.realpath(source_dir), f"{tmp_entry_dir}/src", ignore=shutil.ignore_patterns(".git"))
+        # From the build dir, the libraries, and the headers generated while configuring or building.
+        for dir_path, dir_names, file_names in os.walk(binary_dir):
+            dir_names[:] = [name for name in dir_names if name != "CMakeFiles"]
+            for name in file_names:
+                path = os.path.join(dir_path, name)
+                if path in libraries or name.endswith(prebuilt_header_suffixes):
+                    dst_path = os.path.join(tmp_entry_dir, "build", os.path.relpath(path, binary_dir))
+                    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+                    shutil.copy2(path, dst_path)
+        with open(f"{tmp_entry_dir}/targets.cmake", "w") as file:
+            file.write(targets_cmake)
+        with open(f"{tmp_entry_dir}/entry.json", "w") as file:
+            file.write(json.dumps({key: entry[key] for key in ["lib", "repo", "commit", "targets"]}, indent=2) + "\n")
+        os.rename(tmp_entry_dir, entry_dir)
+        os.utime(f"{entry_dir}.lock")
+        if flags.verbose:
+            print(f"PLS: Stored the prebuilt `{lib}` in `{entry_dir}`.")
+
+
+def store_prebuilt_deps(build_dir):
+    prebuilt_dir = os.path.join(build_dir, ".pls_prebuilt")
+    if os.path.isdir(prebuilt_dir):
+        for lib in sorted(os.listdir(prebuilt_dir)):
+            if os.path.isfile(os.path.join(prebuilt_dir, lib, "entry.json")):
+                store_prebuilt_dependency(os.path.join(prebuilt_dir, lib))
+
+
+def config_cmake_args(config, extra_cxx_flags=""):
+    build_dir, build_type, extra_cmake_args = build_configs[config]
+    return (
+        [
+            "-B",
+            build_dir,
+            f"-DCMAKE_BUILD_TYPE={build_type}",
+            f"-DCMAKE_CXX_FLAGS=-I{os.path.abspath(pls_h_dir)}{extra_cxx_flags}",
+        ]
+        + extra_cmake_args
+        + unity_cmake_args(build_dir)
+    )
+
+
+def update_dependencies_for_configs(configs, cmake_args):
+    # Returns which of the build dirs need to be configured, having updated the dependencies if any of them does.
+    need_configure = {c: not is_build_up_to_date(build_configs[c][0], cmake_args[c]) for c in configs}
+    if any(need_configure.values()):
+        for config in configs:
+            if build_configs[config][0] not in per_dir[full_abspath].add_to_gitignore:
+                per_dir[full_abspath].add_to_gitignore.append(build_configs[config][0])
+        update_dependencies()
+    elif flags.verbose:
+        print("PLS: Nothing to reconfigure, will just build.")
+    return need_configure
+
+
+def configure_and_build(config, cmake_args, need_configure, prefix=None, build_args=()):
+    build_dir = build_configs[config][0]
+    if need_configure:
+        record_artifact(build_dir, "build_dir")
+        # Configured once more if a prebuilt dependency it has picked got evicted from the cache in the meantime.
+        for _ in range(2):
+            # What the previous configuration has picked and exported does not apply.
+            shutil.rmtree(os.path.join(build_dir, ".pls_prebuilt"), ignore_errors=True)
+            if run_with_prefixed_output(["cmake"] + cmake_generator_args(build_dir) + cmake_args, prefix, config) != 0:
+                # The build dir is in an unknown state now, so the next build must not take the no-op fast path.
+                forget_build_fingerprint(build_dir)
+                return f"PLS: cmake configuration of `{config}` failed."
+            if lock_prebuilt_deps_in_use(build_dir):
+                break
+        record_build_fingerprint(build_dir, cmake_args)
+    ninja_log = os.path.join(build_dir, ".ninja_log")
+    ninja_log_offset = os.path.getsize(ninja_log) if os.path.isfile(ninja_log) else 0
+    build_start = trace_timestamp()
+    build_command = ["cmake", "--build", build_dir, "-j", str(flags.jobs)] + list(build_args)
+    returncode = run_with_prefixed_output(build_command, prefix, config)
+    if flags.profile and os.path.isfile(ninja_log) and os.path.getsize(ninja_log) >= ninja_log_offset:
+        merge_ninja_log(ninja_log, ninja_log_offset, build_start, config)
+    if returncode != 0:
+        return f"PLS: cmake build of `{config}` failed."
+    if flags.prebuilt_deps:
+        store_prebuilt_deps(build_dir)
+    return None
+
+
+def cmd_build(args):
+    configs = ["debug", "release"] if flags.all_configs else [selected_config()]
+    cmake_args = {config: config_cmake_args(config) for config in configs}
+    need_configure = update_dependencies_for_configs(configs, cmake_args)
+    if len(configs) == 1:
+        errors = [configure_and_build(configs[0], cmake_args[configs[0]], need_configure[configs[0]])]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(configs)) as pool:
+            errors = list(pool.map(lambda c: configure_and_build(c, cmake_args[c], need_configure[c], c), configs))
+    errors = [error for error in errors if error]
+    if errors:
+        pls_fail("\n".join(errors))
     if flags.verbose:
         print("PLS: Build successful.")
 
@@ -424,21 +2216,742 @@ def cmd_build(args):
 def cmd_run(args):
     cmd_build([])
     # TODO(dkorolev): Forward the command line? And test it?
+    build_dir = build_configs[selected_config()][0]
     executables = per_dir[os.path.abspath(".")].executables
     if not args:
         if len(executables) == 1:
-            result = subprocess.run([f"./.debug/{next(iter(executables.keys()))}"])
+            result = run_subprocess([f"./{build_dir}/{next(iter(executables.keys()))}"], "run")
         else:
             pls_fail(
                 f"PLS: Has more than one executable, specify the name direcly, one of {json.dumps(list(executables.keys()))}."
             )
     else:
         if args[0] in executables:
-            result = subprocess.run([f"./.debug/{args[0]}"])
+            result = run_subprocess([f"./{build_dir}/{args[0]}"], "run")
         else:
             pls_fail(f"PLS: Executable `{args[0]}` is not in {json.dumps(list(executables.keys()))}.")
 
 
+def is_clang():
+    # What `cmake` would pick as the C++ compiler, to know which profile-guided optimization flags does it take.
+    result = run_subprocess([os.getenv("CXX") or "c++", "--version"], "pgo", capture_output=True, text=True)
+    return result.returncode == 0 and "clang" in result.stdout.lower()
+
+
+def cmd_pgo(args):
+    # Builds the executable instrumented to collect the profile, runs it on the training workload, and then builds
+    # the executable optimized using this profile into `.release_pgo`. Each step only rebuilds the given executable.
+    if "--" in args:
+        training_args = args[args.index("--") + 1 :]
+        args = args[: args.index("--")]
+    else:
+        training_args = args[1:]
+        args = args[:1]
+    if len(args) != 1:
+        pls_fail("PLS: Usage: `pls pgo <executable> -- <training args>`.")
+    exe = args[0]
+    profile_dir = os.path.abspath(f"{flags.dotpls}/pgo/{exe}")
+    clang = is_clang()
+    if clang:
+        profile_data = os.path.join(profile_dir, "default.profdata")
+        generate_flags = f" -fprofile-generate={profile_dir}"
+        use_flags = f" -fprofile-use={profile_data} -Wno-profile-instr-unprofiled -Wno-profile-instr-out-of-date"
+    else:
+        # With GCC, the profile of each object file is named after its path, so the build dir prefix is stripped,
+        # for the profiles from `.pgo_instrumented` to be found when building in `.release_pgo`.
+        instrumented_dir = os.path.abspath(build_configs["pgo_instrumented"][0])
+        release_pgo_dir = os.path.abspath(build_configs["release_pgo"][0])
+        generate_flags = f" -fprofile-generate={profile_dir} -fprofile-prefix-path={instrumented_dir}"
+        use_flags = f" -fprofile-use={profile_dir} -fprofile-prefix-path={release_pgo_dir} -Wno-missing-profile"
+    configs = ["pgo_instrumented", "release_pgo"]
+    cmake_args = {
+        "pgo_instrumented": config_cmake_args("pgo_instrumented", generate_flags),
+        "release_pgo": config_cmake_args("release_pgo", use_flags),
+    }
+    need_configure = update_dependencies_for_configs(configs, cmake_args)
+    if exe not in per_dir[full_abspath].executables:
+        pls_fail(f"PLS: Executable `{exe}` is not in {json.dumps(list(per_dir[full_abspath].executables.keys()))}.")
+
+    error = configure_and_build(
+        "pgo_instrumented",
+        cmake_args["pgo_instrumented"],
+        need_configure["pgo_instrumented"],
+        build_args=["--target", exe],
+    )
+    if error:
+        pls_fail(error)
+    # The profile from the previous training run would otherwise be accumulated into.
+    shutil.rmtree(profile_dir, ignore_errors=True)
+    os.makedirs(profile_dir)
+    print(f"PLS: Collecting the profile of `{exe}`.")
+    instrumented_exe = os.path.join(build_configs["pgo_instrumented"][0], exe)
+    result = run_subprocess([f"./{instrumented_exe}"] + training_args, "pgo")
+    if result.returncode != 0:
+        pls_fail(f"PLS: The training run of `{exe}` failed with code {result.returncode}.")
+    if clang:
+        raw_profiles = [os.path.join(profile_dir, f) for f in os.listdir(profile_dir) if f.endswith(".profraw")]
+        result = run_subprocess(["llvm-profdata", "merge", "-o", profile_data] + raw_profiles, "pgo")
+        if result.returncode != 0:
+            pls_fail("PLS: Could not merge the profile with `llvm-profdata`.")
+
+    # The compiler does not know the objects depend on the profile, so they are rebuilt from scratch.
+    error = configure_and_build(
+        "release_pgo",
+        cmake_args["release_pgo"],
+        need_configure["release_pgo"],
+        build_args=["--target", exe, "--clean-first"],
+    )
+    if error:
+        pls_fail(error)
+    print(f"PLS: The profile-optimized `{exe}` is `{os.path.join(build_configs['release_pgo'][0], exe)}`.")
+
+
+def parse_cpu_list(cpus):
+    # The `taskset`-style list, such as `0,2-3`.
+    result = set()
+    try:
+        for part in cpus.split(","):
+            first, _, last = part.partition("-")
+            result.update(range(int(first), int(last or first) + 1))
+    except ValueError:
+        pls_fail(f"PLS: Can not parse the CPU list `{cpus}`, expecting something like `0,2-3`.")
+    return result
+
+
+def percentile(values, q):
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def format_duration(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds:.3f}s"
+
+
+def run_benchmark_once(path, bench_args, cpus):
+    # Returns the wall time, the user and system CPU time, and the max RSS in bytes, of a single run.
+    with TraceSpan(os.path.basename(path), "bench", command=" ".join([path] + bench_args)) as span:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [path] + bench_args,
+            stdout=None if flags.verbose else subprocess.DEVNULL,
+            preexec_fn=(lambda: os.sched_setaffinity(0, cpus)) if cpus else None,
+        )
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        span.args["exit_code"] = process.returncode
+    if process.returncode != 0:
+        pls_fail(f"PLS: Benchmark `{path}` failed with code {process.returncode}.")
+    # The max RSS is in kilobytes on Linux, and in bytes on macOS.
+    max_rss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+    return {"wall": wall, "user": rusage.ru_utime, "sys": rusage.ru_stime, "max_rss": max_rss}
+
+
+def summarize_benchmark_runs(runs):
+    summary = {}
+    for metric in ["wall", "user", "sys", "max_rss"]:
+        values = [run[metric] for run in runs]
+        summary[metric] = {f"p{q}": percentile(values, q) for q in [10, 50, 90]}
+        summary[metric]["min"] = min(values)
+        summary[metric]["max"] = max(values)
+    return summary
+
+
+def executables_listed_in_pls_json(key):
+    # The executables listed in the `pls.json` of the project, as `"bench"` or `"test"`, each of which should exist.
+    listed = read_pls_json("pls.json")[key] if os.path.isfile("pls.json") else []
+    executables = per_dir[full_abspath].executables
+    for exe in listed:
+        if exe not in executables:
+            kind = "Benchmark" if key == "bench" else "Test"
+            pls_fail(f"PLS: {kind} `{exe}` from `pls.json` is not in {json.dumps(list(executables.keys()))}.")
+    return listed
+
+
+def cmd_bench(args):
+    bench_parser = argparse.ArgumentParser(
+        prog="pls bench", description="Build and run the benchmarks, `pls bench [benchmarks] -- [args to them]`."
+    )
+    bench_parser.add_argument("benchmarks", nargs="*", help="The benchmarks to run, all of them by default.")
+    bench_parser.add_argument("--runs", type=int, default=10, help="The number of measured runs, 10 by default.")
+    bench_parser.add_argument("--warmup", type=int, default=1, help="The number of runs not measured, 1 by default.")
+    bench_parser.add_argument("--cpus", type=str, help="Pin the benchmarks to these CPUs, as in `0,2-3`.")
+    bench_parser.add_argument("--compare", action="store_true", help="Compare to the baseline, fail on regressions.")
+    bench_parser.add_argument("--threshold", type=float, default=5.0, help="The regression threshold, 5%% by default.")
+    bench_parser.add_argument("--save-baseline", action="store_true", help="Save the results as the new baseline.")
+    bench_args = []
+    if "--" in args:
+        bench_args = args[args.index("--") + 1 :]
+        args = args[: args.index("--")]
+    bench_flags = bench_parser.parse_args(args)
+    if bench_flags.runs < 1 or bench_flags.warmup < 0:
+        pls_fail("PLS: The number of runs should be positive, and the number of warmup runs should not be negative.")
+    cpus = parse_cpu_list(bench_flags.cpus) if bench_flags.cpus else None
+    if cpus and not hasattr(os, "sched_setaffinity"):
+        pls_fail("PLS: Pinning to CPUs with `--cpus` is not supported on this platform.")
+
+    # The benchmarks are the `bench_*.cc` sources, and the executables listed in `pls.json` as `"bench"`.
+    config = "release_lto" if flags.lto else "release"
+    cmake_args = config_cmake_args(config)
+    need_configure = update_dependencies_for_configs([config], {config: cmake_args})[config]
+    executables = per_dir[full_abspath].executables
+    benchmarks = [exe for exe in executables if exe.startswith("bench_")]
+    benchmarks += [exe for exe in executables_listed_in_pls_json("bench") if exe not in benchmarks]
+    for exe in bench_flags.benchmarks:
+        if exe not in benchmarks:
+            pls_fail(f"PLS: Benchmark `{exe}` is not in {json.dumps(benchmarks)}.")
+    benchmarks = sorted(bench_flags.benchmarks or benchmarks)
+    if not benchmarks:
+        pls_fail('PLS: No benchmarks, name them `bench_*.cc`, or list them in `pls.json` as `"bench"`.')
+    error = configure_and_build(config, cmake_args, need_configure, build_args=["--target"] + benchmarks)
+    if error:
+        pls_fail(error)
+
+    results = {"version": version, "config": config, "benchmarks": {}}
+    for exe in benchmarks:
+        path = os.path.abspath(os.path.join(build_configs[config][0], exe))
+        for _ in range(bench_flags.warmup):
+            run_benchmark_once(path, bench_args, cpus)
+        runs = [run_benchmark_once(path, bench_args, cpus) for _ in range(bench_flags.runs)]
+        summary = summarize_benchmark_runs(runs)
+        results["benchmarks"][exe] = {"runs": runs, "summary": summary}
+        wall = summary["wall"]
+        print(
+            f"PLS: `{exe}`: wall {format_duration(wall['p50'])} median,"
+            f" {format_duration(wall['p10'])} p10, {format_duration(wall['p90'])} p90,"
+            f" user {format_duration(summary['user']['p50'])}, sys {format_duration(summary['sys']['p50'])},"
+            f" max RSS {format_size(int(summary['max_rss']['p50']))}, {bench_flags.runs} runs."
+        )
+
+    bench_dir = f"{flags.dotpls}/bench"
+    baseline_json = f"{bench_dir}/baseline.json"
+    baseline = None
+    if os.path.isfile(baseline_json):
+        with open(baseline_json, "r") as file:
+            baseline = json.loads(file.read())
+    os.makedirs(bench_dir, exist_ok=True)
+    write_file_if_changed(f"{bench_dir}/latest.json", json.dumps(results, indent=2) + "\n")
+    if bench_flags.save_baseline or baseline is None:
+        write_file_if_changed(baseline_json, json.dumps(results, indent=2) + "\n")
+        print(f"PLS: Saved the results as the baseline, `{baseline_json}`.")
+
+    if bench_flags.compare:
+        if baseline is None:
+            pls_fail("PLS: No baseline to compare to, run `pls bench` first.")
+        regressions = 0
+        for exe, result in results["benchmarks"].items():
+            if exe not in baseline["benchmarks"]:
+                print(f"PLS: `{exe}` is not in the baseline.")
+                continue
+            for metric, format_value in [("wall", format_duration), ("max_rss", lambda v: format_size(int(v)))]:
+                value = result["summary"][metric]["p50"]
+                baseline_value = baseline["benchmarks"][exe]["summary"][metric]["p50"]
+                change = (value / baseline_value - 1) * 100 if baseline_value else 0
+                regressed = change > bench_flags.threshold
+                regressions += regressed
+                print(
+                    f"PLS: `{exe}` {metric}: {format_value(value)} vs. {format_value(baseline_value)},"
+                    f" {change:+.1f}%{', REGRESSION' if regressed else ''}."
+                )
+        if regressions:
+            pls_fail(f"PLS: {regressions} regressions beyond {bench_flags.threshold}%.")
+
+
+def parse_shard(shard):
+    # The `i/n` of `--shard`, one-based, so that `1/2` and `2/2` split the tests in two.
+    match = re.fullmatch(r"(\d+)/(\d+)", shard)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        pls_fail(f"PLS: Can not parse the shard `{shard}`, expecting `i/n`, such as `1/4`, with `1 <= i <= n`.")
+    return int(match.group(1)), int(match.group(2))
+
+
+def run_test_once(path, test_args, timeout):
+    # Returns the outcome, `passed`, `failed`, or `timeout`, along with the duration and the output, of a single run.
+    with TraceSpan(os.path.basename(path), "test", command=" ".join([path] + test_args)) as span:
+        start = time.perf_counter()
+        # In its own process group, so that on timeout whatever the test has started is killed too.
+        process = subprocess.Popen(
+            [path] + test_args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True
+        )
+        try:
+            output, _ = process.communicate(timeout=timeout)
+            outcome = "passed" if process.returncode == 0 else "failed"
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            output, _ = process.communicate()
+            outcome = "timeout"
+        duration = time.perf_counter() - start
+        span.args["exit_code"] = process.returncode
+    output = output.decode(errors="replace")
+    return {"outcome": outcome, "exit_code": process.returncode, "duration": duration, "output": output}
+
+
+def run_test_with_retries(exe, path, test_args, timeout, retries):
+    attempts = [run_test_once(path, test_args, timeout)]
+    while attempts[-1]["outcome"] != "passed" and len(attempts) <= retries:
+        attempts.append(run_test_once(path, test_args, timeout))
+    result = {"outcome": attempts[-1]["outcome"], "duration": attempts[-1]["duration"], "attempts": attempts}
+    result["flaky"] = result["outcome"] == "passed" and len(attempts) > 1
+    last = attempts[-1]
+    attempts_note = f", after {len(attempts)} attempts" if len(attempts) > 1 else ""
+    if last["outcome"] == "passed":
+        flaky_note = ", flaky" if result["flaky"] else ""
+        message = f"PLS: `{exe}` passed in {format_duration(last['duration'])}{flaky_note}{attempts_note}."
+    elif last["outcome"] == "failed":
+        duration = format_duration(last["duration"])
+        message = f"PLS: `{exe}` failed with code {last['exit_code']} in {duration}{attempts_note}."
+    else:
+        message = f"PLS: `{exe}` timed out after {format_duration(timeout)}{attempts_note}."
+    with print_lock:
+        print(message)
+        if last["outcome"] != "passed" or flags.verbose:
+            sys.stdout.write(last["output"])
+        sys.stdout.flush()
+    return result
+
+
+def junit_xml(results):
+    # The JUnit XML report, as CI systems understand it: the timeouts are errors, the other failures are failures.
+    failures = sum(result["outcome"] == "failed" for result in results.values())
+    errors = sum(result["outcome"] == "timeout" for result in results.values())
+    total_time = sum(attempt["duration"] for result in results.values() for attempt in result["attempts"])
+    testsuites = xml.etree.ElementTree.Element("testsuites")
+    testsuite = xml.etree.ElementTree.SubElement(
+        testsuites,
+        "testsuite",
+        name="pls",
+        tests=str(len(results)),
+        failures=str(failures),
+        errors=str(errors),
+        skipped="0",
+        time=f"{total_time:.3f}",
+    )
+    for exe, result in results.items():
+        testcase = xml.etree.ElementTree.SubElement(
+            testsuite, "testcase", classname="pls", name=exe, time=f"{result['duration']:.3f}"
+        )
+        last = result["attempts"][-1]
+        if result["outcome"] == "failed":
+            failure = xml.etree.ElementTree.SubElement(testcase, "failure", message=f"Exit code {last['exit_code']}.")
+            failure.text = last["output"]
+        elif result["outcome"] == "timeout":
+            error = xml.etree.ElementTree.SubElement(testcase, "error", message="Timed out.")
+            error.text = last["output"]
+        elif last["output"]:
+            xml.etree.ElementTree.SubElement(testcase, "system-out").text = last["output"]
+    xml.etree.ElementTree.indent(testsuites)
+    return xml.etree.ElementTree.tostring(testsuites, encoding="unicode", xml_declaration=True) + "\n"
+
+
+def cmd_test(args):
+    test_parser = argparse.ArgumentParser(
+        prog="pls test", description="Build and run the tests, `pls test [tests] -- [args to them]`."
+    )
+    test_parser.add_argument("tests", nargs="*", help="The tests to run, all of them by default.")
+    test_parser.add_argument("--timeout", type=float, default=300, help="Per test run, 300s by default, 0 for none.")
+    test_parser.add_argument("--shard", type=str, help="Only run this shard of the tests, `i/n`, as in `1/4`.")
+    test_parser.add_argument("--retries", type=int, default=0, help="Rerun the failed tests up to this many times.")
+    test_parser.add_argument("--junit", type=str, help="Write the results into this file, as JUnit XML.")
+    test_parser.add_argument("--json", type=str, help="Write the results into this file, as JSON.")
+    test_args = []
+    if "--" in args:
+        test_args = args[args.index("--") + 1 :]
+        args = args[: args.index("--")]
+    test_flags = test_parser.parse_args(args)
+    if test_flags.timeout < 0 or test_flags.retries < 0:
+        pls_fail("PLS: Neither the timeout nor the number of retries should be negative.")
+    timeout = test_flags.timeout or None
+
+    # The tests are the `test_*.cc` sources, and the executables listed in `pls.json` as `"test"`.
+    config = selected_config()
+    cmake_args = config_cmake_args(config)
+    need_configure = update_dependencies_for_configs([config], {config: cmake_args})[config]
+    executables = per_dir[full_abspath].executables
+    tests = [exe for exe in executables if exe.startswith("test_")]
+    tests += [exe for exe in executables_listed_in_pls_json("test") if exe not in tests]
+    for exe in test_flags.tests:
+        if exe not in tests:
+            pls_fail(f"PLS: Test `{exe}` is not in {json.dumps(tests)}.")
+    tests = sorted(test_flags.tests or tests)
+    if not tests:
+        pls_fail('PLS: No tests, name them `test_*.cc`, or list them in `pls.json` as `"test"`.')
+    if test_flags.shard:
+        # By the names of the tests, so that each machine running a shard agrees on which tests are in it.
+        shard_index, shard_count = parse_shard(test_flags.shard)
+        tests = tests[shard_index - 1 :: shard_count]
+        if not tests:
+            print(f"PLS: No tests in shard {test_flags.shard}.")
+            return
+    error = configure_and_build(config, cmake_args, need_configure, build_args=["--target"] + tests)
+    if error:
+        pls_fail(error)
+
+    # The slowest tests, by the durations of their previous runs, start first, so that they do not start last, and
+    # the tests that have not been run before start even before them, as they may well be the slowest.
+    test_dir = f"{flags.dotpls}/test"
+    durations_json = f"{test_dir}/durations.json"
+    durations = {}
+    if os.path.isfile(durations_json):
+        with open(durations_json, "r") as file:
+            durations = json.loads(file.read())
+    tests.sort(key=lambda exe: -durations.get(exe, float("inf")))
+    build_dir = build_configs[config][0]
+
+    def run_test(exe):
+        path = os.path.abspath(os.path.join(build_dir, exe))
+        return run_test_with_retries(exe, path, test_args, timeout, test_flags.retries)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(flags.jobs, len(tests))) as pool:
+        results = dict(zip(tests, pool.map(run_test, tests)))
+    results = dict(sorted(results.items()))
+
+    os.makedirs(test_dir, exist_ok=True)
+    durations.update({exe: result["duration"] for exe, result in results.items()})
+    write_file_if_changed(durations_json, json.dumps(durations, indent=2, sort_keys=True) + "\n")
+    report = {"version": version, "config": config, "shard": test_flags.shard, "tests": results}
+    write_file_if_changed(f"{test_dir}/latest.json", json.dumps(report, indent=2) + "\n")
+    if test_flags.json:
+        write_file_if_changed(test_flags.json, json.dumps(report, indent=2) + "\n")
+    if test_flags.junit:
+        write_file_if_changed(test_flags.junit, junit_xml(results))
+
+    failed = [exe for exe, result in results.items() if result["outcome"] != "passed"]
+    flaky = [exe for exe, result in results.items() if result["flaky"]]
+    summary = f"PLS: {len(results) - len(failed)} of {len(results)} tests passed"
+    summary += f", {len(flaky)} of them flaky." if flaky else "."
+    if failed:
+        pls_fail(f"{summary} Failed: {', '.join(f'`{exe}`' for exe in failed)}.")
+    print(summary)
+
+
+# For `pls watch`, the files the changes to which matter, by their names, in the source dirs and in `.git`.
+watched_suffixes = (".cc", ".cpp", ".cxx", ".c", ".h", ".hh", ".hpp", ".hxx", ".inl", ".ipp")
+watched_names = {"pls.json", "CMakeLists.txt", "HEAD", "src"}
+
+
+def is_watched_name(name):
+    return name.endswith(watched_suffixes) or name in watched_names
+
+
+def is_watched_dir_name(name):
+    # The sources are looked for in the subdirs too, so a new or removed subdir is a change, unless it is hidden,
+    # as `.git`, `.pls`, and the build dirs are.
+    return not name.startswith(".")
+
+
+class InotifyWatcher:
+    # Linux-only, via `ctypes`, to not depend on any third-party packages.
+    IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x2, 0x4, 0x8
+    IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+    IN_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    IN_ISDIR = 0x40000000
+    IN_DIR_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.dirs = {}
+
+    def set_dirs(self, dirs):
+        for wd, watched_dir in list(self.dirs.items()):
+            if watched_dir not in dirs:
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.dirs[wd]
+        watched_dirs = set(self.dirs.values())
+        for new_dir in sorted(set(dirs) - watched_dirs):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(new_dir), self.IN_MASK)
+            if wd >= 0:
+                self.dirs[wd] = new_dir
+
+    def wait(self, timeout):
+        # Returns the changed paths, or the empty set if there were no changes within `timeout` seconds.
+        changes = set()
+        while not changes:
+            if not select.select([self.fd], [], [], timeout)[0]:
+                return changes
+            buffer = os.read(self.fd, 1 << 16)
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, name_length = struct.unpack_from("iIII", buffer, offset)
+                name = buffer[offset + 16 : offset + 16 + name_length].rstrip(b"\0").decode(errors="replace")
+                offset += 16 + name_length
+                if mask & self.IN_ISDIR:
+                    # Only the subdirs created, removed, or moved, the changes within them have their own watches.
+                    if wd in self.dirs and mask & self.IN_DIR_MASK and is_watched_dir_name(name):
+                        changes.add(os.path.join(self.dirs[wd], name))
+                elif wd in self.dirs and is_watched_name(name):
+                    changes.add(os.path.join(self.dirs[wd], name))
+        return changes
+
+
+class PollingWatcher:
+    # The portable fallback, compares the sizes and mtimes of the files in the watched dirs periodically.
+    poll_interval = 0.25
+
+    def __init__(self):
+        self.dirs = []
+        self.snapshot = {}
+
+    def take_snapshot(self):
+        snapshot = {}
+        for watched_dir in self.dirs:
+            try:
+                with os.scandir(watched_dir) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            # The subdirs only by their names, as their mtimes change with the files in them.
+                            if is_watched_dir_name(entry.name):
+                                snapshot[entry.path] = "dir"
+                        elif is_watched_name(entry.name):
+                            stat = entry.stat()
+                            snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                pass
+        return snapshot
+
+    def set_dirs(self, dirs):
+        self.dirs = sorted(dirs)
+        self.snapshot = self.take_snapshot()
+
+    def wait(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(self.poll_interval if deadline is None else min(self.poll_interval, timeout))
+            snapshot = self.take_snapshot()
+            changes = {p for p in set(snapshot) | set(self.snapshot) if snapshot.get(p) != self.snapshot.get(p)}
+            self.snapshot = snapshot
+            if changes:
+                return changes
+        return set()
+
+
+initial_add_to_gitignore = list(per_dir[full_abspath].add_to_gitignore)
+
+
+def reset_traversal_state():
+    # So that `pls watch` can re-run the dependency update within the same process. The scan cache is kept.
+    per_dir.clear()
+    modules.clear()
+    module_imported_by.clear()
+    already_traversed_src_dirs.clear()
+    PerDirectoryStatus.add_to_gitignore[:] = initial_add_to_gitignore
+
+
+def watched_dirs_of_build(build_dir):
+    # The source dirs from the last configure, the dirs looked into for their sources, their `.git` dirs,
+    # and the dirs of the headers they include.
+    src_dirs = load_fingerprints().get(build_dir, {}).get("src_dirs", [full_abspath])
+    dirs = set()
+    for src_dir in src_dirs:
+        dirs.update([src_dir, os.path.join(src_dir, "src"), os.path.join(src_dir, ".git")])
+        dirs.update(discovered_source_dirs.get(src_dir, []))
+    for abs_src_name, entry in load_scan_cache()["sources"].items():
+        if os.path.dirname(abs_src_name) in dirs:
+            dirs.update(os.path.dirname(p) for p, signature in entry["inputs"].items() if signature is not None)
+    return {d for d in dirs if os.path.isdir(d)}
+
+
+def cmd_watch(args):
+    watch_parser = argparse.ArgumentParser(prog="pls watch", description="Rebuild whenever the sources change.")
+    watch_parser.add_argument("--run", type=str, help="Run this executable after each successful build.")
+    watch_parser.add_argument("--debounce", type=int, default=200, help="Wait for this many ms of quiet, 200 default.")
+    watch_parser.add_argument("--poll", action="store_true", help="Poll for changes, instead of using `inotify`.")
+    run_args = []
+    if "--" in args:
+        run_args = args[args.index("--") + 1 :]
+        args = args[: args.index("--")]
+    watch_flags = watch_parser.parse_args(args)
+    config = selected_config()
+    build_dir = build_configs[config][0]
+
+    def build_and_run():
+        # The failures are reported, but do not stop watching.
+        try:
+            release_held_cache_locks()
+            reset_traversal_state()
+            cmake_args = config_cmake_args(config)
+            need_configure = update_dependencies_for_configs([config], {config: cmake_args})[config]
+            error = configure_and_build(config, cmake_args, need_configure)
+            if error:
+                pls_fail(error)
+            executables = per_dir[full_abspath].executables
+            if watch_flags.run:
+                if watch_flags.run not in executables:
+                    pls_fail(f"PLS: Executable `{watch_flags.run}` is not in {json.dumps(list(executables.keys()))}.")
+                run_subprocess([os.path.join(".", build_dir, watch_flags.run)] + run_args, "run")
+        except SystemExit:
+            pass
+        # After each build, as `pls watch` is usually stopped by a signal, which may well be other than Ctrl+C.
+        save_manifest()
+        save_trace()
+
+    watcher = None
+    if not watch_flags.poll and sys.platform.startswith("linux"):
+        try:
+            watcher = InotifyWatcher()
+        except (OSError, AttributeError) as e:
+            if flags.verbose:
+                print(f"PLS: Can not use `inotify`, {e}, will poll for changes.")
+    if watcher is None:
+        watcher = PollingWatcher()
+
+    try:
+        build_and_run()
+        while True:
+            watcher.set_dirs(watched_dirs_of_build(build_dir))
+            print("PLS: Watching for changes, press Ctrl+C to stop.", flush=True)
+            changes = watcher.wait(None)
+            # Many editors save in several steps, and the saves of multiple files come in quick succession too.
+            while True:
+                more_changes = watcher.wait(watch_flags.debounce / 1000)
+                if not more_changes:
+                    break
+                changes |= more_changes
+            names = ", ".join(f"`{os.path.relpath(p)}`" for p in sorted(changes))
+            print(f"PLS: Changed {names}.", flush=True)
+            build_and_run()
+    except KeyboardInterrupt:
+        print("\nPLS: Stopped watching.")
+
+
+def cmd_profile(args):
+    profile_parser = argparse.ArgumentParser(prog="pls profile", description="Summarize the `pls --profile` trace.")
+    profile_parser.add_argument("action", choices=["summary"])
+    profile_parser.add_argument("trace", nargs="?", default="trace.json", help="The trace, `trace.json` by default.")
+    profile_parser.add_argument("--top", "-n", type=int, default=10, help="How many to list, 10 by default.")
+    profile_flags = profile_parser.parse_args(args)
+    try:
+        with open(profile_flags.trace, "r") as file:
+            events = [e for e in json.loads(file.read())["traceEvents"] if e.get("ph") == "X"]
+    except (OSError, ValueError, KeyError) as e:
+        pls_fail(f"PLS: Can not read the trace `{profile_flags.trace}`: {e}.")
+
+    def ms(microseconds):
+        return format_duration(microseconds / 1e6)
+
+    for event in events:
+        if event["cat"] == "pls":
+            print(f"PLS: `{event['name']}` took {ms(event['dur'])}.")
+    # The time spent in the phases and subprocesses of each kind, summed up, so it may exceed the wall time.
+    by_category = defaultdict(float)
+    for event in events:
+        if event["cat"] not in ["pls", "phase", "git"]:
+            by_category[event["cat"]] += event["dur"]
+    for category, duration in sorted(by_category.items(), key=lambda kv: -kv[1]):
+        print(f"PLS: Total `{category}` time: {ms(duration)}.")
+
+    files = [e for e in events if e["args"].get("file")]
+    if files:
+        print("PLS: The slowest files:")
+        for event in sorted(files, key=lambda e: -e["dur"])[: profile_flags.top]:
+            config = f" ({event['args']['config']})" if event["args"].get("config") else ""
+            print(f"  {ms(event['dur']):>10}  {event['cat']:<8} {event['args']['file']}{config}")
+    by_dependency = defaultdict(lambda: defaultdict(float))
+    for event in events:
+        if event["args"].get("dependency"):
+            by_dependency[event["args"]["dependency"]][event["cat"]] += event["dur"]
+    if by_dependency:
+        print("PLS: The slowest dependencies:")
+        slowest = sorted(by_dependency.items(), key=lambda kv: -sum(kv[1].values()))[: profile_flags.top]
+        for dependency, durations in slowest:
+            details = ", ".join(f"{category} {ms(d)}" for category, d in sorted(durations.items()))
+            print(f"  {ms(sum(durations.values())):>10}  {dependency} ({details})")
+
+
+def parse_size(size):
+    units = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([KMGT]?)(?:I?B)?", size.strip().upper())
+    if not match:
+        pls_fail(f"PLS: Can not parse the size `{size}`, use bytes or a number with `K`, `M`, `G`, or `T`.")
+    return int(float(match.group(1)) * units[match.group(2)])
+
+
+def format_size(size):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "TB"
+    return f"{size:.1f}{unit}" if unit != "B" else f"{size}B"
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+def list_cache(cache_dir):
+    # The cached mirrors or prebuilt dependencies as (last used timestamp, size in bytes, dir), the least recently
+    # used first.
+    cached = []
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            cached_dir = os.path.join(cache_dir, name)
+            if os.path.isdir(cached_dir) and not name.endswith(".tmp"):
+                lock_path = f"{cached_dir}.lock"
+                last_used = os.stat(lock_path if os.path.isfile(lock_path) else cached_dir).st_mtime
+                cached.append((last_used, dir_size(cached_dir), cached_dir))
+    return sorted(cached)
+
+
+def cmd_cache(args):
+    cache_parser = argparse.ArgumentParser(prog="pls cache", description="Manage the shared cache of `pls`.")
+    cache_parser.add_argument("action", nargs="?", default="info", choices=["info", "gc"])
+    cache_parser.add_argument(
+        "--max-size",
+        type=str,
+        default=os.getenv("PLS_CACHE_MAX_SIZE") or git_cache_default_max_size,
+        help=f"For `gc`, the size to shrink the cache to, `{git_cache_default_max_size}` by default.",
+    )
+    cache_flags = cache_parser.parse_args(args)
+    mirrors = list_cache(git_cache_dir)
+    artifacts = list_cache(artifacts_cache_dir)
+    mirrors_size = sum(size for _, size, _ in mirrors)
+    artifacts_size = sum(size for _, size, _ in artifacts)
+    total_size = mirrors_size + artifacts_size
+    if cache_flags.action == "info":
+        print(f"PLS: The cache is in `{pls_cache_dir}`.")
+        print(f"PLS: Has {len(mirrors)} cached git repositories, {format_size(mirrors_size)} total.")
+        print(f"PLS: Has {len(artifacts)} prebuilt dependencies, {format_size(artifacts_size)} total.")
+        return
+    max_size = parse_size(cache_flags.max_size)
+    evicted = {git_cache_dir: 0, artifacts_cache_dir: 0}
+    evicted_size = 0
+    for _, size, cached_dir in sorted(mirrors + artifacts):
+        if total_size <= max_size:
+            break
+        # What is in use by other `pls` processes is skipped, as it is by definition not the least recently used.
+        with CacheLock(cached_dir, blocking=False) as locked:
+            if locked and os.path.isdir(cached_dir):
+                if flags.verbose:
+                    print(f"PLS: Evicting `{cached_dir}`, {format_size(size)}.")
+                shutil.rmtree(cached_dir)
+                total_size -= size
+                evicted[os.path.dirname(cached_dir)] += 1
+                evicted_size += size
+    evicted_summary = (
+        f"{evicted[git_cache_dir]} cached git repositories and {evicted[artifacts_cache_dir]} prebuilt dependencies, "
+        f"{format_size(evicted_size)}"
+    )
+    print(f"PLS: Evicted {evicted_summary}, {format_size(total_size)} left.")
+
+
 def main():
     if os.path.isfile("pls.py") or os.path.isfile("pls") or os.path.isdir("pls"):
         pls_fail(
@@ -455,10 +2968,24 @@ def main():
     cmds["b"] = cmd_build
     cmds["run"] = cmd_run
     cmds["r"] = cmd_run
+    cmds["cache"] = cmd_cache
+    cmds["lock"] = cmd_lock
+    cmds["pgo"] = cmd_pgo
+    cmds["bench"] = cmd_bench
+    cmds["test"] = cmd_test
+    cmds["t"] = cmd_test
+    cmds["profile"] = cmd_profile
+    cmds["watch"] = cmd_watch
+    cmds["w"] = cmd_watch
 
     cmd0 = cmd[0].strip().lower() if cmd else ""
     if cmd0 in cmds:
-        cmds[cmd0](cmd[1:])
+        try:
+            with TraceSpan(f"pls {cmd0}", "pls", command=" ".join(sys.argv)):
+                cmds[cmd0](cmd[1:])
+        finally:
+            save_manifest()
+            save_trace()
     else:
         print(f"PLS: The command `{cmd0}` is not recognized, try `pls --help`.")
         sys.exit(0)
@@ -1,8 +1,18 @@
 #!/bin/bash
-g++ \
+# Usage: cc_instrument.sh <source> <pls_h_dir> [<headers_log>]
+# The optional third argument is where to write `stderr` with the list of headers used, for the scan cache.
+HEADERS_LOG=/dev/null
+HEADERS_ARGS=()
+if [ "$3" != "" ]; then
+  HEADERS_LOG="$3"
+  HEADERS_ARGS=(-H)
+fi
+LC_ALL=C g++ \
   -I"$2" \
   -D PLS_INSTRUMENTATION \
   -E \
-  "$1" 2>/dev/null \
+  "${HEADERS_ARGS[@]}" \
+  "$1" 2>"$HEADERS_LOG" \
 | grep PLS_INSTRUMENTATION_OUTPUT \
 | sed 's/^PLS_INSTRUMENTATION_OUTPUT//g'
+exit ${PIPESTATUS[0]}
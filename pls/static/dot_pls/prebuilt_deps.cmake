@@ -0,0 +1,88 @@
+# NOTE: This file is installed by `pls`, and is overwritten on each build. It is used with `pls --prebuilt-deps`.
+#
+# Each dependency that does not import others is looked up in the machine-wide artifacts cache, by the hash of what
+# it is, the repo and the commit, and of how it would be compiled here, the compiler, the flags, and the build type.
+# If found, its libraries are imported as prebuilt, and it is not built at all. If not, it is built from source
+# as usual, and its libraries are exported into `${CMAKE_BINARY_DIR}/.pls_prebuilt/<lib>`, for `pls` to store them
+# after the build.
+
+include_guard(GLOBAL)
+
+function(pls_add_prebuilt_dependency lib repo commit pls_version artifacts_dir)
+  string(TOUPPER "${CMAKE_BUILD_TYPE}" config)
+  get_directory_property(compile_options COMPILE_OPTIONS)
+  get_directory_property(compile_definitions COMPILE_DEFINITIONS)
+  set(key_inputs "${pls_version}" "${lib}" "${repo}" "${commit}" "${CMAKE_SYSTEM_NAME}" "${CMAKE_SYSTEM_PROCESSOR}")
+  foreach(language C CXX)
+    list(APPEND key_inputs "${CMAKE_${language}_COMPILER}" "${CMAKE_${language}_COMPILER_ID}")
+    list(APPEND key_inputs "${CMAKE_${language}_COMPILER_VERSION}" "${CMAKE_${language}_STANDARD}")
+    list(APPEND key_inputs "${CMAKE_${language}_EXTENSIONS}")
+    list(APPEND key_inputs "${CMAKE_${language}_FLAGS}" "${CMAKE_${language}_FLAGS_${config}}")
+  endforeach()
+  list(APPEND key_inputs "${CMAKE_BUILD_TYPE}" "${CMAKE_POSITION_INDEPENDENT_CODE}")
+  list(APPEND key_inputs "${CMAKE_INTERPROCEDURAL_OPTIMIZATION}" "${CMAKE_UNITY_BUILD}")
+  list(APPEND key_inputs "${compile_options}" "${compile_definitions}")
+  # The flags `pls` passes refer to the project dir, which should not make the key differ from project to project.
+  string(REPLACE "${CMAKE_SOURCE_DIR}" "<project>" key_inputs "${key_inputs}")
+  string(SHA256 key "${key_inputs}")
+
+  set(entry_dir "${artifacts_dir}/${key}")
+  set(export_dir "${CMAKE_BINARY_DIR}/.pls_prebuilt/${lib}")
+  file(REMOVE_RECURSE "${export_dir}")
+  # The profile-guided builds, the flags of which refer to the profiles of the project by their paths, which the key
+  # does not tell apart from those of any other project.
+  if(PLS_NO_PREBUILT_DEPS)
+    add_subdirectory(impl)
+    return()
+  endif()
+  if(EXISTS "${entry_dir}/targets.cmake")
+    set(PLS_PREBUILT_DIR "${entry_dir}")
+    include("${entry_dir}/targets.cmake")
+    file(WRITE "${export_dir}/used.txt" "${entry_dir}")
+    return()
+  endif()
+
+  add_subdirectory(impl)
+
+  # Only the static and the header-only libraries can be prebuilt, and only if they link to nothing but each other,
+  # and to the system libraries.
+  set(dirs "${CMAKE_CURRENT_SOURCE_DIR}/impl")
+  set(targets)
+  set(exportable TRUE)
+  while(dirs)
+    list(GET dirs 0 dir)
+    list(REMOVE_AT dirs 0)
+    get_directory_property(subdirs DIRECTORY "${dir}" SUBDIRECTORIES)
+    get_directory_property(dir_targets DIRECTORY "${dir}" BUILDSYSTEM_TARGETS)
+    list(APPEND dirs ${subdirs})
+    foreach(target ${dir_targets})
+      get_target_property(type ${target} TYPE)
+      if(type STREQUAL "STATIC_LIBRARY" OR type STREQUAL "INTERFACE_LIBRARY")
+        list(APPEND targets ${target})
+      elseif(NOT type STREQUAL "EXECUTABLE" AND NOT type STREQUAL "UTILITY")
+        set(exportable FALSE)
+      endif()
+    endforeach()
+  endwhile()
+  foreach(target ${targets})
+    get_target_property(link_libraries ${target} INTERFACE_LINK_LIBRARIES)
+    if(link_libraries)
+      foreach(item ${link_libraries})
+        string(REGEX REPLACE "^\\$<LINK_ONLY:(.*)>$" "\\1" item "${item}")
+        if(item MATCHES "\\$<" OR (TARGET "${item}" AND NOT item IN_LIST targets))
+          set(exportable FALSE)
+        endif()
+      endforeach()
+    endif()
+  endforeach()
+  if(exportable AND targets)
+    export(TARGETS ${targets} FILE "${export_dir}/targets.cmake")
+    string(REPLACE ";" "\", \"" targets_json "${targets}")
+    file(
+      WRITE "${export_dir}/entry.json"
+      "{\"lib\": \"${lib}\", \"repo\": \"${repo}\", \"commit\": \"${commit}\", \"key\": \"${key}\",\n"
+      " \"source_dir\": \"${CMAKE_CURRENT_SOURCE_DIR}/impl\", \"binary_dir\": \"${CMAKE_CURRENT_BINARY_DIR}/impl\",\n"
+      " \"targets\": [\"${targets_json}\"]}\n"
+    )
+  endif()
+endfunction()
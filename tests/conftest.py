@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+PLS_CMD_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pls", "cmd.py")
+
+
+def git(repo_dir, *args):
+    command = ["git", "-C", repo_dir, "-c", "user.name=pls", "-c", "user.email=pls@localhost", *args]
+    return subprocess.run(command, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def commit_files(repo_dir, files):
+    # Writes the files into the repo, which is created if it does not exist yet, commits them, and returns the commit.
+    os.makedirs(repo_dir, exist_ok=True)
+    for file_name, contents in files.items():
+        with open(os.path.join(repo_dir, file_name), "w") as file:
+            file.write(contents)
+    if not os.path.isdir(os.path.join(repo_dir, ".git")):
+        git(repo_dir, "init", "-q")
+    git(repo_dir, "add", "-A")
+    git(repo_dir, "commit", "-qm", "Commit.")
+    return git(repo_dir, "rev-parse", "HEAD")
+
+
+def pls_json(imports):
+    repos = ", ".join(f'"{lib}": "https://github.com/dkorolev/{lib}"' for lib in imports)
+    return f'{{"import": {{{repos}}}}}'
+
+
+def run_pls(project_dir, *args, **env):
+    # With the repos from `github/dkorolev` and the shared cache in `cache`, both next to the project dir.
+    tmp_path = os.path.dirname(project_dir)
+    env = {**os.environ, "PLS_INJECT_GITHUB": os.path.join(tmp_path, "github"), **env}
+    env["PLS_CACHE_DIR"] = os.path.join(tmp_path, "cache")
+    return subprocess.run([sys.executable, PLS_CMD_PY, *args], cwd=project_dir, env=env, capture_output=True, text=True)
+
+
+@pytest.fixture
+def project_dir(tmp_path):
+    project_dir = tmp_path / "project"
+    project_dir.mkdir()
+    return project_dir
@@ -0,0 +1,46 @@
+import json
+import shutil
+
+import pytest
+
+from conftest import run_pls
+from pls.cmd import percentile
+
+BENCH_SLEEP_CC = """#include <cstdlib>
+#include <unistd.h>
+int main(int argc, char** argv) { usleep(atoi(argv[1])); }
+"""
+
+
+def test_percentile():
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([1, 2, 3, 4, 5], 90) == pytest.approx(4.6)
+    assert percentile([7], 10) == 7
+
+
+@pytest.mark.skipif(shutil.which("cmake") is None or shutil.which("g++") is None, reason="Needs `cmake`.")
+def test_bench_saves_the_baseline_and_flags_regressions(project_dir):
+    (project_dir / "bench_sleep.cc").write_text(BENCH_SLEEP_CC)
+    (project_dir / "sleeper.cc").write_text(BENCH_SLEEP_CC)
+    (project_dir / "pls.json").write_text('{"bench": ["sleeper"]}')
+
+    result = run_pls(project_dir, "bench", "--runs", "3", "--cpus", "0", "--", "1000")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "Saved the results as the baseline" in result.stdout
+    with open(project_dir / ".pls" / "bench" / "baseline.json") as file:
+        baseline = json.loads(file.read())
+    assert baseline["config"] == "release"
+    assert sorted(baseline["benchmarks"]) == ["bench_sleep", "sleeper"]
+    assert len(baseline["benchmarks"]["sleeper"]["runs"]) == 3
+    assert baseline["benchmarks"]["sleeper"]["summary"]["wall"]["p50"] >= 0.001
+
+    result = run_pls(project_dir, "bench", "sleeper", "--compare", "--threshold", "100", "--runs", "1", "--", "50000")
+    assert result.returncode == 1
+    assert "`sleeper` wall:" in result.stdout and "REGRESSION" in result.stdout
+    assert "bench_sleep" not in result.stdout
+
+    (project_dir / "pls.json").write_text('{"bench": ["sleepr"]}')
+    result = run_pls(project_dir, "bench")
+    assert result.returncode == 1
+    assert "PLS: Benchmark `sleepr` from `pls.json` is not in" in result.stdout
@@ -0,0 +1,64 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from conftest import run_pls
+
+pytestmark = pytest.mark.skipif(shutil.which("cmake") is None or shutil.which("g++") is None, reason="Needs `cmake`.")
+
+
+def build(project_dir):
+    result = run_pls(project_dir, "--verbose", "build")
+    assert result.returncode == 0, result.stdout + result.stderr
+    return "Nothing to reconfigure" in result.stdout
+
+
+@pytest.fixture
+def project_dir(project_dir):
+    (project_dir / "main.cc").write_text('#include <cstdio>\nint main() { printf("one\\n"); }\n')
+    return project_dir
+
+
+def test_unchanged_project_is_not_reconfigured(project_dir):
+    assert not build(project_dir)
+    cmakelists_mtime = os.stat(project_dir / "CMakeLists.txt").st_mtime_ns
+    assert build(project_dir)
+    assert os.stat(project_dir / "CMakeLists.txt").st_mtime_ns == cmakelists_mtime
+
+
+def test_changed_function_body_is_rebuilt_without_reconfiguring(project_dir):
+    assert not build(project_dir)
+    (project_dir / "main.cc").write_text('#include <cstdio>\nint main() { printf("two\\n"); }\n')
+    assert build(project_dir)
+    assert subprocess.run([project_dir / ".debug" / "main"], capture_output=True, text=True).stdout == "two\n"
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        lambda d: (d / "main.cc").write_text('#include "pls.h"\nPLS_PROJECT("renamed")\nint main() {}\n'),
+        lambda d: (d / "other.cc").write_text("int main() {}\n"),
+        lambda d: (d / "pls.json").write_text('{"import": {}}'),
+        lambda d: shutil.rmtree(d / ".debug"),
+    ],
+    ids=["pls_commands", "new_source", "pls_json", "no_build_dir"],
+)
+def test_configure_relevant_changes_reconfigure(project_dir, change):
+    assert not build(project_dir)
+    change(project_dir)
+    assert not build(project_dir)
+    assert build(project_dir)
+
+
+def test_all_configs_builds_debug_and_release_concurrently(project_dir):
+    result = run_pls(project_dir, "--verbose", "build", "--all-configs")
+    assert result.returncode == 0, result.stdout + result.stderr
+    lines = result.stdout.splitlines()
+    assert any(line.startswith("[debug] ") for line in lines)
+    assert any(line.startswith("[release] ") for line in lines)
+    for build_dir, build_type in [(".debug", "Debug"), (".release", "Release")]:
+        assert f"CMAKE_BUILD_TYPE:STRING={build_type}\n" in (project_dir / build_dir / "CMakeCache.txt").read_text()
+        assert subprocess.run([project_dir / build_dir / "main"], capture_output=True, text=True).stdout == "one\n"
+    assert build(project_dir)
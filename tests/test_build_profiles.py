@@ -0,0 +1,55 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from conftest import run_pls
+
+pytestmark = pytest.mark.skipif(shutil.which("cmake") is None or shutil.which("g++") is None, reason="Needs `cmake`.")
+
+MAIN_CC = """#include <cstdio>
+#include <cstdlib>
+int main(int argc, char** argv) {
+  long n = argc > 1 ? atol(argv[1]) : 0, s = 0;
+  for (long i = 0; i < n; ++i) s += i % 7 ? 1 : i;
+#ifdef NDEBUG
+  printf("release %ld\\n", s);
+#else
+  printf("debug %ld\\n", s);
+#endif
+}
+"""
+
+
+@pytest.fixture
+def project_dir(project_dir):
+    (project_dir / "main.cc").write_text(MAIN_CC)
+    return project_dir
+
+
+@pytest.mark.parametrize(
+    "args, build_dir, expected",
+    [([], ".debug", "debug 0"), (["--release"], ".release", "release 0"), (["--lto"], ".release_lto", "release 0")],
+)
+def test_run_in_build_profile(project_dir, args, build_dir, expected):
+    result = run_pls(project_dir, *args, "run")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert result.stdout.splitlines()[-1] == expected
+    assert (project_dir / build_dir / "main").is_file()
+    assert build_dir in (project_dir / ".gitignore").read_text().splitlines()
+
+
+def test_pgo_builds_the_optimized_executable_from_the_training_run(project_dir):
+    result = run_pls(project_dir, "pgo", "main", "--", "1000")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "release 71928\n" in result.stdout
+    assert os.listdir(project_dir / ".pls" / "pgo" / "main")
+    optimized = subprocess.run([project_dir / ".release_pgo" / "main", "10"], capture_output=True, text=True)
+    assert optimized.stdout == "release 15\n"
+
+
+def test_pgo_requires_a_known_executable(project_dir):
+    result = run_pls(project_dir, "pgo", "nope")
+    assert result.returncode == 1
+    assert "Executable `nope` is not in" in result.stdout
@@ -0,0 +1,91 @@
+import os
+import shutil
+
+import pytest
+
+from conftest import commit_files, git, run_pls
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None or shutil.which("cmake") is None, reason="Needs `git`.")
+
+
+@pytest.fixture
+def project_dir(tmp_path, project_dir):
+    # A git repo with its own `.gitignore`, where `main.cc` imports `lib`.
+    cmakelists_txt = (
+        "cmake_minimum_required(VERSION 3.14.1)\nproject(lib CXX)\nadd_library(lib INTERFACE)\n"
+        "target_include_directories(lib INTERFACE ${CMAKE_CURRENT_SOURCE_DIR})\n"
+    )
+    lib_h = "inline int lib() { return 42; }\n"
+    commit_files(tmp_path / "github" / "dkorolev" / "lib", {"CMakeLists.txt": cmakelists_txt, "lib.h": lib_h})
+    git(project_dir, "init", "-q")
+    (project_dir / ".gitignore").write_text("*.o\n")
+    (project_dir / "main.cc").write_text(
+        '#include "pls.h"\nPLS_IMPORT("lib", "https://github.com/dkorolev/lib")\n#include "lib.h"\n'
+        "int main() { return lib() - 42; }\n"
+    )
+    result = run_pls(project_dir, "build")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert (project_dir / ".debug").is_dir() and (project_dir / "lib").is_symlink()
+    return project_dir
+
+
+def test_build_only(project_dir):
+    result = run_pls(project_dir, "clean", "--build-only")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert not (project_dir / ".debug").exists()
+    assert (project_dir / "lib").is_symlink()
+    assert (project_dir / "CMakeLists.txt").is_file()
+    assert (project_dir / ".pls" / "deps" / "lib").is_dir()
+    assert (project_dir / ".pls" / "manifest.json").is_file()
+
+
+def test_default_keeps_the_deps_and_rebuilds_offline(project_dir):
+    (project_dir / ".vscode" / "settings.json").write_text("{}\n")
+    result = run_pls(project_dir, "clean")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert sorted(os.listdir(project_dir)) == [".git", ".gitignore", ".pls", ".vscode", "main.cc"]
+    assert sorted(os.listdir(project_dir / ".pls")) == ["deps", "manifest.json"]
+    # Neither cleaning nor rebuilding needs the remote repos once the deps are cloned.
+    shutil.rmtree(project_dir.parent / "github")
+    shutil.rmtree(project_dir.parent / "cache")
+    result = run_pls(project_dir, "run")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "Cloning" not in result.stdout
+
+
+def test_full_restores_the_user_files(project_dir):
+    (project_dir / ".gitignore").write_text((project_dir / ".gitignore").read_text() + "*.tmp\n")
+    (project_dir / "CMakeLists.txt").write_text("# Now this is mine.\n")
+    result = run_pls(project_dir, "clean", "--full")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert sorted(os.listdir(project_dir)) == [".git", ".gitignore", "CMakeLists.txt", "main.cc"]
+    assert (project_dir / ".gitignore").read_text() == "*.o\n*.tmp\n"
+    assert (project_dir / "CMakeLists.txt").read_text() == "# Now this is mine.\n"
+
+
+def test_clean_never_clones(tmp_path):
+    # With a dependency that can not be cloned, `pls clean` still succeeds, as it does not look at the sources.
+    (tmp_path / "main.cc").write_text('#include "pls.h"\nPLS_IMPORT("nope", "https://github.com/dkorolev/nope")\n')
+    (tmp_path / ".debug").mkdir()
+    result = run_pls(tmp_path, "clean")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert not (tmp_path / ".debug").exists()
+    assert not (tmp_path / ".pls").exists()
+
+
+def test_clean_after_the_symlinks_were_created_before_the_manifest(project_dir):
+    # As if built by the older `pls`, which did not keep the manifest, and then rebuilt by this one.
+    os.unlink(project_dir / ".pls" / "manifest.json")
+    result = run_pls(project_dir, "build")
+    assert result.returncode == 0, result.stdout + result.stderr
+    result = run_pls(project_dir, "clean")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert not os.path.lexists(project_dir / "lib")
+    assert not (project_dir / "CMakeLists.txt").exists()
+    result = run_pls(project_dir, "run")
+    assert result.returncode == 0, result.stdout + result.stderr
+    # The dangling symlink, as left by the older `pls clean`, is replaced.
+    shutil.rmtree(project_dir / ".pls" / "singleton_deps")
+    result = run_pls(project_dir, "build")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert (project_dir / "lib").is_symlink() and (project_dir / "lib").is_dir()
@@ -0,0 +1,118 @@
+import os
+import shutil
+
+import pytest
+
+from conftest import commit_files, git, pls_json, run_pls
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None or shutil.which("g++") is None, reason="Needs `git`.")
+
+
+@pytest.fixture
+def github_dir(tmp_path):
+    github_dir = tmp_path / "github"
+    # A diamond: `top` -> `left`, `right` -> `bottom`.
+    commit_files(github_dir / "dkorolev" / "bottom", {"CMakeLists.txt": "\n"})
+    commit_files(github_dir / "dkorolev" / "left", {"CMakeLists.txt": "\n", "pls.json": pls_json(["bottom"])})
+    commit_files(github_dir / "dkorolev" / "right", {"CMakeLists.txt": "\n", "pls.json": pls_json(["bottom"])})
+    commit_files(github_dir / "dkorolev" / "top", {"CMakeLists.txt": "\n", "pls.json": pls_json(["left", "right"])})
+    return github_dir
+
+
+def test_clones_the_dependency_graph_in_frontiers(github_dir, project_dir):
+    (project_dir / "main.cc").write_text(
+        '#include "pls.h"\nPLS_IMPORT("top", "https://github.com/dkorolev/top")\nint main() {}\n'
+    )
+    result = run_pls(project_dir, "install", PLS_JOBS="4")
+    assert result.returncode == 0, result.stdout + result.stderr
+    deps_dir = project_dir / ".pls" / "deps"
+    assert result.stdout.splitlines() == [
+        f"PLS: Requirement `top` from `{project_dir}`.",
+        f"PLS: Requirement `left` from `{deps_dir / 'top'}`.",
+        f"PLS: Requirement `right` from `{deps_dir / 'top'}`.",
+        f"PLS: Requirement `bottom` from `{deps_dir / 'left'}`.",
+        f"PLS: Requirement `bottom` from `{deps_dir / 'right'}`.",
+    ]
+    for lib in ["top", "left", "right", "bottom"]:
+        assert (deps_dir / lib / ".git").is_dir()
+        assert (project_dir / lib).is_symlink()
+    assert (deps_dir / "left" / "bottom").is_symlink()
+    assert (deps_dir / "right" / "bottom").is_symlink()
+
+
+def test_reports_every_failed_clone_with_the_requirement_chain(github_dir, project_dir):
+    commit_files(
+        github_dir / "dkorolev" / "broken",
+        {"CMakeLists.txt": "\n", "pls.json": pls_json(["missing_one", "missing_two"])},
+    )
+    (project_dir / "pls.json").write_text(pls_json(["broken"]))
+    (project_dir / "main.cc").write_text("int main() {}\n")
+    result = run_pls(project_dir, "install", PLS_JOBS="4")
+    assert result.returncode == 1
+    chain = f"`{project_dir / '.pls' / 'deps' / 'broken'}` <- `{project_dir}`"
+    assert f"dkorolev/missing_one failed, required by {chain}." in result.stdout
+    assert f"dkorolev/missing_two failed, required by {chain}." in result.stdout
+
+
+def test_materializes_dependencies_from_the_git_cache(tmp_path, github_dir, project_dir):
+    (project_dir / "pls.json").write_text(pls_json(["top"]))
+    (project_dir / "main.cc").write_text("int main() {}\n")
+    assert run_pls(project_dir, "install", PLS_JOBS="4").returncode == 0
+    mirrors = [name for name in os.listdir(tmp_path / "cache" / "git") if not name.endswith(".lock")]
+    assert len(mirrors) == 4
+    top_dir = project_dir / ".pls" / "deps" / "top"
+    assert (top_dir / ".git" / "shallow").is_file()
+    assert git(top_dir, "remote", "get-url", "origin") == f"file://{github_dir}/dkorolev/top"
+
+    # With the "upstream" gone, the dependencies are still installed, from the cache.
+    shutil.rmtree(github_dir)
+    assert run_pls(project_dir, "clean", "--full").returncode == 0
+    result = run_pls(project_dir, "install", PLS_JOBS="4")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "Could not update the cached" in result.stdout
+    for lib in ["top", "left", "right", "bottom"]:
+        assert (project_dir / ".pls" / "deps" / lib / "pls.json").exists() == (lib != "bottom")
+
+
+def test_cache_gc_evicts_down_to_the_max_size(github_dir, project_dir):
+    (project_dir / "pls.json").write_text(pls_json(["left"]))
+    (project_dir / "main.cc").write_text("int main() {}\n")
+    assert run_pls(project_dir, "install", PLS_JOBS="4").returncode == 0
+    assert "Has 2 cached git repositories" in run_pls(project_dir, "cache").stdout
+    result = run_pls(project_dir, "cache", "gc", "--max-size", "0")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "Evicted 2 cached git repositories" in result.stdout
+    assert "Has 0 cached git repositories" in run_pls(project_dir, "cache").stdout
+
+
+def test_no_git_cache_clones_directly(tmp_path, github_dir, project_dir):
+    (project_dir / "pls.json").write_text(pls_json(["bottom"]))
+    (project_dir / "main.cc").write_text("int main() {}\n")
+    assert run_pls(project_dir, "--no-git-cache", "install", PLS_JOBS="4").returncode == 0
+    assert (project_dir / ".pls" / "deps" / "bottom" / ".git").is_dir()
+    assert not (tmp_path / "cache").exists()
+
+
+def test_the_output_is_the_same_for_any_number_of_jobs(github_dir, project_dir):
+    (project_dir / "pls.json").write_text('{"sources": {"include": ["**/*.cc"]}}')
+    for name, lib in [
+        ("main.cc", "top"),
+        ("src/util.cc", "left"),
+        ("tools/a/first.cc", "right"),
+        ("tools/a/second.cc", None),
+        ("tools/b/deep/third.cc", "bottom"),
+    ]:
+        (project_dir / name).parent.mkdir(parents=True, exist_ok=True)
+        pls_import = f'#include "pls.h"\nPLS_IMPORT("{lib}", "https://github.com/dkorolev/{lib}")\n' if lib else ""
+        (project_dir / name).write_text(f"{pls_import}int main() {{}}\n")
+    outputs = []
+    for jobs in ["1", "8", "1"]:
+        result = run_pls(project_dir, "--no-cache", "install", PLS_JOBS=jobs)
+        assert result.returncode == 0, result.stdout + result.stderr
+        outputs.append((result.stdout, (project_dir / "CMakeLists.txt").read_text()))
+        assert run_pls(project_dir, "clean", "--full").returncode == 0
+    assert outputs[0] == outputs[1] == outputs[2]
+    assert outputs[0][0].count("PLS: Requirement") == 8
+    assert "add_executable(tools_b_deep_third tools/b/deep/third.cc)\n" in outputs[0][1]
+    result = run_pls(project_dir, "install", PLS_JOBS="auto")
+    assert result.returncode == 1 and "The `PLS_JOBS` should be the number of jobs, not `auto`." in result.stdout
@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import pls.cmd as pls_cmd
+from conftest import PLS_CMD_PY
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in [
+        "main.cc",
+        "sync.cc",
+        "notes.txt",
+        "src/util.cc",
+        "src/deep/helper.cc",
+        "tools/server/main.cc",
+        "third_party/zlib/zlib.cc",
+        ".pls/deps/lib/lib.cc",
+        ".debug/CMakeFiles/gen.cc",
+        ".git/hooks/hook.cc",
+        "elsewhere/linked.cc",
+    ]:
+        os.makedirs(os.path.dirname(name) or ".", exist_ok=True)
+        with open(name, "w") as file:
+            file.write("int main() {}\n")
+    os.symlink(tmp_path / "elsewhere", tmp_path / "linked_dep", target_is_directory=True)
+    return tmp_path
+
+
+def source_names(src_dir="."):
+    return [name for name, _, _ in pls_cmd.list_sources_in_dir(src_dir)]
+
+
+def test_the_project_dir_and_its_src_by_default(tree):
+    assert source_names() == ["main.cc", "sync.cc", "src/util.cc"]
+    assert sorted(os.path.relpath(d, tree) for d in pls_cmd.discovered_source_dirs[str(tree)]) == [".", "src"]
+
+
+def test_the_globs_from_pls_json(tree):
+    (tree / "pls.json").write_text('{"sources": {"include": ["**/*.cc"], "exclude": ["third_party/**", "sync.cc"]}}')
+    assert source_names() == [
+        "main.cc",
+        "elsewhere/linked.cc",
+        "src/util.cc",
+        "src/deep/helper.cc",
+        "tools/server/main.cc",
+    ]
+    looked_into = {os.path.relpath(d, tree) for d in pls_cmd.discovered_source_dirs[str(tree)]}
+    assert not looked_into & {"third_party", ".pls", ".debug", ".git", "linked_dep"}
+    (tree / "pls.json").write_text('{"sources": {"include": ["tools/*/*.cc"]}}')
+    assert source_names() == ["tools/server/main.cc"]
+    assert {os.path.relpath(d, tree) for d in pls_cmd.discovered_source_dirs[str(tree)]} == {
+        ".",
+        "tools",
+        "tools/server",
+    }
+
+
+def test_the_executable_names():
+    assert pls_cmd.executable_name_of_source("sync.cc") == "sync"
+    assert pls_cmd.executable_name_of_source("src/cc.cc") == "cc"
+    assert pls_cmd.executable_name_of_source("tools/server/main.cc") == "tools_server_main"
+
+
+def test_the_nested_targets_are_generated(tree):
+    (tree / "pls.json").write_text('{"sources": {"include": ["*.cc", "tools/**/*.cc"]}}')
+    result = subprocess.run([sys.executable, PLS_CMD_PY, "install"], cwd=tree, capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
+    cmakelists_txt = (tree / "CMakeLists.txt").read_text()
+    assert "add_executable(sync sync.cc)\n" in cmakelists_txt
+    assert "add_executable(tools_server_main tools/server/main.cc)\n" in cmakelists_txt
+    (tree / "tools_server_main.cc").write_text("int main() {}\n")
+    result = subprocess.run([sys.executable, PLS_CMD_PY, "install"], cwd=tree, capture_output=True, text=True)
+    assert result.returncode == 1
+    assert "Both `tools_server_main.cc` and `tools/server/main.cc`" in result.stdout
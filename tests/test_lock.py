@@ -0,0 +1,97 @@
+import json
+import shutil
+
+import pytest
+
+from conftest import commit_files, git, pls_json, run_pls
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None or shutil.which("g++") is None, reason="Needs `git`.")
+
+
+@pytest.fixture
+def project_dir(tmp_path, project_dir):
+    # `main.cc` -> `middle` -> `bottom`, and `tool.cc` imports nothing.
+    github_dir = tmp_path / "github" / "dkorolev"
+    commit_files(github_dir / "bottom", {"CMakeLists.txt": "\n", "version.txt": "1\n"})
+    commit_files(github_dir / "middle", {"CMakeLists.txt": "\n", "pls.json": pls_json(["bottom"])})
+    (project_dir / "main.cc").write_text(
+        '#include "pls.h"\nPLS_IMPORT("middle", "https://github.com/dkorolev/middle")\nint main() {}\n'
+    )
+    (project_dir / "tool.cc").write_text("int main() {}\n")
+    return project_dir
+
+
+def test_lock_records_the_commits_and_the_importers(project_dir):
+    result = run_pls(project_dir, "lock")
+    assert result.returncode == 0, result.stdout + result.stderr
+    github_dir = project_dir.parent / "github" / "dkorolev"
+    lock = json.loads((project_dir / "pls.lock").read_text())
+    assert lock == {
+        "format": 1,
+        "dependencies": {
+            "bottom": {
+                "repo": "https://github.com/dkorolev/bottom",
+                "commit": git(github_dir / "bottom", "rev-parse", "HEAD"),
+                "imported_by": {"middle": []},
+            },
+            "middle": {
+                "repo": "https://github.com/dkorolev/middle",
+                "commit": git(github_dir / "middle", "rev-parse", "HEAD"),
+                "imported_by": {".": ["main"]},
+            },
+        },
+    }
+
+
+def test_locked_install_checks_out_the_locked_commits_offline(project_dir):
+    assert run_pls(project_dir, "lock").returncode == 0
+    bottom_dir = project_dir.parent / "github" / "dkorolev" / "bottom"
+    locked_commit = git(bottom_dir, "rev-parse", "HEAD")
+    commit_files(bottom_dir, {"version.txt": "2\n"})
+    assert run_pls(project_dir, "clean", "--full").returncode == 0
+    # The locked commits are in the shared cache, so the remotes are not needed.
+    shutil.rmtree(project_dir.parent / "github")
+    result = run_pls(project_dir, "--locked", "install")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "Could not update" not in result.stdout
+    assert result.stdout.splitlines() == [f"PLS: Requirement `middle` from `{project_dir}`."]
+    deps_dir = project_dir / ".pls" / "deps"
+    assert git(deps_dir / "bottom", "rev-parse", "HEAD") == locked_commit
+    assert (deps_dir / "bottom" / "version.txt").read_text() == "1\n"
+    assert (project_dir / "bottom").is_symlink()
+    assert (deps_dir / "middle" / "bottom").is_symlink()
+
+
+def test_locked_install_replaces_the_dependency_at_another_commit(project_dir):
+    bottom_dir = project_dir.parent / "github" / "dkorolev" / "bottom"
+    assert run_pls(project_dir, "lock").returncode == 0
+    commit_files(bottom_dir, {"version.txt": "2\n"})
+    assert run_pls(project_dir, "clean", "--full").returncode == 0
+    assert run_pls(project_dir, "install").returncode == 0
+    assert (project_dir / ".pls" / "deps" / "bottom" / "version.txt").read_text() == "2\n"
+    result = run_pls(project_dir, "--locked", "install")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert (project_dir / ".pls" / "deps" / "bottom" / "version.txt").read_text() == "1\n"
+
+
+def test_locked_install_requires_an_up_to_date_lock(project_dir):
+    result = run_pls(project_dir, "--locked", "install")
+    assert result.returncode == 1
+    assert "No `pls.lock` to use with `--locked`, run `pls lock` first." in result.stdout
+    assert run_pls(project_dir, "lock").returncode == 0
+    commit_files(project_dir.parent / "github" / "dkorolev" / "other", {"CMakeLists.txt": "\n"})
+    (project_dir / "pls.json").write_text(pls_json(["other"]))
+    result = run_pls(project_dir, "--locked", "install")
+    assert result.returncode == 1
+    assert "The `pls.lock` is out of date, `other` is from `https://github.com/dkorolev/other` now" in result.stdout
+
+
+def test_conflicting_imports_are_reported(project_dir):
+    commit_files(project_dir.parent / "github" / "dkorolev" / "bottom_fork", {"CMakeLists.txt": "\n"})
+    (project_dir / "pls.json").write_text('{"import": {"bottom": "https://github.com/dkorolev/bottom_fork"}}')
+    result = run_pls(project_dir, "install")
+    assert result.returncode == 1
+    assert (
+        "PLS: Conflicting imports of `bottom`: `https://github.com/dkorolev/bottom_fork` from "
+        f"`{project_dir}`, and `https://github.com/dkorolev/bottom` from `{project_dir / '.pls' / 'deps' / 'middle'}`."
+    ) in result.stdout
@@ -0,0 +1,141 @@
+import os
+import shutil
+
+import pytest
+
+import pls.cmd as pls_cmd
+
+pytestmark = pytest.mark.skipif(shutil.which("g++") is None, reason="Needs `g++`.")
+
+IMPORT_A = 'PLS_IMPORT("lib_a", "https://github.com/dkorolev/lib_a")'
+IMPORT_B = 'PLS_IMPORT("lib_b", "https://github.com/dkorolev/lib_b")'
+
+# Each case is `(name, {file name: contents}, whether the native scanner should handle it without `g++ -E`)`.
+# The source to scan is always `main.cc`.
+CASES = [
+    ("trivial", {"main.cc": "int main() {}\n"}, True),
+    (
+        "readme",
+        {
+            "main.cc": f"""#include <iostream>
+#include "pls.h"
+{IMPORT_A};
+#include "lib_a.h"
+int main() {{ std::cout << lib_a_add(2, 2) << std::endl; }}
+"""
+        },
+        True,
+    ),
+    (
+        "project_and_imports",
+        {"main.cc": f'#include "pls.h"\nPLS_PROJECT("my_project")\n{IMPORT_A}\n{IMPORT_B};;\nint main() {{}}\n'},
+        True,
+    ),
+    (
+        "comments_and_strings",
+        {
+            "main.cc": f"""#include "pls.h"
+// {IMPORT_B}
+/* {IMPORT_B}
+#include "nope.h"
+*/
+char const* s1 = "{IMPORT_B.replace('"', "'")}";
+char const* s2 = R"raw({IMPORT_B}
+)raw";
+char const c = '"';
+int const n = 1'000'000;
+{IMPORT_A};  // Trailing comment.
+int main() {{}}
+"""
+        },
+        True,
+    ),
+    ("before_pls_h", {"main.cc": f'{IMPORT_B}\n#include "pls.h"\n{IMPORT_A}\nint main() {{}}\n'}, True),
+    ("multiline_arguments", {"main.cc": '#include "pls.h"\nPLS_IMPORT(\n  "lib_a",\n  "repo"\n);\n'}, True),
+    (
+        "guarded_header",
+        {
+            "main.cc": '#include "pls.h"\n#include "a.h"\n#include "a.h"\nint main() {}\n',
+            "a.h": f"#ifndef A_H\n#define A_H\n{IMPORT_A}\n#endif  // A_H\n",
+        },
+        True,
+    ),
+    (
+        "pragma_once_header",
+        {
+            "main.cc": '#include "pls.h"\n#include "a.h"\n#include "sub/b.h"\n#include "a.h"\nint main() {}\n',
+            "a.h": f"#pragma once\n{IMPORT_A}\n",
+            "sub/b.h": f'#pragma once\n#include "../a.h"\n{IMPORT_B}\n',
+        },
+        True,
+    ),
+    (
+        "unguarded_header_twice",
+        {"main.cc": '#include "pls.h"\n#include "a.h"\n#include "a.h"\n', "a.h": f"{IMPORT_A}\n"},
+        True,
+    ),
+    (
+        "system_header_under_if",
+        {"main.cc": f'#include "pls.h"\n#ifdef FOO\n#include <vector>\n#endif\n{IMPORT_A}\n'},
+        True,
+    ),
+    (
+        "system_headers_via_project_header",
+        {
+            "main.cc": '#include <vector>\n#include "pls.h"\n#include "a.h"\n#include <map>\n',
+            "a.h": f"#ifndef A_H\n#define A_H\n#include <cstdio>\n#include <vector>\n{IMPORT_A}\n#endif\n",
+        },
+        True,
+    ),
+    (
+        "unrelated_multiline_define",
+        {"main.cc": f'#include "pls.h"\n#define ADD(a, b) \\\n  ((a) + (b))\n{IMPORT_A}\nint main() {{}}\n'},
+        True,
+    ),
+    ("missing_header_last", {"main.cc": f'#include "pls.h"\n{IMPORT_A}\n#include "missing.h"\n'}, True),
+    (
+        "guard_with_else",
+        {
+            "main.cc": '#include "pls.h"\n#include "a.h"\n',
+            "a.h": f"#ifndef A_H\n#define A_H\n#else\n{IMPORT_A}\n#endif\n",
+        },
+        False,
+    ),
+    ("same_line", {"main.cc": f'#include "pls.h"\n{IMPORT_A} {IMPORT_B}\n'}, False),
+    ("under_ifdef", {"main.cc": f'#include "pls.h"\n#ifdef PLS_INSTRUMENTATION\n{IMPORT_A}\n#endif\n'}, False),
+    ("under_if_0", {"main.cc": f'#include "pls.h"\n#if 0\n{IMPORT_A}\n#endif\n{IMPORT_B}\n'}, False),
+    ("via_macro", {"main.cc": f'#include "pls.h"\n#define IMPORT_A {IMPORT_A}\nIMPORT_A\n'}, False),
+    ("macro_arguments", {"main.cc": '#include "pls.h"\n#define LIB "lib_a"\nPLS_IMPORT(LIB, "repo")\n'}, False),
+    ("missing_header_first", {"main.cc": f'#include "pls.h"\n#include "missing.h"\n{IMPORT_A}\n'}, False),
+    ("header_under_if", {"main.cc": '#include "pls.h"\n#ifndef X\n#include "a.h"\n#endif\n', "a.h": IMPORT_A}, False),
+]
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pls_cmd.install_dotpls_files()
+    return tmp_path
+
+
+@pytest.mark.parametrize("name,files,handled_natively", CASES, ids=[case[0] for case in CASES])
+def test_native_scan_matches_preprocessor(project, name, files, handled_natively):
+    for file_name, contents in files.items():
+        os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+        with open(file_name, "w") as file:
+            file.write(contents)
+    pls_h_abs_dir = os.path.abspath(pls_cmd.pls_h_dir)
+    try:
+        expected, _, expected_system_includes, _ = pls_cmd.scan_source_with_preprocessor("main.cc", pls_h_abs_dir)
+    except SystemExit:
+        # The output `pls` can not parse, such as two `PLS_*` commands on the same line.
+        expected = None
+    try:
+        actual, inputs, system_includes, _ = pls_cmd.scan_source_natively("main.cc", pls_h_abs_dir)
+    except pls_cmd.NativeScanFallback:
+        assert not handled_natively
+    else:
+        assert handled_natively
+        assert actual == expected
+        assert system_includes == expected_system_includes
+        assert inputs[os.path.abspath("main.cc")] is True
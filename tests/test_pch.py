@@ -0,0 +1,94 @@
+import glob
+import shutil
+
+import pytest
+
+from conftest import run_pls
+
+pytestmark = pytest.mark.skipif(shutil.which("cmake") is None or shutil.which("g++") is None, reason="Needs `cmake`.")
+
+
+@pytest.fixture
+def project_dir(project_dir):
+    # Both sources include `<vector>` and `<iostream>`, only one of them includes `<map>`.
+    (project_dir / "one.cc").write_text(
+        "#include <iostream>\n#include <vector>\n#include <map>\n"
+        "int main() { std::vector<int> v(1); std::map<int, int> m; std::cout << v.size() + m.size() << '\\n'; }\n"
+    )
+    (project_dir / "two.cc").write_text(
+        '#include "common.h"\n#include <iostream>\n'
+        "int main() { std::vector<int> v(2); std::cout << v.size() << '\\n'; }\n"
+    )
+    (project_dir / "common.h").write_text("#pragma once\n#include <vector>\n#include <cstdio>\n")
+    return project_dir
+
+
+def precompiled_headers(project_dir):
+    with open(project_dir / ".pls" / "pch.cmake") as file:
+        for line in file:
+            if "PRIVATE" in line and "target_precompile_headers(" in line:
+                return line.split("PRIVATE")[1].strip(" )\n").split(" ")
+    return []
+
+
+def test_shared_system_headers_are_precompiled(project_dir):
+    result = run_pls(project_dir, "build")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert sorted(precompiled_headers(project_dir)) == ["<iostream>", "<vector>"]
+    assert "target_precompile_headers(two REUSE_FROM one)" in (project_dir / ".pls" / "pch.cmake").read_text()
+    assert glob.glob(str(project_dir / ".debug" / "**" / "cmake_pch.hxx.gch"), recursive=True)
+    result = run_pls(project_dir, "run", "two")
+    assert result.returncode == 0 and result.stdout.endswith("2\n"), result.stdout + result.stderr
+
+
+def test_pch_settings_in_pls_json(project_dir):
+    (project_dir / "pls.json").write_text('{"pch": {"include": ["map"], "exclude": ["iostream"]}}')
+    result = run_pls(project_dir, "install")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert precompiled_headers(project_dir) == ["<map>", "<vector>"]
+    (project_dir / "pls.json").write_text('{"pch": false}')
+    result = run_pls(project_dir, "install")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert precompiled_headers(project_dir) == []
+    (project_dir / "pls.json").write_text('{"pch": "yes"}')
+    result = run_pls(project_dir, "install")
+    assert result.returncode != 0
+    assert "should be `true`, `false`, or an object" in result.stdout
+
+
+def test_no_pch_flag(project_dir):
+    result = run_pls(project_dir, "--no-pch", "install")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert precompiled_headers(project_dir) == []
+
+
+# With `_GLIBCXX_DEBUG` defined first, `<vector>` is the debug one, unless it was included before, as precompiled.
+DEBUG_MODE_CC = """#include <iostream>
+#include <vector>
+#include <map>
+int main() {
+#ifdef _GLIBCXX_DEBUG_VECTOR
+  std::cout << "debug-mode\\n";
+#else
+  std::cout << "NOT-debug-mode\\n";
+#endif
+}
+"""
+
+
+def test_sources_defining_macros_before_the_system_headers_do_not_use_them(project_dir):
+    (project_dir / "three.cc").write_text("#define _GLIBCXX_DEBUG\n" + DEBUG_MODE_CC)
+    (project_dir / "debug.h").write_text("#pragma once\n#undef NDEBUG\n#define _GLIBCXX_DEBUG\n")
+    (project_dir / "four.cc").write_text('#include "debug.h"\n' + DEBUG_MODE_CC)
+    result = run_pls(project_dir, "--verbose", "build")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert (
+        "No precompiled headers for `three`, as `three.cc` defines macros before the system headers." in result.stdout
+    )
+    assert "No precompiled headers for `four`" in result.stdout
+    pch_cmake = (project_dir / ".pls" / "pch.cmake").read_text()
+    assert sorted(precompiled_headers(project_dir)) == ["<iostream>", "<vector>"]
+    assert "three" not in pch_cmake and "four" not in pch_cmake
+    for exe in ["three", "four"]:
+        result = run_pls(project_dir, "run", exe)
+        assert result.returncode == 0 and result.stdout.endswith("\ndebug-mode\n"), result.stdout + result.stderr
@@ -0,0 +1,118 @@
+import glob
+import os
+import shutil
+
+import pytest
+
+from conftest import commit_files, pls_json, run_pls
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None or shutil.which("cmake") is None, reason="Needs `git`.")
+
+BOTTOM_CMAKELISTS_TXT = """cmake_minimum_required(VERSION 3.14.1)
+project(bottom CXX)
+add_library(bottom bottom.cc)
+target_include_directories(bottom PUBLIC ${CMAKE_CURRENT_SOURCE_DIR})
+"""
+
+TOP_CMAKELISTS_TXT = """cmake_minimum_required(VERSION 3.14.1)
+project(top CXX)
+add_subdirectory(bottom)
+add_library(top top.cc)
+target_include_directories(top PUBLIC ${CMAKE_CURRENT_SOURCE_DIR})
+target_link_libraries(top bottom)
+"""
+
+
+def make_project(tmp_path, name):
+    # `main.cc` imports `top`, which imports `bottom`, so only `bottom` can be prebuilt.
+    project_dir = tmp_path / name
+    project_dir.mkdir()
+    (project_dir / "main.cc").write_text(
+        '#include <cstdio>\n#include "pls.h"\nPLS_IMPORT("top", "https://github.com/dkorolev/top")\n'
+        '#include "top.h"\nint main() { std::printf("%d\\n", top()); }\n'
+    )
+    return project_dir
+
+
+def built_objects(project_dir, source_name):
+    return glob.glob(str(project_dir / ".debug" / "**" / f"{source_name}.o"), recursive=True)
+
+
+@pytest.fixture
+def tmp_path_with_deps(tmp_path):
+    github_dir = tmp_path / "github" / "dkorolev"
+    commit_files(
+        github_dir / "bottom",
+        {
+            "CMakeLists.txt": BOTTOM_CMAKELISTS_TXT,
+            "bottom.h": "int bottom();\n",
+            "bottom.cc": '#include "bottom.h"\nint bottom() { return 42; }\n',
+        },
+    )
+    commit_files(
+        github_dir / "top",
+        {
+            "CMakeLists.txt": TOP_CMAKELISTS_TXT,
+            "pls.json": pls_json(["bottom"]),
+            "top.h": "int top();\n",
+            "top.cc": '#include "top.h"\n#include "bottom.h"\nint top() { return bottom() + 1; }\n',
+        },
+    )
+    return tmp_path
+
+
+def test_prebuilt_dependency_is_reused_by_another_project(tmp_path_with_deps):
+    tmp_path = tmp_path_with_deps
+    first_dir = make_project(tmp_path, "first")
+    result = run_pls(first_dir, "--prebuilt-deps", "run")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert result.stdout.endswith("43\n")
+    assert built_objects(first_dir, "bottom.cc")
+    entries = [d for d in glob.glob(str(tmp_path / "cache" / "artifacts" / "*")) if os.path.isdir(d)]
+    assert len(entries) == 1
+    assert os.path.isfile(os.path.join(entries[0], "build", "libbottom.a"))
+    assert os.path.isfile(os.path.join(entries[0], "src", "bottom.h"))
+
+    second_dir = make_project(tmp_path, "second")
+    result = run_pls(second_dir, "--prebuilt-deps", "run")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert result.stdout.endswith("43\n")
+    assert not built_objects(second_dir, "bottom.cc")
+    assert built_objects(second_dir, "top.cc")
+    assert "Has 1 prebuilt dependencies" in run_pls(second_dir, "cache").stdout
+
+
+def test_evicted_or_changed_prebuilt_dependency_is_built(tmp_path_with_deps):
+    tmp_path = tmp_path_with_deps
+    assert run_pls(make_project(tmp_path, "first"), "--prebuilt-deps", "build").returncode == 0
+    project_dir = make_project(tmp_path, "second")
+    assert run_pls(project_dir, "--prebuilt-deps", "build").returncode == 0
+    assert not built_objects(project_dir, "bottom.cc")
+    result = run_pls(project_dir, "cache", "gc", "--max-size", "1")
+    assert "and 1 prebuilt dependencies" in result.stdout
+    result = run_pls(project_dir, "--prebuilt-deps", "run")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert result.stdout.endswith("43\n")
+    assert built_objects(project_dir, "bottom.cc")
+    # Built from source, and stored again.
+    assert "Has 1 prebuilt dependencies" in run_pls(project_dir, "cache").stdout
+
+    # The checkout of the dependency changed locally is not what was prebuilt.
+    assert run_pls(project_dir, "clean", "--build-only").returncode == 0
+    assert run_pls(project_dir, "--prebuilt-deps", "build").returncode == 0
+    assert not built_objects(project_dir, "bottom.cc")
+    bottom_cc = project_dir / ".pls" / "deps" / "bottom" / "bottom.cc"
+    bottom_cc.write_text(bottom_cc.read_text().replace("42", "100"))
+    result = run_pls(project_dir, "--prebuilt-deps", "run")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert result.stdout.endswith("101\n")
+
+
+def test_profile_guided_builds_do_not_use_or_store_prebuilt_dependencies(tmp_path_with_deps):
+    tmp_path = tmp_path_with_deps
+    project_dir = make_project(tmp_path, "project")
+    result = run_pls(project_dir, "--prebuilt-deps", "pgo", "main")
+    assert result.returncode == 0, result.stdout + result.stderr
+    for build_dir in [".pgo_instrumented", ".release_pgo"]:
+        assert glob.glob(str(project_dir / build_dir / "**" / "bottom.cc.o"), recursive=True)
+    assert not glob.glob(str(tmp_path / "cache" / "artifacts" / "*"))
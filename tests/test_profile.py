@@ -0,0 +1,50 @@
+import json
+import shutil
+
+import pytest
+
+import pls.cmd
+from conftest import commit_files, run_pls
+
+
+def test_merge_ninja_log_spreads_overlapping_jobs(tmp_path, monkeypatch):
+    ninja_log = tmp_path / ".ninja_log"
+    old_entries = "# ninja log v5\n0\t10\t0\told.o\tabc\n"
+    ninja_log.write_text(
+        old_entries + "0\t100\t0\ta/impl/CMakeFiles/a.dir/a.cc.o\th1\n50\t80\t0\tCMakeFiles/m.dir/m.cc.o\th2\n"
+        "100\t120\t0\tm\th3\n"
+    )
+    monkeypatch.setattr(pls.cmd.flags, "profile", str(tmp_path / "trace.json"))
+    monkeypatch.setattr(pls.cmd, "trace_events", [])
+    pls.cmd.merge_ninja_log(str(ninja_log), len(old_entries), 1000.0, "debug")
+    events = {e["name"]: e for e in pls.cmd.trace_events if e["ph"] == "X"}
+    assert sorted(events) == ["a.cc.o", "m", "m.cc.o"]
+    assert events["a.cc.o"]["ts"] == 1000.0 and events["a.cc.o"]["dur"] == 100000
+    assert events["a.cc.o"]["args"]["dependency"] == "a"
+    assert events["m.cc.o"]["args"]["dependency"] is None
+    # The overlapping jobs are on different "threads", and the one after them reuses the first one.
+    assert events["a.cc.o"]["tid"] != events["m.cc.o"]["tid"]
+    assert events["m"]["tid"] == events["a.cc.o"]["tid"]
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="Needs `git`.")
+def test_profile_records_the_phases_and_the_dependencies(tmp_path, project_dir):
+    commit_files(
+        tmp_path / "github" / "dkorolev" / "lib", {"CMakeLists.txt": "\n", "lib.cc": "int lib() { return 42; }\n"}
+    )
+    (project_dir / "pls.json").write_text('{"import": {"lib": "https://github.com/dkorolev/lib"}}')
+    (project_dir / "main.cc").write_text("int main() {}\n")
+
+    result = run_pls(project_dir, "--profile=trace.json", "install")
+    assert result.returncode == 0, result.stdout + result.stderr
+    with open(project_dir / "trace.json") as file:
+        events = [e for e in json.loads(file.read())["traceEvents"] if e["ph"] == "X"]
+    names = {(e["cat"], e["name"]) for e in events}
+    assert {("pls", "pls install"), ("phase", "traverse_source_tree"), ("clone", "lib"), ("scan", "lib.cc")} <= names
+    assert any(e["cat"] == "git" and e["args"]["exit_code"] == 0 for e in events)
+
+    result = run_pls(project_dir, "profile", "summary")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "PLS: `pls install` took" in result.stdout
+    assert "PLS: The slowest dependencies:" in result.stdout
+    assert "lib (clone" in result.stdout
@@ -0,0 +1,71 @@
+import shutil
+
+import pytest
+
+import pls.cmd as pls_cmd
+
+requires_gcc = pytest.mark.skipif(shutil.which("g++") is None, reason="Needs `g++`.")
+
+
+@pytest.fixture(params=["native", "preprocessor"])
+def project(request, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(pls_cmd, "scan_cache", None)
+    monkeypatch.setattr(pls_cmd.flags, "no_cache", False)
+    monkeypatch.setattr(pls_cmd.flags, "no_native_scan", request.param == "preprocessor")
+    pls_cmd.install_dotpls_files()
+    runs = []
+
+    def counting(scan):
+        def counting_scan(*args, **kwargs):
+            runs.append(args[0])
+            return scan(*args, **kwargs)
+
+        return counting_scan
+
+    monkeypatch.setattr(pls_cmd, "scan_source_natively", counting(pls_cmd.scan_source_natively))
+    monkeypatch.setattr(pls_cmd, "scan_source_with_preprocessor", counting(pls_cmd.scan_source_with_preprocessor))
+    return tmp_path, runs
+
+
+def write(path, contents):
+    with open(path, "w") as file:
+        file.write(contents)
+
+
+@requires_gcc
+def test_unchanged_source_is_not_rescanned(project):
+    tmp_path, runs = project
+    write("a.cc", '#include "pls.h"\nPLS_IMPORT("lib", "https://github.com/x/lib")\nint main() {}\n')
+    expected = [{"pls_import": {"lib": "lib", "repo": "https://github.com/x/lib"}}]
+    assert pls_cmd.instrument_source_file("a.cc") == expected
+    assert pls_cmd.instrument_source_file("a.cc") == expected
+    assert len(runs) == 1
+    pls_cmd.save_scan_cache()
+    pls_cmd.scan_cache = None
+    assert pls_cmd.instrument_source_file("a.cc") == expected
+    assert len(runs) == 1
+
+
+@requires_gcc
+def test_header_changes_invalidate_the_cache(project):
+    tmp_path, runs = project
+    write("a.cc", '#include "pls.h"\n#include "a.h"\nint main() {}\n')
+    write("a.h", "\n")
+    assert pls_cmd.instrument_source_file("a.cc") == []
+    write("a.h", 'PLS_PROJECT("renamed")\n')
+    assert pls_cmd.instrument_source_file("a.cc") == [{"pls_project": "renamed"}]
+    assert len(runs) == 2
+
+
+@requires_gcc
+def test_missing_header_appearing_invalidates_the_cache(project):
+    tmp_path, runs = project
+    write("a.cc", '#include "pls.h"\n#include "dep.h"\nPLS_PROJECT("after")\nint main() {}\n')
+    assert pls_cmd.instrument_source_file("a.cc") == []
+    scans = len(runs)
+    assert pls_cmd.instrument_source_file("a.cc") == []
+    assert len(runs) == scans
+    write("dep.h", "\n")
+    assert pls_cmd.instrument_source_file("a.cc") == [{"pls_project": "after"}]
+    assert len(runs) > scans
@@ -0,0 +1,81 @@
+import json
+import shutil
+import xml.etree.ElementTree
+
+import pytest
+
+from conftest import run_pls
+from pls.cmd import junit_xml
+
+# Exits with the code from `argv[1]`, or, if `argv[2]` is a file that does not exist yet, creates it and fails.
+TEST_CC = """#include <cstdio>
+#include <cstdlib>
+#include <unistd.h>
+int main(int argc, char** argv) {
+  if (argc > 2 && access(argv[2], F_OK) != 0) { std::fclose(std::fopen(argv[2], "w")); return 1; }
+  std::printf("Ran %s.\\n", argv[0]);
+  return argc > 1 ? atoi(argv[1]) : 0;
+}
+"""
+
+
+@pytest.fixture
+def project_dir(project_dir):
+    for name in ["test_one", "test_two", "test_sleep", "checker", "main"]:
+        (project_dir / f"{name}.cc").write_text(TEST_CC)
+    (project_dir / "test_sleep.cc").write_text("#include <unistd.h>\nint main() { sleep(30); }\n")
+    (project_dir / "pls.json").write_text('{"test": ["checker"]}')
+    return project_dir
+
+
+def test_junit_xml():
+    attempt = {"outcome": "failed", "exit_code": 2, "duration": 0.5, "output": "Oops.\n"}
+    results = {
+        "test_a": {"outcome": "failed", "duration": 0.5, "attempts": [attempt], "flaky": False},
+        "test_b": {
+            "outcome": "timeout",
+            "duration": 1,
+            "attempts": [{**attempt, "outcome": "timeout"}],
+            "flaky": False,
+        },
+    }
+    testsuite = xml.etree.ElementTree.fromstring(junit_xml(results)).find("testsuite")
+    assert (
+        testsuite.attrib["tests"] == "2" and testsuite.attrib["failures"] == "1" and testsuite.attrib["errors"] == "1"
+    )
+    assert testsuite.find("testcase[@name='test_a']/failure").text == "Oops.\n"
+    assert testsuite.find("testcase[@name='test_b']/error") is not None
+
+
+@pytest.mark.skipif(shutil.which("cmake") is None or shutil.which("g++") is None, reason="Needs `cmake`.")
+def test_runs_the_tests_with_timeouts_and_reports(project_dir):
+    result = run_pls(project_dir, "test", "--timeout", "0.5", "--junit", "junit.xml", "--json", "results.json")
+    assert result.returncode == 1
+    assert "PLS: `test_sleep` timed out after 500.00ms." in result.stdout
+    assert "PLS: 3 of 4 tests passed. Failed: `test_sleep`." in result.stdout
+    results = json.loads((project_dir / "results.json").read_text())["tests"]
+    assert sorted(results.keys()) == ["checker", "test_one", "test_sleep", "test_two"]
+    assert results["test_one"]["outcome"] == "passed" and results["test_sleep"]["outcome"] == "timeout"
+    testsuite = xml.etree.ElementTree.parse(project_dir / "junit.xml").getroot().find("testsuite")
+    assert testsuite.attrib["tests"] == "4" and testsuite.attrib["errors"] == "1"
+    # The slowest test, which has timed out, starts first the next time.
+    result = run_pls(project_dir, "test", "--timeout", "0.5")
+    assert result.stdout.split("PLS: `")[1].startswith("test_sleep`")
+
+
+@pytest.mark.skipif(shutil.which("cmake") is None or shutil.which("g++") is None, reason="Needs `cmake`.")
+def test_shards_retries_and_args(project_dir):
+    (project_dir / "test_sleep.cc").unlink()
+    assert run_pls(project_dir, "test", "--shard", "3/2").returncode == 1
+    shards = [run_pls(project_dir, "test", "--shard", f"{i}/2") for i in [1, 2]]
+    assert all(result.returncode == 0 for result in shards), [result.stdout for result in shards]
+    assert "PLS: `checker` passed" in shards[0].stdout and "PLS: `test_two` passed" in shards[0].stdout
+    assert "PLS: `test_one` passed" in shards[1].stdout and "PLS: 1 of 1 tests passed." in shards[1].stdout
+    result = run_pls(project_dir, "test", "test_one", "--", "5")
+    assert result.returncode == 1
+    assert "PLS: `test_one` failed with code 5" in result.stdout and "Ran " in result.stdout
+    flag_file = str(project_dir / "flag")
+    result = run_pls(project_dir, "test", "test_one", "--retries", "2", "--", "0", flag_file)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "PLS: 1 of 1 tests passed, 1 of them flaky." in result.stdout
+    assert "flaky, after 2 attempts." in result.stdout
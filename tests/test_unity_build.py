@@ -0,0 +1,65 @@
+import glob
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from conftest import commit_files, run_pls
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("cmake") is None or shutil.which("g++") is None or shutil.which("git") is None, reason="Needs `cmake`."
+)
+
+
+@pytest.fixture
+def project_dir(tmp_path, project_dir):
+    # The dependency has two sources that do not compile as one translation unit.
+    cmakelists_txt = (
+        "cmake_minimum_required(VERSION 3.14.1)\nproject(ulib CXX)\nadd_library(ulib a.cc b.cc c.cc)\n"
+        "target_include_directories(ulib PUBLIC .)\n"
+    )
+    commit_files(
+        tmp_path / "github" / "dkorolev" / "ulib",
+        {
+            "CMakeLists.txt": cmakelists_txt,
+            "a.cc": "static int helper() { return 1; }\nint a() { return helper(); }\n",
+            "b.cc": "static int helper() { return 2; }\nint b() { return helper(); }\n",
+            "c.cc": "int c() { return 3; }\n",
+            "ulib.h": "int a();\nint b();\nint c();\n",
+        },
+    )
+    (project_dir / "main.cc").write_text(
+        '#include "pls.h"\nPLS_IMPORT("ulib", "https://github.com/dkorolev/ulib");\n#include "ulib.h"\n'
+        '#include <cstdio>\nint main() { printf("%d\\n", a() + b() + c()); }\n'
+    )
+    return project_dir
+
+
+def unity_sources(project_dir):
+    sources = []
+    for unity_file in glob.glob(str(project_dir / ".debug" / "**" / "unity_*.cxx"), recursive=True):
+        with open(unity_file) as file:
+            sources += [os.path.basename(line.split('"')[1]) for line in file if line.startswith("#include")]
+    return sorted(sources)
+
+
+def test_unity_build_with_the_opted_out_sources(project_dir):
+    (project_dir / "pls.json").write_text('{"unity": {"batch_size": 4, "exclude": ["ulib/b.cc"]}}')
+    result = run_pls(project_dir, "build")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert unity_sources(project_dir) == ["a.cc", "c.cc", "main.cc"]
+    assert subprocess.run([project_dir / ".debug" / "main"], capture_output=True, text=True).stdout == "6\n"
+
+
+def test_unity_build_can_be_turned_off(project_dir):
+    (project_dir / "pls.json").write_text('{"unity": {"exclude": ["ulib"]}}')
+    assert run_pls(project_dir, "build").returncode == 0
+    assert "CMAKE_UNITY_BUILD:UNINITIALIZED=ON" in (project_dir / ".debug" / "CMakeCache.txt").read_text()
+    (project_dir / "pls.json").unlink()
+    result = run_pls(project_dir, "build")
+    assert result.returncode == 0, result.stdout + result.stderr
+    cmake_cache_txt = (project_dir / ".debug" / "CMakeCache.txt").read_text()
+    assert "CMAKE_UNITY_BUILD:UNINITIALIZED=OFF" in cmake_cache_txt
+    assert "CMAKE_PROJECT_INCLUDE" not in cmake_cache_txt
+    assert run_pls(project_dir, "--unity", "build").returncode != 0
@@ -0,0 +1,115 @@
+import json
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import pls.cmd
+from conftest import PLS_CMD_PY
+
+WATCHERS = [pls.cmd.PollingWatcher]
+if sys.platform.startswith("linux"):
+    WATCHERS.append(pls.cmd.InotifyWatcher)
+
+
+@pytest.mark.parametrize("watcher_class", WATCHERS)
+def test_watcher_reports_the_changed_sources_only(tmp_path, watcher_class):
+    (tmp_path / "main.cc").write_text("int main() {}\n")
+    watcher = watcher_class()
+    watcher.set_dirs({str(tmp_path)})
+    assert watcher.wait(0.3) == set()
+    (tmp_path / "main.cc.swp").write_text("")
+    (tmp_path / "notes.txt").write_text("")
+    assert watcher.wait(0.3) == set()
+    (tmp_path / "main.cc").write_text("int main() { return 0; }\n")
+    (tmp_path / "lib.h").write_text("\n")
+    changes = watcher.wait(1)
+    changes |= watcher.wait(0.3)
+    assert changes == {str(tmp_path / "main.cc"), str(tmp_path / "lib.h")}
+
+
+def read_lines_until(lines, expected, timeout=60):
+    seen = []
+    while True:
+        line = lines.get(timeout=timeout)
+        seen.append(line)
+        if line.strip() == expected:
+            return seen
+
+
+def start_watching(tmp_path, project_dir):
+    # Returns the process, and the queue of the lines it outputs.
+    env = {**os.environ, "PLS_CACHE_DIR": str(tmp_path / "cache")}
+    process = subprocess.Popen(
+        [sys.executable, "-u", PLS_CMD_PY, "--verbose", "watch", "--run", "main"],
+        cwd=project_dir,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    lines = queue.Queue()
+    threading.Thread(target=lambda: [lines.put(line) for line in process.stdout], daemon=True).start()
+    return process, lines
+
+
+@pytest.mark.skipif(shutil.which("cmake") is None or shutil.which("g++") is None, reason="Needs `cmake`.")
+def test_watch_rebuilds_and_reruns_on_changes(tmp_path, project_dir):
+    (project_dir / "main.cc").write_text('#include <cstdio>\nint main() { printf("one\\n"); }\n')
+    process, lines = start_watching(tmp_path, project_dir)
+    try:
+        read_lines_until(lines, "one")
+        read_lines_until(lines, "PLS: Watching for changes, press Ctrl+C to stop.")
+        (project_dir / "main.cc").write_text('#include <cstdio>\nint main() { printf("two\\n"); }\n')
+        output = read_lines_until(lines, "two")
+        assert "PLS: Changed `main.cc`.\n" in output
+        assert "PLS: Nothing to reconfigure, will just build.\n" in output
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait(timeout=30)
+
+
+@pytest.mark.parametrize("watcher_class", WATCHERS)
+def test_watcher_reports_the_new_and_removed_subdirs(tmp_path, watcher_class):
+    (tmp_path / "main.cc").write_text("int main() {}\n")
+    watcher = watcher_class()
+    watcher.set_dirs({str(tmp_path)})
+    (tmp_path / ".hidden").mkdir()
+    assert watcher.wait(0.3) == set()
+    (tmp_path / "lib").mkdir()
+    changes = watcher.wait(1)
+    changes |= watcher.wait(0.3)
+    assert changes == {str(tmp_path / "lib")}
+    (tmp_path / "lib" / "lib.h").write_text("\n")
+    assert watcher.wait(0.3) == set()
+    (tmp_path / "lib" / "lib.h").unlink()
+    (tmp_path / "lib").rmdir()
+    changes = watcher.wait(1)
+    changes |= watcher.wait(0.3)
+    assert changes == {str(tmp_path / "lib")}
+
+
+@pytest.mark.skipif(shutil.which("cmake") is None or shutil.which("g++") is None, reason="Needs `cmake`.")
+def test_watch_keeps_the_manifest_when_terminated(tmp_path, project_dir):
+    (project_dir / "main.cc").write_text("int main() {}\n")
+    process, lines = start_watching(tmp_path, project_dir)
+    try:
+        read_lines_until(lines, "PLS: Watching for changes, press Ctrl+C to stop.")
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    manifest = json.loads((project_dir / ".pls" / "manifest.json").read_text())
+    assert manifest["artifacts"][".debug"] == "build_dir"
+
+
+def test_held_cache_locks_are_released(tmp_path):
+    lock = pls.cmd.CacheLock(str(tmp_path / "entry"), shared=True)
+    assert lock.__enter__()
+    pls.cmd.held_cache_locks.append(lock)
+    pls.cmd.release_held_cache_locks()
+    assert pls.cmd.held_cache_locks == [] and lock.file.closed